@@ -1,100 +1,147 @@
 """
 Real AI Service Integration for Production
 """
-import openai
-from typing import Dict, Any, List
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
 import os
 from datetime import datetime
 import json
 
+from utils.metrics import INTENT_BATCH_SIZE, PROMPT_TOKENS, PROMPT_HISTORY_DROPPED
+
+from .intent_batcher import IntentBatcher
+from .llm_scheduler import DeadlineExceeded, LLMScheduler, priority_for
+from .pricing import format_rate, get_rate_card_store
+from .prompt_builder import INTENT_PROMPT, RESPONSE_PROMPT, build_intent_batch, parse_intent_batch
+
+# Deterministic replies used when generate_response misses its deadline
+FALLBACK_RESPONSES = {
+    "greeting": "Hello! I'm Sanhith from Tata Capital. Are you looking for a personal loan today?",
+    "rate_query": "{greeting}our personal loan rates start at {lowest_rate} per annum and depend mainly on your credit score. Shall I check the rate you qualify for?",
+    "document_query": "{greeting}for most loans you only need your Aadhaar and PAN card. A salary slip may be needed for larger amounts.",
+    "loan_inquiry": "{greeting}I'd be happy to help you with a personal loan. How much would you like to borrow?",
+    "default": "I apologize, but I'm experiencing some technical difficulties. Let me help you with your loan inquiry in a moment.",
+}
+
 class AIService:
-    def __init__(self):
-        # Initialize OpenAI client
-        openai.api_key = os.getenv("OPENAI_API_KEY")
+    def __init__(self, complete: Optional[Callable[..., Awaitable[str]]] = None,
+                 intent_batch_size: Optional[int] = None, intent_batch_window_ms: Optional[float] = None,
+                 scheduler: Optional[LLMScheduler] = None):
+        self.api_key = os.getenv("OPENAI_API_KEY")
         self.model = "gpt-4"  # or "gpt-3.5-turbo" for cost optimization
+        self._openai = None
+        # Chat completion function returning the reply text; defaults to OpenAI
+        self._complete = complete or self._openai_complete
+        # Global concurrency limit, priorities and deadlines for every LLM call
+        self.scheduler = scheduler or LLMScheduler.from_env()
+        
+        # Intent calls from all sessions are micro-batched unless the window is 0
+        if intent_batch_size is None:
+            intent_batch_size = int(os.getenv("INTENT_BATCH_SIZE", "32"))
+        if intent_batch_window_ms is None:
+            intent_batch_window_ms = float(os.getenv("INTENT_BATCH_WINDOW_MS", "5"))
+        self.intent_batcher = None
+        if intent_batch_window_ms > 0 and intent_batch_size > 1:
+            self.intent_batcher = IntentBatcher(
+                self.analyze_intents, intent_batch_size, intent_batch_window_ms,
+                on_batch=INTENT_BATCH_SIZE.observe
+            )
+    
+    @property
+    def openai(self):
+        """OpenAI client, imported and configured on first use to keep worker boot fast"""
+        if self._openai is None:
+            import openai
+            openai.api_key = self.api_key
+            if os.getenv("OPENAI_API_BASE"):
+                # e.g. the local stub in mock_services/llm_stub.py
+                openai.api_base = os.getenv("OPENAI_API_BASE")
+            self._openai = openai
+        return self._openai
+    
+    async def _openai_complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> str:
+        response = await self.openai.ChatCompletion.acreate(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        return response.choices[0].message.content
+    
+    async def _scheduled_complete(self, priority: int, label: str, messages: List[Dict[str, str]],
+                                  max_tokens: int, temperature: float) -> str:
+        """Complete through the scheduler; raises DeadlineExceeded when the reply would be too late"""
+        return await self.scheduler.run(
+            priority, lambda: self._complete(messages, max_tokens=max_tokens, temperature=temperature), label
+        )
         
     async def analyze_intent(self, message: str, context: Dict[str, Any]) -> str:
         """
         Real intent analysis using GPT-4
         """
-        system_prompt = """
-        You are an expert intent classifier for a loan application system.
-        Analyze the user's message and return one of these intents:
-        - greeting: User is saying hello or starting conversation
-        - loan_inquiry: User wants to apply for a loan
-        - amount_query: User is specifying loan amount
-        - tenure_query: User is specifying loan tenure
-        - document_query: User asking about required documents
-        - rate_query: User asking about interest rates
-        - objection: User has concerns or objections
-        - confirmation: User is confirming or agreeing
-        - rejection: User is declining or not interested
+        if self.intent_batcher is not None:
+            try:
+                return await self.intent_batcher.classify(message, context)
+            except Exception as e:
+                return self._fallback_intent_analysis(message)
         
-        Return only the intent name, nothing else.
-        """
+        messages, prompt_tokens, _ = INTENT_PROMPT.build(message, context)
+        PROMPT_TOKENS.labels(call="analyze_intent").observe(prompt_tokens)
         
         try:
-            response = await openai.ChatCompletion.acreate(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Message: {message}\nContext: {json.dumps(context)}"}
-                ],
-                max_tokens=50,
-                temperature=0.1
-            )
-            
-            return response.choices[0].message.content.strip().lower()
+            reply = await self._scheduled_complete(priority_for(context), "analyze_intent", messages,
+                                                   max_tokens=50, temperature=0.1)
+            return reply.strip().lower()
         except Exception as e:
             # Fallback to rule-based intent detection
             return self._fallback_intent_analysis(message)
     
-    async def generate_response(self, intent: str, user_message: str, context: Dict[str, Any]) -> str:
+    async def analyze_intents(self, requests: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
         """
-        Generate contextual responses using GPT-4
+        Classify several (message, context) pairs with a single LLM call
         """
-        user_name = context.get('name', 'there')
-        conversation_history = context.get('conversation_history', [])
+        messages, prompt_tokens = build_intent_batch(requests)
+        PROMPT_TOKENS.labels(call="analyze_intents").observe(prompt_tokens)
         
-        system_prompt = f"""
-        You are Sanhith, a professional loan advisor at Tata Capital. You are helpful, friendly, and knowledgeable about personal loans.
+        # The batch goes at the priority of its most urgent member
+        priority = min(priority_for(context) for _, context in requests)
         
-        Current context:
-        - User name: {user_name}
-        - Conversation stage: {context.get('conversation_state', 'greeting')}
-        - Intent: {intent}
+        try:
+            reply = await self._scheduled_complete(priority, "analyze_intents", messages,
+                                                   max_tokens=8 * len(requests), temperature=0.1)
+            intents = parse_intent_batch(reply, len(requests))
+        except Exception as e:
+            intents = [None] * len(requests)
         
-        Guidelines:
-        - Be conversational and human-like
-        - Use the user's name when appropriate
-        - Provide specific loan information when asked
-        - Keep responses concise but informative
-        - Always maintain a professional yet friendly tone
-        - If discussing loan terms, mention Tata Capital's competitive rates
+        # Anything the model skipped falls back to the rules
+        return [intent or self._fallback_intent_analysis(message)
+                for intent, (message, _) in zip(intents, requests)]
+    
+    async def generate_response(self, intent: str, user_message: str, context: Dict[str, Any]) -> str:
         """
-        
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add conversation history for context
-        for msg in conversation_history[-5:]:  # Last 5 messages for context
-            messages.append({
-                "role": "user" if msg['sender'] == 'user' else "assistant",
-                "content": msg['content']
-            })
-        
-        messages.append({"role": "user", "content": user_message})
+        Generate contextual responses using GPT-4
+        """
+        messages, prompt_tokens, dropped = RESPONSE_PROMPT.build(
+            user_message, dict(context, intent=intent), context.get('conversation_history', [])
+        )
+        PROMPT_TOKENS.labels(call="generate_response").observe(prompt_tokens)
+        if dropped:
+            PROMPT_HISTORY_DROPPED.labels(call="generate_response").inc(dropped)
         
         try:
-            response = await openai.ChatCompletion.acreate(
-                model=self.model,
-                messages=messages,
-                max_tokens=300,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content.strip()
+            reply = await self._scheduled_complete(priority_for(context), "generate_response", messages,
+                                                   max_tokens=300, temperature=0.7)
+            return reply.strip()
+        except DeadlineExceeded:
+            return self._fallback_response(intent, context)
         except Exception as e:
-            return f"I apologize, but I'm experiencing some technical difficulties. Let me help you with your loan inquiry in a moment."
+            return FALLBACK_RESPONSES["default"]
+    
+    def _fallback_response(self, intent: str, context: Dict[str, Any]) -> str:
+        """Template reply for when the LLM cannot answer in time"""
+        template = FALLBACK_RESPONSES.get(intent, FALLBACK_RESPONSES["default"])
+        name = context.get("name")
+        lowest_rate, _ = get_rate_card_store().current().rate_range()
+        return template.format(greeting=f"{name}, " if name else "", lowest_rate=format_rate(lowest_rate))
     
     def _fallback_intent_analysis(self, message: str) -> str:
         """Fallback rule-based intent analysis"""
@@ -119,5 +166,19 @@ class AIService:
         else:
             return "general_query"
 
-# Usage in agents
-ai_service = AIService()
\ No newline at end of file
+# Usage in agents: the shared instance is created lazily on first access
+_ai_service: Optional[AIService] = None
+
+def get_ai_service() -> AIService:
+    """Get the process-wide AIService, creating it on first use"""
+    global _ai_service
+    if _ai_service is None:
+        _ai_service = AIService()
+    return _ai_service
+
+def __getattr__(name: str):
+    # Keeps `from agents.ai_service import ai_service` working without
+    # building the service (and importing openai) at module import time
+    if name == "ai_service":
+        return get_ai_service()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,82 @@
+"""
+Cross-session micro-batching of intent classification.
+
+Intent prompts are tiny, so at peak most of the cost of a call is per-request
+overhead rather than tokens. The batcher holds classification requests from
+all sessions for a few milliseconds (or until the batch is full), sends them
+as one request and resolves each caller's future with its own result.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IntentRequest = Tuple[str, Dict[str, Any]]
+
+
+class IntentBatcher:
+    def __init__(self, classify_batch: Callable[[List[IntentRequest]], Awaitable[List[str]]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 on_batch: Optional[Callable[[int], None]] = None):
+        self.classify_batch = classify_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # Called with the size of every batch that is sent, e.g. to record a metric
+        self.on_batch = on_batch
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: List[Tuple[IntentRequest, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+
+    async def classify(self, message: str, context: Dict[str, Any]) -> str:
+        """Queue one message for the next batch and wait for its intent"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Pending requests belong to a previous (closed) event loop
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+
+        future = loop.create_future()
+        self._pending.append(((message, context), future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = self._loop.create_task(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[IntentRequest, asyncio.Future]]):
+        if self.on_batch:
+            self.on_batch(len(batch))
+        try:
+            intents = await self.classify_batch([request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if len(intents) != len(batch):
+            logger.warning("Intent batch of %d returned %d results", len(batch), len(intents))
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue  # Caller was cancelled
+            if i < len(intents):
+                future.set_result(intents[i])
+            else:
+                future.set_exception(LookupError("No intent returned for batched message"))
@@ -0,0 +1,143 @@
+"""
+Priority-aware concurrency scheduler in front of the LLM client.
+
+At most ``max_concurrency`` LLM calls run at once. Waiting calls are ordered
+by priority class (derived from the conversation state, so users in
+verification or sanction go before greeting chit-chat) and then by deadline.
+A call that cannot start or finish before its deadline raises
+DeadlineExceeded so the caller can answer with its deterministic fallback
+instead of keeping the user waiting.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from utils.metrics import LLM_DEADLINE_FALLBACKS, LLM_QUEUE_WAIT
+
+T = TypeVar("T")
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+PRIORITY_BY_STATE = {
+    "verification": HIGH,
+    "underwriting": HIGH,
+    "sanction": HIGH,
+    "sales": NORMAL,
+    "greeting": LOW,
+    "collecting_name": LOW,
+}
+
+# How long each class may take, queueing included, before falling back
+DEFAULT_DEADLINES_MS = {HIGH: 4000, NORMAL: 6000, LOW: 2500}
+
+
+class DeadlineExceeded(Exception):
+    """The LLM call could not complete before its deadline"""
+
+
+def priority_for(context: Dict[str, Any]) -> int:
+    return PRIORITY_BY_STATE.get(context.get("conversation_state"), LOW)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = 16, deadlines_ms: Optional[Dict[int, float]] = None):
+        self.max_concurrency = max_concurrency
+        self.deadlines_ms = {**DEFAULT_DEADLINES_MS, **(deadlines_ms or {})}
+        self.running = 0
+        # (priority, deadline, seq, future); seq keeps FIFO order on ties
+        self._queue: List[Tuple[int, float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Moving average of call duration, used to predict queueing delay
+        self.avg_call_seconds: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        return cls(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+            deadlines_ms={
+                priority: float(os.getenv(f"LLM_DEADLINE_MS_{name.upper()}", DEFAULT_DEADLINES_MS[priority]))
+                for priority, name in PRIORITY_NAMES.items()
+            }
+        )
+
+    async def run(self, priority: int, call: Callable[[], Awaitable[T]], label: str = "llm",
+                  deadline_ms: Optional[float] = None) -> T:
+        """Run ``call`` once a slot is free, or raise DeadlineExceeded"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Slots and waiters belong to a previous (closed) event loop
+            self._loop = loop
+            self.running = 0
+            self._queue = []
+
+        start = loop.time()
+        deadline = start + (deadline_ms if deadline_ms is not None else self.deadlines_ms[priority]) / 1000
+        priority_name = PRIORITY_NAMES[priority]
+
+        try:
+            await self._acquire(priority, deadline)
+        except DeadlineExceeded:
+            LLM_DEADLINE_FALLBACKS.labels(priority=priority_name, call=label).inc()
+            raise
+        LLM_QUEUE_WAIT.labels(priority=priority_name).observe(loop.time() - start)
+
+        started = loop.time()
+        try:
+            return await asyncio.wait_for(call(), timeout=max(deadline - started, 0))
+        except asyncio.TimeoutError:
+            LLM_DEADLINE_FALLBACKS.labels(priority=priority_name, call=label).inc()
+            raise DeadlineExceeded(f"{label} did not finish within its deadline")
+        finally:
+            elapsed = loop.time() - started
+            if self.avg_call_seconds is None:
+                self.avg_call_seconds = elapsed
+            else:
+                self.avg_call_seconds += 0.1 * (elapsed - self.avg_call_seconds)
+            self._release()
+
+    async def _acquire(self, priority: int, deadline: float):
+        loop = self._loop
+        if self.running < self.max_concurrency:
+            # Slots are handed to waiters as soon as they free up, so anything
+            # still queued while a slot is free has already expired
+            self._queue.clear()
+            self.running += 1
+            return
+
+        if self.avg_call_seconds is not None:
+            # Callers ahead of us drain at roughly max_concurrency per average call
+            ahead = sum(1 for p, d, _, future in self._queue
+                        if (p, d) <= (priority, deadline) and not future.done())
+            predicted_finish = loop.time() + (ahead // self.max_concurrency + 2) * self.avg_call_seconds
+            if predicted_finish > deadline:
+                raise DeadlineExceeded("LLM queue is too long to meet the deadline")
+
+        future = loop.create_future()
+        heapq.heappush(self._queue, (priority, deadline, next(self._seq), future))
+        timer = loop.call_at(deadline, self._expire, future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as we were cancelled: hand it on
+                self._release()
+            raise
+        finally:
+            timer.cancel()
+
+    def _expire(self, future: asyncio.Future):
+        if not future.done():
+            future.set_exception(DeadlineExceeded("Deadline passed while waiting for an LLM slot"))
+
+    def _release(self):
+        self.running -= 1
+        while self._queue:
+            _, _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+                return
@@ -1,41 +1,77 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Callable, Optional
 from datetime import datetime
 import json
+import os
+import random
+
+from mock_services.adapters import as_crm_adapter, as_bureau_adapter
+from utils.funnel import get_funnel
+from utils.tracing import tracer, traced
 
 from .sales_agent import SalesAgent
 from .verification_agent import VerificationAgent
 from .underwriting_agent import UnderwritingAgent
 from .sanction_letter_agent import SanctionLetterAgent
+from .prefetch import CustomerPrefetch
+from .pricing import format_rate, get_rate_card_store
+from .session_state import SessionState
+from .state_machine import ANY_EVENT, ANY_STATE, Transition, TransitionTable
+
+# Prompts the worker agents send without suggestions get these, by the step in their metadata
+STEP_SUGGESTIONS = {
+    "tenure": ("1 year", "2 years", "3 years", "5 years"),
+    "purpose": ("Home renovation", "Wedding", "Medical emergency", "Education", "Business", "Travel"),
+    "phone": ("9876543210 (Demo - Instant Approval)", "9876543211 (Demo - Salary Required)", "9876543212 (Demo - Rejection)"),
+    "kyc_confirmation": ("Yes, correct", "No, update details", "Looks good"),
+}
 
 class MasterAgent:
-    def __init__(self, session_id: str, crm_service, credit_service, session_manager):
-        self.session_id = session_id
+    """Routes turns between the worker agents; one instance serves every session it is handed the state of"""
+    
+    def __init__(self, crm_service, credit_service, session_manager,
+                 prefetch: Optional[bool] = None, rng: Optional[random.Random] = None,
+                 clock: Optional[Callable[[], datetime]] = None, jobs=None):
         self.crm_service = crm_service
         self.credit_service = credit_service
         self.session_manager = session_manager
         
-        # Initialize worker agents
-        self.sales_agent = SalesAgent()
-        self.verification_agent = VerificationAgent(crm_service)
-        self.underwriting_agent = UnderwritingAgent(credit_service)
-        self.sanction_letter_agent = SanctionLetterAgent()
+        # Async views of the services, shared by the worker agents
+        self.crm = as_crm_adapter(crm_service)
+        self.bureau = as_bureau_adapter(credit_service)
         
-        # Conversation state
-        self.conversation_state = "greeting"
-        self.user_context = {}
+        # Every quote, from the first EMI to the sanction letter, is priced from one rate card
+        self.rate_cards = get_rate_card_store()
+        # Live conversion counts, fed as turns move sessions along
+        self.funnel = get_funnel()
         
-    async def start_conversation(self) -> Dict[str, Any]:
+        # Initialize worker agents
+        self.sales_agent = SalesAgent(rate_cards=self.rate_cards)
+        # rng and clock are only passed to make replays deterministic
+        self.clock = clock or datetime.now
+        self.verification_agent = VerificationAgent(self.crm, self.bureau, rng)
+        self.underwriting_agent = UnderwritingAgent(self.bureau, rate_cards=self.rate_cards)
+        self.sanction_letter_agent = SanctionLetterAgent(rng=rng, clock=clock, jobs=jobs, rate_cards=self.rate_cards)
+        
+        # Start CRM and bureau lookups as soon as the phone is captured
+        # (CUSTOMER_PREFETCH=0 looks them up when they are needed instead)
+        if prefetch is None:
+            prefetch = os.getenv("CUSTOMER_PREFETCH", "1") != "0"
+        self.prefetch_enabled = prefetch
+        
+    async def start_conversation(self, state: SessionState) -> Dict[str, Any]:
         """Initialize conversation with welcome message"""
-        self.conversation_state = "greeting"
+        state.conversation_state = "greeting"
+        state.stage_since = self.funnel.session_started()
         
-        welcome_message = """
+        lowest_rate = self._lowest_rate()
+        welcome_message = f"""
 👋 Hi there! I'm Sanhith, your personal loan advisor from Tata Capital.
 
 I'm here to help you get the loan you need - whether it's for your dream home renovation, that special wedding, or any other important goal in your life! 
 
 ✨ Here's what I can do for you today:
 • Get you instant approval (often in under 5 minutes!)
-• Offer competitive rates starting at just 10.99%
+• Offer competitive rates starting at just {lowest_rate}
 • Minimal paperwork - we keep it simple
 • Quick fund transfer to your account
 
@@ -52,124 +88,131 @@ So, are you looking to get a personal loan today? I'd love to help make it happe
             ]
         }
     
-    async def process_message(self, user_message: str) -> Dict[str, Any]:
-        """Main orchestration logic"""
+    async def process_message(self, state: SessionState, user_message: str) -> Dict[str, Any]:
+        """Handle one user turn of the session, traced as a single span"""
+        with tracer.span("master.process_message", session_id=state.session_id,
+                         state=state.conversation_state) as span:
+            previous_state = state.conversation_state
+            result = await self._route_message(state, user_message)
+            self._record_funnel(state, previous_state, result)
+            span.set_attribute("next_state", state.conversation_state)
+            return result
+    
+    async def _route_message(self, state: SessionState, user_message: str) -> Dict[str, Any]:
+        """Main orchestration logic: dispatch the turn through the transition table"""
         
         # Update conversation context
-        self.user_context["last_message"] = user_message
-        self.user_context["timestamp"] = datetime.now().isoformat()
-        
+        state.user_context["last_message"] = user_message
+        state.user_context["timestamp"] = self.clock().isoformat()
+        
+        event = await self._event(state, user_message)
+        transition = TRANSITIONS.lookup(state.conversation_state, event)
+        if transition is None:
+            return None  # Not a state of this flow
+        result = await transition.handler(self, state, user_message)
+        TRANSITIONS.record(transition, state.conversation_state)
+        
+        # Worker agents leave some prompts without suggestions; fill them in by step
+        if not result.get("suggestions"):
+            suggestions = STEP_SUGGESTIONS.get(result.get("metadata", {}).get("step"))
+            if suggestions:
+                result["suggestions"] = list(suggestions)
+        return result
+    
+    def _record_funnel(self, state: SessionState, previous_state: str, result: Optional[Dict[str, Any]]):
+        """Count the turn in the funnel if it moved the session on or rejected its application"""
+        metadata = (result.get("metadata") or {}) if isinstance(result, dict) else {}
+        reason = metadata.get("reason") if metadata.get("loan_rejected") else None
+        if state.conversation_state != previous_state or reason:
+            state.stage_since = self.funnel.transition(previous_state, state.conversation_state,
+                                                       state.stage_since, reason)
+    
+    async def _event(self, state: SessionState, user_message: str) -> str:
+        """What the turn means to the transition table"""
         # Handle greetings at any time
-        if self._is_greeting(user_message) and not self.user_context.get("name"):
-            return await self._handle_greeting()
-        
-        # Handle name collection after greeting
-        if self.conversation_state == "collecting_name":
-            return await self._collect_name(user_message)
-        
-        # Determine intent and route to appropriate agent
-        intent = await self._analyze_intent(user_message)
-        
-        if self.conversation_state == "greeting":
-            if intent in ["yes", "interested", "loan_inquiry"]:
-                self.conversation_state = "sales"
-                result = await self.sales_agent.start_sales_process()
-                # Don't override suggestions if they already exist
-                return result
-            elif intent == "rates":
-                return await self._explain_rates()
-            elif intent == "documents":
-                return await self._explain_documents()
-            elif intent == "eligibility":
-                return await self._explain_eligibility()
-            else:
-                return await self._handle_objection(user_message)
-                
-        elif self.conversation_state == "sales":
-            result = await self.sales_agent.process_message(user_message, self.user_context)
-            
-            # Only add suggestions if they don't already exist
-            if isinstance(result, dict) and not result.get("suggestions"):
-                step = result.get("metadata", {}).get("step")
-                if step == "tenure":
-                    result["suggestions"] = ["1 year", "2 years", "3 years", "5 years"]
-                elif step == "purpose":
-                    result["suggestions"] = ["Home renovation", "Wedding", "Medical emergency", "Education", "Business", "Travel"]
-                elif step == "phone":
-                    result["suggestions"] = ["9876543210 (Demo - Instant Approval)", "9876543211 (Demo - Salary Required)", "9876543212 (Demo - Rejection)"]
-            
-            if result.get("next_action") == "verification":
-                self.conversation_state = "verification"
-                self.user_context.update(result["collected_data"])
-                verification_result = await self.verification_agent.start_verification(self.user_context)
-                # Only add OTP suggestions if they don't already exist
-                if isinstance(verification_result, dict) and not verification_result.get("suggestions"):
-                    otp = verification_result.get("metadata", {}).get("otp")
-                    if otp:
-                        verification_result["suggestions"] = [otp, "Resend OTP", "Change number"]
-                return verification_result
-            else:
-                return result
-                
-        elif self.conversation_state == "verification":
-            result = await self.verification_agent.process_message(user_message, self.user_context)
-            
-            # Only add suggestions if they don't already exist
-            if isinstance(result, dict) and not result.get("suggestions"):
-                step = result.get("metadata", {}).get("step")
-                if step == "kyc_confirmation":
-                    result["suggestions"] = ["Yes, correct", "No, update details", "Looks good"]
-            
-            # If customer data is returned, update context
-            if result.get("customer_data"):
-                self.user_context.update(result["customer_data"])
+        if not state.user_context.get("name") and self._is_greeting(user_message):
+            return "greeting"
+        # Only states with per-intent rows need the intent
+        if state.conversation_state in TRANSITIONS.branching_states:
+            return await self._analyze_intent(user_message)
+        return ANY_EVENT
+    
+    async def _start_sales(self, state: SessionState, user_message: str) -> Dict[str, Any]:
+        state.conversation_state = "sales"
+        return await self.sales_agent.start_sales_process()
+    
+    async def _sales_turn(self, state: SessionState, user_message: str) -> Dict[str, Any]:
+        result = await self.sales_agent.process_message(user_message, state)
+        if result.get("next_action") != "verification":
+            return result
+        
+        state.conversation_state = "verification"
+        state.user_context.update(result["collected_data"])
+        self._start_prefetch(state, state.user_context["phone"])
+        return await self.verification_agent.start_verification(state.user_context)
+    
+    async def _verification_turn(self, state: SessionState, user_message: str) -> Dict[str, Any]:
+        result = await self.verification_agent.process_message(user_message, state)
+        
+        if result.get("metadata", {}).get("error") in ("invalid_otp", "otp_expired", "otp_locked"):
+            # Never use data fetched for a number that failed verification
+            self._discard_prefetch(state)
+        
+        # If customer data is returned, update context
+        if result.get("customer_data"):
+            state.user_context.update(result["customer_data"])
+        
+        if result.get("next_action") != "underwriting":
+            return result
+        
+        state.conversation_state = "underwriting"
+        try:
+            # Automatically evaluate the loan after verification
+            evaluation_result = await self.underwriting_agent.evaluate_loan(state.user_context, state.prefetch)
             
-            if result.get("next_action") == "underwriting":
-                self.conversation_state = "underwriting"
-                
-                try:
-                    # Automatically evaluate the loan after verification
-                    evaluation_result = await self.underwriting_agent.evaluate_loan(self.user_context)
-                    
-                    if evaluation_result.get("decision") == "approved":
-                        self.conversation_state = "sanction"
-                        sanction_result = await self.sanction_letter_agent.generate_sanction_letter(self.user_context)
-                        # Add final suggestions
-                        if isinstance(sanction_result, dict):
-                            sanction_result["suggestions"] = ["Download letter", "Apply for another loan", "Thank you", "Contact support"]
-                        return sanction_result
-                    elif evaluation_result.get("decision") == "rejected":
-                        rejection_result = await self._handle_rejection(evaluation_result.get("reason", "Unknown reason"))
-                        if isinstance(rejection_result, dict):
-                            rejection_result["suggestions"] = ["Apply for smaller amount", "Improve credit score", "Add co-applicant", "Contact support"]
-                        return rejection_result
-                    else:
-                        # Add suggestions for salary upload
-                        if isinstance(evaluation_result, dict):
-                            evaluation_result["suggestions"] = ["Upload salary slip", "Try smaller amount", "Contact support"]
-                        return evaluation_result
-                except Exception as e:
-                    # Return a simple error message and try to continue
-                    return {
-                        "content": f"There was an issue processing your application. Error: {str(e)}. Let me try a different approach.",
-                        "metadata": {"error": True},
-                        "suggestions": ["Try again", "Contact support", "Start over"]
-                    }
+            if evaluation_result.get("decision") == "approved":
+                state.conversation_state = "sanction"
+                sanction_result = await self.sanction_letter_agent.generate_sanction_letter(state.user_context)
+                sanction_result["suggestions"] = ["Download letter", "Apply for another loan", "Thank you", "Contact support"]
+                return sanction_result
+            elif evaluation_result.get("decision") == "rejected":
+                rejection_result = await self._handle_rejection(state, evaluation_result.get("reason", "Unknown reason"))
+                rejection_result["suggestions"] = ["Apply for smaller amount", "Improve credit score", "Add co-applicant", "Contact support"]
+                return rejection_result
             else:
-                return result
-                
-        elif self.conversation_state == "underwriting":
-            # This state should rarely be reached since we auto-evaluate after verification
-            result = await self.underwriting_agent.process_message(user_message, self.user_context)
-            return result
-                
-        elif self.conversation_state == "sanction":
+                # Add suggestions for salary upload
+                evaluation_result["suggestions"] = ["Upload salary slip", "Try smaller amount", "Contact support"]
+                return evaluation_result
+        except Exception as e:
+            # Return a simple error message and try to continue
             return {
-                "content": "Your loan has been approved! You should receive the sanction letter shortly. Is there anything else I can help you with?",
-                "metadata": {"conversation_complete": True},
-                "suggestions": ["Download letter", "Apply for another loan", "Thank you", "Contact support"]
+                "content": f"There was an issue processing your application. Error: {str(e)}. Let me try a different approach.",
+                "metadata": {"error": True},
+                "suggestions": ["Try again", "Contact support", "Start over"]
             }
     
+    async def _underwriting_turn(self, state: SessionState, user_message: str) -> Dict[str, Any]:
+        # This state should rarely be reached since we auto-evaluate after verification
+        return await self.underwriting_agent.process_message(user_message, state.user_context)
+    
+    async def _sanction_turn(self, state: SessionState, user_message: str) -> Dict[str, Any]:
+        return {
+            "content": "Your loan has been approved! You should receive the sanction letter shortly. Is there anything else I can help you with?",
+            "metadata": {"conversation_complete": True},
+            "suggestions": ["Download letter", "Apply for another loan", "Thank you", "Contact support"]
+        }
+    
+    def _start_prefetch(self, state: SessionState, phone: str):
+        self._discard_prefetch(state)
+        if self.prefetch_enabled:
+            state.prefetch = CustomerPrefetch.start(phone, self.crm, self.bureau)
+    
+    def _discard_prefetch(self, state: SessionState):
+        if state.prefetch is not None:
+            state.prefetch.discard()
+            state.prefetch = None
+    
+    @traced("master.analyze_intent")
     async def _analyze_intent(self, message: str) -> str:
         """Analyze user intent using LLM"""
         prompt = f"""
@@ -211,9 +254,9 @@ So, are you looking to get a personal loan today? I'd love to help make it happe
         greetings = ["hi", "hello", "hey", "good morning", "good afternoon", "good evening", "namaste"]
         return any(greeting in message.lower() for greeting in greetings)
     
-    async def _handle_greeting(self) -> Dict[str, Any]:
+    async def _handle_greeting(self, state: SessionState, user_message: str) -> Dict[str, Any]:
         """Handle user greeting and ask for name"""
-        self.conversation_state = "collecting_name"
+        state.conversation_state = "collecting_name"
         
         message = """
 Hello! 👋 It's so wonderful to meet you! 
@@ -228,15 +271,16 @@ Before we get started, I'd love to know your name so I can assist you better. Wh
             "suggestions": ["My name is...", "Call me...", "I'm...", "Skip name"]
         }
     
-    async def _collect_name(self, user_message: str) -> Dict[str, Any]:
+    async def _collect_name(self, state: SessionState, user_message: str) -> Dict[str, Any]:
         """Collect user's name and personalize the experience"""
         # Extract name from message
         name = self._extract_name(user_message)
         
         if name and name.lower() != "skip":
-            self.user_context["name"] = name
-            self.conversation_state = "greeting"
+            state.user_context["name"] = name
+            state.conversation_state = "greeting"
             
+            lowest_rate = self._lowest_rate()
             message = f"""
 {name}! What a lovely name! 😊 It's such a pleasure to meet you, {name}!
 
@@ -244,7 +288,7 @@ I'm here to help you get the perfect personal loan for whatever you need - wheth
 
 ✨ Here's what I can do for you today:
 • Get you instant approval (often in under 5 minutes!)
-• Offer competitive rates starting at just 10.99%
+• Offer competitive rates starting at just {lowest_rate}
 • Minimal paperwork - we keep it simple
 • Quick fund transfer to your account
 
@@ -262,16 +306,17 @@ So {name}, are you looking to get a personal loan today? I'd love to help make i
             }
         else:
             # If name extraction failed or user wants to skip
-            self.conversation_state = "greeting"
+            state.conversation_state = "greeting"
+            lowest_rate = self._lowest_rate()
             
-            message = """
+            message = f"""
 No problem at all! I'm happy to help you regardless! 😊
 
 I'm here to help you get the perfect personal loan for whatever you need - whether it's for home renovation, a wedding, medical expenses, or any other important goal in your life!
 
 ✨ Here's what I can do for you today:
 • Get you instant approval (often in under 5 minutes!)
-• Offer competitive rates starting at just 10.99%
+• Offer competitive rates starting at just {lowest_rate}
 • Minimal paperwork - we keep it simple
 • Quick fund transfer to your account
 
@@ -288,6 +333,11 @@ So, are you looking to get a personal loan today? I'd love to help make it happe
                 ]
             }
     
+    def _lowest_rate(self) -> str:
+        """The starting rate quoted to customers, from the current rate card"""
+        lowest_rate, _ = self.rate_cards.current().rate_range()
+        return format_rate(lowest_rate)
+    
     def _extract_name(self, message: str) -> str:
         """Extract name from user message"""
         import re
@@ -316,18 +366,28 @@ So, are you looking to get a personal loan today? I'd love to help make it happe
         
         return None
     
-    async def _explain_rates(self) -> Dict[str, Any]:
+    async def _explain_rates(self, state: SessionState, user_message: str) -> Dict[str, Any]:
         """Explain interest rates"""
-        user_name = self.user_context.get("name", "")
+        user_name = state.user_context.get("name", "")
         greeting = f"{user_name}, " if user_name else ""
+        rate_card = self.rate_cards.current()
+        lowest_rate, highest_rate = rate_card.rate_range()
+        examples, next_band_from = [], None
+        for _, min_score, _ in rate_card.score_bands:
+            if min_score:
+                scores = f"{min_score}+" if next_band_from is None else f"{min_score}-{next_band_from - 1}"
+                low, high = rate_card.rate_range(min_score)
+                examples.append(f"• Credit Score {scores}: {format_rate(low)} - {format_rate(high)}")
+            next_band_from = min_score
+        examples = "\n".join(examples)
         
         message = f"""
 {greeting}Great question! Let me break down our interest rates for you! 💰
 
 🏷️ **Our Personal Loan Interest Rates:**
 
-✅ **Starting Rate**: 10.99% per annum (for excellent credit profiles)
-✅ **Typical Range**: 10.99% - 24.99% per annum
+✅ **Starting Rate**: {format_rate(lowest_rate)} per annum (for excellent credit profiles)
+✅ **Typical Range**: {format_rate(lowest_rate)} - {format_rate(highest_rate)} per annum
 ✅ **Rate Type**: Reducing balance (you pay interest only on outstanding amount)
 
 🎯 **What determines your rate?**
@@ -337,9 +397,7 @@ So, are you looking to get a personal loan today? I'd love to help make it happe
 • Your relationship with Tata Capital
 
 📊 **Rate Examples:**
-• Credit Score 750+: 10.99% - 15.99%
-• Credit Score 700-749: 16.99% - 20.99%
-• Credit Score 650-699: 21.99% - 24.99%
+{examples}
 
 The good news? Most of our customers get rates much better than credit cards (which charge 18-36%!)
 
@@ -356,9 +414,9 @@ Would you like me to check what rate you'd qualify for? It's completely free and
             ]
         }
     
-    async def _explain_documents(self) -> Dict[str, Any]:
+    async def _explain_documents(self, state: SessionState, user_message: str) -> Dict[str, Any]:
         """Explain required documents"""
-        user_name = self.user_context.get("name", "")
+        user_name = state.user_context.get("name", "")
         greeting = f"{user_name}, " if user_name else ""
         
         message = f"""
@@ -396,9 +454,9 @@ Most customers are amazed at how little paperwork we need. Ready to see how simp
             ]
         }
     
-    async def _explain_eligibility(self) -> Dict[str, Any]:
+    async def _explain_eligibility(self, state: SessionState, user_message: str) -> Dict[str, Any]:
         """Explain loan eligibility"""
-        user_name = self.user_context.get("name", "")
+        user_name = state.user_context.get("name", "")
         greeting = f"{user_name}, " if user_name else ""
         
         message = f"""
@@ -443,10 +501,10 @@ Want me to check your exact eligibility? It's free and takes just 2 minutes! 
             ]
         }
     
-    async def _handle_objection(self, message: str) -> Dict[str, Any]:
+    async def _handle_objection(self, state: SessionState, message: str) -> Dict[str, Any]:
         """Handle user objections with persuasive responses"""
         
-        user_name = self.user_context.get("name", "")
+        user_name = state.user_context.get("name", "")
         greeting = f"{user_name}, " if user_name else ""
         
         message_lower = message.lower()
@@ -468,15 +526,16 @@ What do you say? 😊
             suggestions = ["Check eligibility", "Tell me more", "What's the process?", "Maybe later"]
             
         elif any(word in message_lower for word in ["interest", "rate", "expensive"]):
+            lowest_rate = self._lowest_rate()
             response = f"""
 {greeting}I hear you on the interest rates - that's always a smart thing to ask about! 
 
-Here's some good news: our rates start from just 10.99%, which is typically much lower than:
+Here's some good news: our rates start from just {lowest_rate}, which is typically much lower than:
 • Credit cards (18-36% annually) 
 • Other personal loan providers
 • Emergency borrowing options
 
-Plus, with your profile, you might qualify for our best rates! The exact rate depends on your credit score and income, but I've seen customers get rates as low as 10.99%.
+Plus, with your profile, you might qualify for our best rates! The exact rate depends on your credit score and income, but I've seen customers get rates as low as {lowest_rate}.
 
 Want me to check what rate you'd qualify for? It takes just a minute and there's no obligation! 
             """
@@ -519,9 +578,9 @@ Sound fair? Let's give it a try! 😊
             "suggestions": suggestions
         }
     
-    async def _handle_rejection(self, reason: str) -> Dict[str, Any]:
+    async def _handle_rejection(self, state: SessionState, reason: str) -> Dict[str, Any]:
         """Handle loan rejection gracefully"""
-        user_name = self.user_context.get("name", "")
+        user_name = state.user_context.get("name", "")
         greeting = f"{user_name}, " if user_name else ""
         
         rejection_message = f"""
@@ -541,14 +600,61 @@ Would you like me to help you with any of these options?
             "suggestions": ["Apply for smaller amount", "Improve credit score", "Add co-applicant", "Contact support"]
         }
     
-    async def process_salary_slip(self, file_path: str) -> str:
-        """Process uploaded salary slip"""
-        # Mock salary extraction - in production use OCR
-        extracted_salary = 75000  # Mock extracted amount
+    async def process_salary_slip(self, state: SessionState, slip: Dict[str, Any]) -> Dict[str, Any]:
+        """Continue underwriting with the figures parsed from an uploaded salary slip"""
+        if state.conversation_state != "underwriting":
+            return {
+                "content": "Thanks! I don't need a salary slip for your application right now - "
+                           "I'll ask for one if it's required.",
+                "metadata": {"salary_slip_status": "not_required"}
+            }
         
-        self.user_context["salary"] = extracted_salary
+        # Take-home pay is what the EMI has to come out of
+        salary = slip.get("net_salary") or slip.get("gross_salary")
+        if slip.get("status") != "parsed" or not salary:
+            return {
+                "content": "I couldn't find your salary in that file. 📄 Please upload your latest salary slip as "
+                           "the PDF from your payroll portal (scans and photos can't be read yet).",
+                "metadata": {"salary_required": True, "salary_slip_status": slip.get("status")},
+                "suggestions": ["Upload salary slip", "Try smaller amount", "Contact support"]
+            }
+        
+        state.user_context["salary"] = salary
+        state.user_context["salary_slip_verified"] = True
+        state.user_context["salary_slip"] = {
+            "gross_salary": slip.get("gross_salary"),
+            "net_salary": slip.get("net_salary"),
+            "employer": slip.get("employer"),
+            "content_hash": slip.get("content_hash"),
+        }
         
         # Continue with underwriting
-        result = await self.underwriting_agent.evaluate_with_salary(self.user_context)
+        result = await self.underwriting_agent.evaluate_with_salary(state.user_context)
         
-        return result["content"]
\ No newline at end of file
+        if result["decision"] == "approved":
+            state.conversation_state = "sanction"
+            response = await self.sanction_letter_agent.generate_sanction_letter(state.user_context)
+            if isinstance(response, dict):
+                response["suggestions"] = ["Download letter", "Apply for another loan", "Thank you", "Contact support"]
+        else:
+            response = await self._handle_rejection(state, result.get("reason", "Unknown reason"))
+            response["suggestions"] = ["Apply for smaller amount", "Improve credit score", "Add co-applicant", "Contact support"]
+        self._record_funnel(state, "underwriting", response)
+        return response
+
+# The conversation flow: (state, event) -> handler and the states the turn may leave it in
+TRANSITIONS = TransitionTable([
+    Transition(ANY_STATE, "greeting", MasterAgent._handle_greeting, ["collecting_name"]),
+    Transition("collecting_name", ANY_EVENT, MasterAgent._collect_name, ["greeting"]),
+    Transition("greeting", "yes", MasterAgent._start_sales, ["sales"]),
+    Transition("greeting", "interested", MasterAgent._start_sales, ["sales"]),
+    Transition("greeting", "loan_inquiry", MasterAgent._start_sales, ["sales"]),
+    Transition("greeting", "rates", MasterAgent._explain_rates, ["greeting"]),
+    Transition("greeting", "documents", MasterAgent._explain_documents, ["greeting"]),
+    Transition("greeting", "eligibility", MasterAgent._explain_eligibility, ["greeting"]),
+    Transition("greeting", ANY_EVENT, MasterAgent._handle_objection, ["greeting"]),
+    Transition("sales", ANY_EVENT, MasterAgent._sales_turn, ["sales", "verification"]),
+    Transition("verification", ANY_EVENT, MasterAgent._verification_turn, ["verification", "underwriting", "sanction"]),
+    Transition("underwriting", ANY_EVENT, MasterAgent._underwriting_turn, ["underwriting"]),
+    Transition("sanction", ANY_EVENT, MasterAgent._sanction_turn, ["sanction"]),
+], initial="greeting")
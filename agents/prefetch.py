@@ -0,0 +1,46 @@
+"""
+Speculative customer lookups.
+
+The CRM record and the bureau report only depend on the phone number, which
+is known a full turn (the OTP round trip) before either is needed. As soon as
+sales captures the phone, both lookups start in the background; verification
+and underwriting then await results that are usually already there. If the
+OTP check fails the prefetch is discarded so nothing fetched for an
+unverified number is ever used.
+"""
+import asyncio
+from typing import Dict, Any, Optional
+
+from mock_services.adapters import CRMAdapter, CreditBureauAdapter
+
+
+class CustomerPrefetch:
+    def __init__(self, phone: str, crm_lookup: asyncio.Task, bureau_lookup: asyncio.Task):
+        self.phone = phone
+        self.crm_lookup = crm_lookup
+        self.bureau_lookup = bureau_lookup
+
+    @classmethod
+    def start(cls, phone: str, crm: CRMAdapter, bureau: CreditBureauAdapter) -> "CustomerPrefetch":
+        """Kick off both lookups as background tasks"""
+        loop = asyncio.get_running_loop()
+        return cls(
+            phone,
+            loop.create_task(crm.get_customer_by_phone(phone)),
+            loop.create_task(bureau.get_bureau_report(phone)),
+        )
+
+    async def customer(self) -> Optional[Dict[str, Any]]:
+        return await self.crm_lookup
+
+    async def bureau_report(self) -> Dict[str, Any]:
+        return await self.bureau_lookup
+
+    def discard(self):
+        """Drop the results; calls already in a worker thread finish but are ignored"""
+        for task in (self.crm_lookup, self.bureau_lookup):
+            if task.done():
+                if not task.cancelled():
+                    task.exception()  # Mark any failure as retrieved
+            else:
+                task.cancel()
@@ -0,0 +1,227 @@
+"""
+Risk-based pricing.
+
+The rate card (config/rate_card.json) prices a loan from the applicant's
+credit score band plus adjustments for the amount band and tenure band.
+When the card is loaded it is expanded into a dense table holding a
+``Quote`` for every score band, amount band and tenure month. Each quote
+carries the annual rate and the EMI per rupee borrowed, so pricing a loan
+is one list index and its EMI one multiplication. Sales, underwriting, the
+sanction letter and the bureau's rate guidance all price from this table,
+so the applicant sees the same rate and EMI at every step.
+
+Before the credit score is known, sales quotes the card's standard rate.
+The card is reloaded like the underwriting policy: workers check its mtime
+every RATE_CARD_CHECK_SECONDS and swap in the rebuilt table with a single
+reference assignment.
+"""
+import bisect
+import json
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from .underwriting_policy import PolicyStore
+
+DEFAULT_RATE_CARD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      "config", "rate_card.json")
+
+MAX_SCORE = 900
+STANDARD_BAND = "standard"
+
+
+class RateCardError(ValueError):
+    """The rate card file is malformed"""
+
+
+class Quote:
+    __slots__ = ("band", "rate", "tenure", "emi_factor")
+
+    def __init__(self, band: str, rate: float, tenure: int):
+        self.band = band
+        self.rate = rate  # Percent per annum, reducing balance
+        self.tenure = tenure
+        self.emi_factor = emi_factor(rate, tenure)
+
+    def emi(self, amount: int) -> int:
+        return int(amount * self.emi_factor)
+
+
+def emi_factor(annual_rate: float, tenure: int) -> float:
+    """Monthly instalment per rupee borrowed"""
+    if tenure <= 0:
+        return 0.0
+    rate = annual_rate / 1200
+    growth = (1 + rate) ** tenure
+    return rate * growth / (growth - 1)
+
+
+class RateCard:
+    def __init__(self, version: str, standard_rate: float, score_bands: List[Tuple[str, int, float]],
+                 amount_bands: List[Tuple[Optional[int], float]], min_tenure: int,
+                 tenure_bands: List[Tuple[int, float]]):
+        self.version = version
+        self.standard_rate = standard_rate
+        self.score_bands = score_bands
+        self.amount_bands = amount_bands
+        self.tenure_bands = tenure_bands
+        self.min_tenure = min_tenure
+        self.max_tenure = tenure_bands[-1][0]
+
+        months = range(min_tenure, self.max_tenure + 1)
+        tenure_adjustments = [next(adjustment for up_to, adjustment in tenure_bands if tenure <= up_to)
+                              for tenure in months]
+        self._tenures = len(months)
+        self._amount_limits = [up_to for up_to, _ in amount_bands[:-1]]
+        # Band of every score the bureau can report, and where its quotes start in the table
+        self._score_band = [next(i for i, (_, min_score, _) in enumerate(score_bands) if score >= min_score)
+                            for score in range(MAX_SCORE + 1)]
+        self._score_rows = [band * len(amount_bands) * self._tenures for band in self._score_band]
+        self._quotes = [Quote(name, round(rate + amount_adjustment + tenure_adjustment, 2), tenure)
+                        for name, _, rate in score_bands
+                        for _, amount_adjustment in amount_bands
+                        for tenure, tenure_adjustment in zip(months, tenure_adjustments)]
+        self._standard = [Quote(STANDARD_BAND, standard_rate, tenure) for tenure in months]
+        band_size = len(amount_bands) * self._tenures
+        self._rate_ranges = []
+        for band in range(len(score_bands)):
+            rates = [quote.rate for quote in self._quotes[band * band_size:(band + 1) * band_size]]
+            self._rate_ranges.append((min(rates), max(rates)))
+
+    def quote(self, credit_score: Optional[int], amount: int, tenure: int) -> Quote:
+        """Price a loan; without a credit score, at the standard rate"""
+        offset = tenure - self.min_tenure
+        if offset < 0 or offset >= self._tenures:
+            # Outside the card's tenures: the nearest one's rate, repaid over the tenure asked for
+            nearest = self.quote(credit_score, amount, self.min_tenure if offset < 0 else self.max_tenure)
+            return Quote(nearest.band, nearest.rate, tenure)
+        if credit_score is None:
+            return self._standard[offset]
+        if not 0 <= credit_score <= MAX_SCORE:
+            credit_score = 0 if credit_score < 0 else MAX_SCORE
+        return self._quotes[self._score_rows[credit_score]
+                            + bisect.bisect_left(self._amount_limits, amount) * self._tenures + offset]
+
+    def emi(self, credit_score: Optional[int], amount: int, tenure: int) -> int:
+        if not amount or tenure <= 0:
+            return 0
+        return int(amount * self.quote(credit_score, amount, tenure).emi_factor)
+
+    def rate_range(self, credit_score: Optional[int] = None) -> Tuple[float, float]:
+        """Lowest and highest rate of the score's band, or of the whole card"""
+        if credit_score is None:
+            return min(low for low, _ in self._rate_ranges), max(high for _, high in self._rate_ranges)
+        return self._rate_ranges[self._score_band[min(max(credit_score, 0), MAX_SCORE)]]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "standard_rate": self.standard_rate,
+            "bands": [{"band": name, "min_score": min_score, "rates": list(self._rate_ranges[i])}
+                      for i, (name, min_score, _) in enumerate(self.score_bands)],
+            "tenure_months": [self.min_tenure, self.max_tenure],
+        }
+
+
+def format_rate(rate: float) -> str:
+    return f"{rate:.2f}%"
+
+
+def price_loan(rate_card: RateCard, context: Dict[str, Any]) -> Dict[str, Any]:
+    """The application's rate and EMI, kept in its context as ``loan_quote``"""
+    amount = context.get("loan_amount", 0)
+    quote = rate_card.quote(context.get("credit_score"), amount, context.get("tenure", 12))
+    return {"rate": quote.rate, "emi": quote.emi(amount), "band": quote.band,
+            "rate_card_version": rate_card.version}
+
+
+def _number(value, where: str) -> float:
+    # JSON accepts NaN and Infinity, which would price every loan at a rate no EMI can be computed from
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise RateCardError(f"{where}: expected a finite number")
+    return value
+
+
+def _bands(document: Dict[str, Any], key: str, last_unbounded: bool) -> List[Tuple[Optional[int], float]]:
+    """Ordered (up_to, adjustment) pairs with increasing limits"""
+    bands, previous = [], 0
+    entries = document.get(key) or []
+    if not entries:
+        raise RateCardError(f"rate card has no {key!r}")
+    for i, entry in enumerate(entries):
+        where = f"{key}[{i}]"
+        up_to = entry.get("up_to")
+        if up_to is None and last_unbounded and i == len(entries) - 1:
+            bands.append((None, _number(entry.get("adjustment", 0), where)))
+            continue
+        if isinstance(up_to, bool) or not isinstance(up_to, int) or up_to <= previous:
+            raise RateCardError(f"{where}: 'up_to' must be a whole number above {previous}")
+        bands.append((up_to, _number(entry.get("adjustment", 0), where)))
+        previous = up_to
+    if last_unbounded and bands[-1][0] is not None:
+        raise RateCardError(f"the last of {key!r} must have no 'up_to'")
+    return bands
+
+
+def compile_rate_card(document: Dict[str, Any]) -> RateCard:
+    version = str(document.get("version") or "")
+    if not version:
+        raise RateCardError("rate card has no 'version'")
+    standard_rate = _number(document.get("standard_rate"), "standard_rate")
+
+    score_bands, previous = [], MAX_SCORE + 1
+    for i, entry in enumerate(document.get("credit_score_bands") or []):
+        where = f"credit_score_bands[{i}]"
+        min_score = entry.get("min_score")
+        if isinstance(min_score, bool) or not isinstance(min_score, int) or not 0 <= min_score < previous:
+            raise RateCardError(f"{where}: 'min_score' must be a whole number below {previous}")
+        score_bands.append((str(entry.get("band") or f"band_{i}"), min_score, _number(entry.get("rate"), where)))
+        previous = min_score
+    if not score_bands or score_bands[-1][1] != 0:
+        raise RateCardError("the last credit score band must start at 0")
+
+    min_tenure = document.get("min_tenure_months", 1)
+    if isinstance(min_tenure, bool) or not isinstance(min_tenure, int) or min_tenure < 1:
+        raise RateCardError("'min_tenure_months' must be a whole number of at least 1")
+    tenure_bands = _bands(document, "tenure_bands", last_unbounded=False)
+    if tenure_bands[-1][0] < min_tenure:
+        raise RateCardError("tenure bands end before 'min_tenure_months'")
+
+    card = RateCard(version, standard_rate, score_bands, _bands(document, "amount_bands", last_unbounded=True),
+                    min_tenure, tenure_bands)
+    if min(card.rate_range()[0], standard_rate) <= 0:
+        raise RateCardError("every rate must be positive, adjustments included")
+    return card
+
+
+def load_rate_card(path: str) -> RateCard:
+    with open(path) as f:
+        return compile_rate_card(json.load(f))
+
+
+class RateCardStore(PolicyStore):
+    """The current rate card, rebuilt when its file changes; ``current()`` returns the RateCard"""
+
+    kind = "rate card"
+    loader = staticmethod(load_rate_card)
+
+    def __init__(self, path: str = DEFAULT_RATE_CARD_PATH, check_interval: float = 2.0):
+        super().__init__(path, check_interval)
+
+    @classmethod
+    def from_env(cls) -> "RateCardStore":
+        return cls(
+            os.getenv("RATE_CARD_PATH", DEFAULT_RATE_CARD_PATH),
+            float(os.getenv("RATE_CARD_CHECK_SECONDS", "2")),
+        )
+
+
+_rate_card_store: Optional[RateCardStore] = None
+
+
+def get_rate_card_store() -> RateCardStore:
+    """Process-wide rate card store, loaded on first use"""
+    global _rate_card_store
+    if _rate_card_store is None:
+        _rate_card_store = RateCardStore.from_env()
+    return _rate_card_store
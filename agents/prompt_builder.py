@@ -0,0 +1,170 @@
+"""
+Token-budgeted prompt construction for AIService.
+
+Every prompt starts with a static system message that is byte-for-byte the
+same on every call, so providers with prefix caching can reuse it. Per-turn
+details follow in a compact context message built from a whitelist of
+context fields (never OTPs, timestamps or other raw session state), then as
+much recent history as fits in the token budget, then the user's message.
+"""
+import os
+import re
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+# Chat formats add a few tokens of framing to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate BPE token count without a tokenizer: ~4 bytes of UTF-8 per token.
+
+    Counting bytes rather than characters keeps the estimate honest for the
+    emoji, rupee signs and Devanagari that show up in this chat.
+    """
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut ``text`` to roughly ``max_tokens`` tokens, on a character boundary"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    clipped = text.encode("utf-8")[:max_tokens * 4].decode("utf-8", errors="ignore")
+    return clipped.rstrip() + "…"
+
+
+class PromptBuilder:
+    def __init__(self, system_prompt: str, context_fields: Dict[str, str], budget_tokens: int,
+                 history_messages: int = 0, max_message_tokens: int = 150):
+        # Static prefix, identical on every call
+        self.system_message = {"role": "system", "content": system_prompt.strip()}
+        self.system_tokens = estimate_tokens(self.system_message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        # Context key -> label shown to the model; anything else is left out
+        self.context_fields = context_fields
+        self.budget_tokens = budget_tokens
+        self.history_messages = history_messages
+        self.max_message_tokens = max_message_tokens
+
+    def format_context(self, context: Dict[str, Any]) -> str:
+        """Whitelisted, non-empty context fields as one compact line"""
+        parts = [f"{label}: {context[key]}" for key, label in self.context_fields.items()
+                 if context.get(key) not in (None, "")]
+        return "; ".join(parts)
+
+    def build(self, user_message: str, context: Dict[str, Any],
+              history: Optional[Sequence[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, str]], int, int]:
+        """Build the message list for one call.
+
+        Returns ``(messages, prompt_tokens, dropped_history)``. The system
+        prefix, context and user message are always included; history is
+        added newest first until the budget runs out.
+        """
+        user_message = truncate_to_tokens(user_message, self.max_message_tokens)
+        tail = [{"role": "user", "content": user_message}]
+        tokens = self.system_tokens + estimate_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+
+        context_line = self.format_context(context)
+        if context_line:
+            tail.insert(0, {"role": "system", "content": f"Context: {context_line}"})
+            tokens += estimate_tokens(context_line) + 3 + MESSAGE_OVERHEAD_TOKENS
+
+        recent = list(history or [])[-self.history_messages:] if self.history_messages else []
+        included: List[Dict[str, str]] = []
+        for message in reversed(recent):
+            content = truncate_to_tokens(message.get("content", ""), self.max_message_tokens)
+            cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            if tokens + cost > self.budget_tokens:
+                break
+            included.append({
+                "role": "user" if message.get("sender") == "user" else "assistant",
+                "content": content,
+            })
+            tokens += cost
+        included.reverse()
+
+        dropped = len(recent) - len(included)
+        return [self.system_message] + tail[:-1] + included + tail[-1:], tokens, dropped
+
+
+INTENT_INSTRUCTIONS = """
+You are an expert intent classifier for a loan application system.
+Analyze the user's message and return one of these intents:
+- greeting: User is saying hello or starting conversation
+- loan_inquiry: User wants to apply for a loan
+- amount_query: User is specifying loan amount
+- tenure_query: User is specifying loan tenure
+- document_query: User asking about required documents
+- rate_query: User asking about interest rates
+- objection: User has concerns or objections
+- confirmation: User is confirming or agreeing
+- rejection: User is declining or not interested
+"""
+
+INTENT_PROMPT = PromptBuilder(
+    system_prompt=INTENT_INSTRUCTIONS + "\nReturn only the intent name, nothing else.",
+    context_fields={
+        "conversation_state": "Conversation stage",
+        "loan_amount": "Loan amount",
+        "tenure": "Tenure (months)",
+    },
+    budget_tokens=int(os.getenv("INTENT_PROMPT_TOKEN_BUDGET", "400")),
+)
+
+INTENT_BATCH_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (INTENT_INSTRUCTIONS + """
+You will receive numbered messages from different users, each followed by its context in brackets.
+Reply with exactly one line per message in the form "<number>: <intent>" and nothing else.
+""").strip(),
+}
+
+_BATCH_REPLY_LINE = re.compile(r"^\s*(\d+)\s*[:.)-]\s*([a-z_]+)", re.MULTILINE)
+
+
+def build_intent_batch(requests: Sequence[Tuple[str, Dict[str, Any]]]) -> Tuple[List[Dict[str, str]], int]:
+    """One classification prompt for several users' messages, numbered from 1"""
+    lines = []
+    for i, (message, context) in enumerate(requests, 1):
+        message = truncate_to_tokens(" ".join(message.split()), INTENT_PROMPT.max_message_tokens)
+        context_line = INTENT_PROMPT.format_context(context)
+        lines.append(f"{i}. {message} [{context_line}]" if context_line else f"{i}. {message}")
+    content = "\n".join(lines)
+    tokens = (estimate_tokens(INTENT_BATCH_SYSTEM_MESSAGE["content"]) + estimate_tokens(content)
+              + 2 * MESSAGE_OVERHEAD_TOKENS)
+    return [INTENT_BATCH_SYSTEM_MESSAGE, {"role": "user", "content": content}], tokens
+
+
+def parse_intent_batch(reply: str, count: int) -> List[Optional[str]]:
+    """Intents from a batched reply by message number; None where the model skipped one"""
+    intents: List[Optional[str]] = [None] * count
+    for number, intent in _BATCH_REPLY_LINE.findall(reply.lower()):
+        index = int(number) - 1
+        if 0 <= index < count:
+            intents[index] = intent
+    return intents
+
+
+RESPONSE_PROMPT = PromptBuilder(
+    system_prompt="""
+You are Sanhith, a professional loan advisor at Tata Capital. You are helpful, friendly, and knowledgeable about personal loans.
+
+Guidelines:
+- Be conversational and human-like
+- Use the user's name when appropriate
+- Provide specific loan information when asked
+- Keep responses concise but informative
+- Always maintain a professional yet friendly tone
+- If discussing loan terms, mention Tata Capital's competitive rates
+""",
+    context_fields={
+        "name": "User name",
+        "conversation_state": "Conversation stage",
+        "intent": "Intent",
+        "loan_amount": "Loan amount",
+        "tenure": "Tenure (months)",
+        "purpose": "Purpose",
+        "city": "City",
+        "preapproved_limit": "Pre-approved limit",
+    },
+    budget_tokens=int(os.getenv("RESPONSE_PROMPT_TOKEN_BUDGET", "1200")),
+    history_messages=10,
+)
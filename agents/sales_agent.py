@@ -1,10 +1,17 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from utils.tracing import traced
+
+from .pricing import RateCardStore, format_rate, get_rate_card_store
+from .session_state import SessionState
 
 class SalesAgent:
-    def __init__(self):
-        self.collected_data = {}
-        self.current_step = "loan_amount"
-        
+    """Collects amount, tenure, purpose and phone; the step and answers live in the SessionState"""
+    
+    def __init__(self, rate_cards: Optional[RateCardStore] = None):
+        # EMIs are quoted at the rate card's standard rate until the credit score is known
+        self.rate_cards = rate_cards or get_rate_card_store()
+    
     async def start_sales_process(self) -> Dict[str, Any]:
         """Start the sales conversation"""
         message = """
@@ -27,14 +34,18 @@ Don't worry about being exact right now - we can always adjust it based on what
             "suggestions": ["₹2 lakhs", "₹5 lakhs", "₹10 lakhs", "₹20 lakhs"]
         }
     
-    async def process_message(self, user_message: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    @traced("sales.process_message")
+    async def process_message(self, user_message: str, state: SessionState) -> Dict[str, Any]:
         """Process sales conversation step by step"""
+        if state.sales_data is None:
+            state.sales_data = {}
+        collected_data = state.sales_data
         
-        if self.current_step == "loan_amount":
+        if state.sales_step == "loan_amount":
             amount = self._extract_amount(user_message)
             if amount:
-                self.collected_data["loan_amount"] = amount
-                self.current_step = "tenure"
+                collected_data["loan_amount"] = amount
+                state.sales_step = "tenure"
                 result = await self._ask_tenure(amount)
                 result["next_action"] = "continue"
                 return result
@@ -43,11 +54,11 @@ Don't worry about being exact right now - we can always adjust it based on what
                 result["next_action"] = "continue"
                 return result
                 
-        elif self.current_step == "tenure":
+        elif state.sales_step == "tenure":
             tenure = self._extract_tenure(user_message)
             if tenure:
-                self.collected_data["tenure"] = tenure
-                self.current_step = "purpose"
+                collected_data["tenure"] = tenure
+                state.sales_step = "purpose"
                 result = await self._ask_purpose()
                 result["next_action"] = "continue"
                 return result
@@ -56,24 +67,25 @@ Don't worry about being exact right now - we can always adjust it based on what
                 result["next_action"] = "continue"
                 return result
                 
-        elif self.current_step == "purpose":
+        elif state.sales_step == "purpose":
             purpose = user_message.strip()
-            self.collected_data["purpose"] = purpose
-            self.current_step = "phone"
+            collected_data["purpose"] = purpose
+            state.sales_step = "phone"
             result = await self._ask_phone()
             result["next_action"] = "continue"
             return result
             
-        elif self.current_step == "phone":
+        elif state.sales_step == "phone":
             phone = self._extract_phone(user_message)
             if phone:
-                self.collected_data["phone"] = phone
-                return await self._complete_sales()
+                collected_data["phone"] = phone
+                return await self._complete_sales(collected_data)
             else:
                 result = self._ask_phone_clarification()
                 result["next_action"] = "continue"
                 return result
     
+    @traced("sales.extract_amount")
     def _extract_amount(self, message: str) -> int:
         """Extract loan amount from user message"""
         import re
@@ -94,6 +106,7 @@ Don't worry about being exact right now - we can always adjust it based on what
         
         return None
     
+    @traced("sales.extract_tenure")
     def _extract_tenure(self, message: str) -> int:
         """Extract tenure from user message"""
         import re
@@ -119,6 +132,7 @@ Don't worry about being exact right now - we can always adjust it based on what
         
         return None
     
+    @traced("sales.extract_phone")
     def _extract_phone(self, message: str) -> str:
         """Extract phone number from user message"""
         import re
@@ -219,12 +233,13 @@ What's your mobile number?
             "suggestions": ["9876543210 (Demo - Instant Approval)", "9876543211 (Demo - Salary Required)", "9876543212 (Demo - Rejection)"]
         }
     
-    async def _complete_sales(self) -> Dict[str, Any]:
+    async def _complete_sales(self, collected_data: Dict[str, Any]) -> Dict[str, Any]:
         """Complete sales process and move to verification"""
-        amount = self.collected_data["loan_amount"]
-        tenure = self.collected_data["tenure"]
-        purpose = self.collected_data["purpose"]
+        amount = collected_data["loan_amount"]
+        tenure = collected_data["tenure"]
+        purpose = collected_data["purpose"]
         emi = self._calculate_emi(amount, tenure)
+        lowest_rate, highest_rate = self.rate_cards.current().rate_range()
         
         message = f"""
 Perfect! Let me just summarize everything to make sure we're on the same page! 📋
@@ -235,7 +250,7 @@ Perfect! Let me just summarize everything to make sure we're on the same page! 
 📅 **Tenure**: {tenure} months ({tenure//12} years {tenure%12 if tenure%12 > 0 else ''} months)
 💳 **Monthly EMI**: ₹{emi:,}
 🎯 **Purpose**: {purpose.title()}
-🏷️ **Interest Rate**: 10.99% - 24.99%* (depends on your profile)
+🏷️ **Interest Rate**: {format_rate(lowest_rate)} - {format_rate(highest_rate)}* (depends on your profile)
 🚀 **Processing Fee**: ₹999 + GST
 
 *Don't worry about the rate range - with your profile, I'm confident you'll get a great rate!
@@ -250,15 +265,13 @@ Ready? Let's do this! 🚀
         return {
             "content": message,
             "next_action": "verification",
-            "collected_data": self.collected_data,
+            "collected_data": collected_data,
             "metadata": {"sales_complete": True}
         }
     
     def _calculate_emi(self, amount: int, tenure: int) -> int:
-        """Calculate EMI using standard formula"""
-        rate = 0.15 / 12  # 15% annual rate
-        emi = amount * rate * (1 + rate)**tenure / ((1 + rate)**tenure - 1)
-        return int(emi)
+        """Indicative EMI at the standard rate"""
+        return self.rate_cards.current().emi(None, amount, tenure)
     
     def _ask_amount_clarification(self) -> Dict[str, Any]:
         """Ask for amount clarification"""
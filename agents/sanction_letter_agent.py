@@ -1,32 +1,69 @@
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional
 from datetime import datetime, timedelta
+import io
+import random
 import uuid
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
 import os
 
+from utils.document_cache import get_document_cache
+from utils.download_tokens import signed_download_url
+from utils.job_queue import PRIORITY_HIGH, job
+from utils.tracing import traced
+
+from .pricing import RateCardStore, format_rate, get_rate_card_store, price_loan
+from .sanction_letter_template import get_sanction_letter_template
+
 class SanctionLetterAgent:
-    def __init__(self):
+    def __init__(self, in_memory: Optional[bool] = None, rng: Optional[random.Random] = None,
+                 clock: Optional[Callable[[], datetime]] = None, jobs=None,
+                 rate_cards: Optional[RateCardStore] = None):
         self.template_path = "templates/"
-        
+        # Only for letters whose application wasn't priced by underwriting
+        self.rate_cards = rate_cards or get_rate_card_store()
+        # With a job queue, in-memory letters are rendered by its workers
+        self.jobs = jobs
+        # Approval IDs and dates; the replay engine pins both for reproducible letters
+        self.rng = rng
+        self.clock = clock or datetime.now
+        # Render letters into memory and persist them in the background
+        # (SANCTION_LETTER_IN_MEMORY=0 writes them to disk inline instead)
+        if in_memory is None:
+            in_memory = os.getenv("SANCTION_LETTER_IN_MEMORY", "1") != "0"
+        self.in_memory = in_memory
+        
+    @traced("sanction.generate_letter")
     async def generate_sanction_letter(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Generate official sanction letter PDF"""
         
         # Generate approval details
-        approval_id = f"TC{datetime.now().strftime('%Y%m%d')}{str(uuid.uuid4())[:6].upper()}"
-        approval_date = datetime.now().strftime("%B %d, %Y")
-        disbursal_date = (datetime.now() + timedelta(days=1)).strftime("%B %d, %Y")
+        now = self.clock()
+        suffix = f"{self.rng.getrandbits(24):06X}" if self.rng else str(uuid.uuid4())[:6].upper()
+        approval_id = f"TC{now.strftime('%Y%m%d')}{suffix}"
+        approval_date = now.strftime("%B %d, %Y")
+        disbursal_date = (now + timedelta(days=1)).strftime("%B %d, %Y")
+        first_emi_date = self._get_first_emi_date(now)
         
         # Create PDF
         pdf_filename = f"sanction_letter_{approval_id}.pdf"
         pdf_path = f"generated_docs/{pdf_filename}"
         
-        # Ensure directory exists
-        os.makedirs("generated_docs", exist_ok=True)
-        
         # Generate PDF
-        self._create_sanction_letter_pdf(pdf_path, context, approval_id, approval_date, disbursal_date)
+        if self.in_memory:
+            # Served from the document cache right away, written to disk in the background
+            if self.jobs is not None:
+                # Dates go in explicitly: the job's own agent has neither this clock nor rng
+                data = await self.jobs.run("sanction.render_pdf", context, approval_id, approval_date, disbursal_date,
+                                           first_emi_date, idempotency_key=f"letter:{approval_id}")
+            else:
+                buffer = io.BytesIO()
+                self._create_sanction_letter_pdf(buffer, context, approval_id, approval_date, disbursal_date,
+                                                 first_emi_date)
+                data = buffer.getvalue()
+            get_document_cache().put(approval_id, pdf_filename, data)
+        else:
+            os.makedirs("generated_docs", exist_ok=True)
+            self._create_sanction_letter_pdf(pdf_path, context, approval_id, approval_date, disbursal_date,
+                                             first_emi_date)
         
         # Get customer name from context
         customer_name = context.get('name', 'Valued Customer')
@@ -69,35 +106,27 @@ Is there anything else I can help you with today? 😊
                 "sanction_letter_generated": True,
                 "approval_id": approval_id,
                 "pdf_path": pdf_path,
-                "download_url": f"/download/{pdf_filename}"
+                "download_url": signed_download_url(pdf_filename)
             }
         }
     
-    def _create_sanction_letter_pdf(self, pdf_path: str, context: Dict[str, Any], 
-                                   approval_id: str, approval_date: str, disbursal_date: str):
-        """Create the actual PDF sanction letter with professional format"""
-        
-        c = canvas.Canvas(pdf_path, pagesize=letter)
-        width, height = letter
-        
-        # Header with Tata Capital branding
-        c.setFillColorRGB(0.1, 0.2, 0.5)  # Dark blue color
-        c.rect(0, height - 120, width, 120, fill=1)
-        
-        # Company Logo and Name
-        c.setFillColorRGB(1, 1, 1)  # White text
-        c.setFont("Helvetica-Bold", 24)
-        c.drawString(50, height - 60, "TATA CAPITAL")
-        c.setFont("Helvetica", 14)
-        c.drawString(50, height - 80, "Financial Services Limited")
-        c.drawString(50, height - 100, "CIN: U65923MH2007PLC169607")
-        
-        # Document title
-        c.setFillColorRGB(0, 0, 0)  # Black text
-        c.setFont("Helvetica-Bold", 18)
-        title = "PERSONAL LOAN SANCTION LETTER"
-        title_width = c.stringWidth(title, "Helvetica-Bold", 18)
-        c.drawString((width - title_width) / 2, height - 160, title)
+    @traced("sanction.render_pdf")
+    def _create_sanction_letter_pdf(self, output, context: Dict[str, Any], 
+                                   approval_id: str, approval_date: str, disbursal_date: str,
+                                   first_emi_date: str):
+        """Create the actual PDF sanction letter with professional format.
+        
+        ``output`` is a file path or a binary file object such as BytesIO.
+        Every date is passed in, so the letter doesn't depend on which agent
+        (or job worker) renders it.
+        """
+        # Header, table labels, terms and footer are cached per process,
+        # only the applicant specific fields are drawn here
+        template = get_sanction_letter_template()
+        c = template.new_canvas(output)
+        width, height = template.width, template.height
+        
+        template.draw_layer(c, 0)
         
         # Reference details (right aligned)
         c.setFont("Helvetica", 10)
@@ -105,167 +134,72 @@ Is there anything else I can help you with today? 😊
         c.drawRightString(width - 50, height - 155, f"Date: {approval_date}")
         
         # Customer Address Section
-        y_pos = height - 200
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y_pos, "To,")
-        
-        y_pos -= 20
-        c.setFont("Helvetica", 11)
         customer_name = context.get('name', 'Valued Customer')
-        c.drawString(50, y_pos, f"Mr./Ms. {customer_name}")
-        
-        y_pos -= 15
         customer_city = context.get('city', 'Your City')
-        c.drawString(50, y_pos, f"{customer_city}")
-        
-        y_pos -= 15
         customer_phone = context.get('phone', 'N/A')
-        c.drawString(50, y_pos, f"Mobile: {customer_phone}")
-        
-        # Salutation and main content
-        y_pos -= 40
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y_pos, f"Dear {customer_name.split()[0] if customer_name != 'Valued Customer' else 'Sir/Madam'},")
-        
-        y_pos -= 30
+        name_y, city_y, phone_y = template.address_y
         c.setFont("Helvetica", 11)
-        c.drawString(50, y_pos, "Subject: Approval of Personal Loan Application")
-        
-        y_pos -= 25
-        c.drawString(50, y_pos, "We are pleased to inform you that your Personal Loan application has been")
-        y_pos -= 15
-        c.drawString(50, y_pos, "APPROVED. The loan is sanctioned subject to the terms and conditions mentioned below:")
+        c.drawString(50, name_y, f"Mr./Ms. {customer_name}")
+        c.drawString(50, city_y, f"{customer_city}")
+        c.drawString(50, phone_y, f"Mobile: {customer_phone}")
         
-        # Loan Details in a professional table format
-        y_pos -= 40
+        # Salutation
         c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y_pos, "LOAN SANCTION DETAILS:")
-        
-        # Draw table header
-        y_pos -= 25
-        c.setFillColorRGB(0.9, 0.9, 0.9)  # Light gray background
-        c.rect(50, y_pos - 15, width - 100, 20, fill=1)
-        
-        c.setFillColorRGB(0, 0, 0)  # Black text
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(60, y_pos - 10, "PARTICULARS")
-        c.drawString(300, y_pos - 10, "DETAILS")
-        
-        # Loan details data
-        y_pos -= 25
-        c.setFont("Helvetica", 10)
+        c.drawString(50, template.salutation_y, f"Dear {customer_name.split()[0] if customer_name != 'Valued Customer' else 'Sir/Madam'},")
         
+        # Loan details, in the same order as the template's row labels
         loan_amount = context.get('loan_amount', 0)
         tenure_months = context.get('tenure', 12)
         tenure_years = tenure_months // 12
         tenure_remaining_months = tenure_months % 12
         tenure_display = f"{tenure_years} years" + (f" {tenure_remaining_months} months" if tenure_remaining_months > 0 else "")
-        emi = self._calculate_emi(loan_amount, tenure_months)
+        # The rate the application was approved at, even if the rate card changed since
+        quote = context.get("loan_quote") or price_loan(self.rate_cards.current(), context)
         
         loan_details = [
-            ("Applicant Name", customer_name),
-            ("Customer ID", context.get('customer_id', 'N/A')),
-            ("Loan Amount Sanctioned", f"₹ {loan_amount:,}"),
-            ("Rate of Interest", "12.99% per annum (reducing balance)"),
-            ("Loan Tenure", f"{tenure_months} months ({tenure_display})"),
-            ("EMI Amount", f"₹ {emi:,}"),
-            ("Processing Fee", "₹ 999 + GST (18%)"),
-            ("Total Processing Fee", "₹ 1,178"),
-            ("Credit Score", str(context.get('credit_score', 'N/A'))),
-            ("Pre-approved Limit", f"₹ {context.get('preapproved_limit', 0):,}"),
-            ("Loan Purpose", context.get('purpose', 'Personal use')),
-            ("Disbursal Mode", "NEFT/RTGS to registered bank account"),
-            ("Expected Disbursal Date", disbursal_date),
-            ("First EMI Due Date", self._get_first_emi_date()),
+            customer_name,
+            context.get('customer_id', 'N/A'),
+            f"₹ {loan_amount:,}",
+            f"{format_rate(quote['rate'])} per annum (reducing balance)",
+            f"{tenure_months} months ({tenure_display})",
+            f"₹ {quote['emi']:,}",
+            "₹ 999 + GST (18%)",
+            "₹ 1,178",
+            str(context.get('credit_score', 'N/A')),
+            f"₹ {context.get('preapproved_limit', 0):,}",
+            context.get('purpose', 'Personal use'),
+            "NEFT/RTGS to registered bank account",
+            disbursal_date,
+            first_emi_date,
         ]
         
-        for i, (label, value) in enumerate(loan_details):
-            # Alternate row colors
-            if i % 2 == 0:
-                c.setFillColorRGB(0.95, 0.95, 0.95)
-                c.rect(50, y_pos - 12, width - 100, 15, fill=1)
-            
-            c.setFillColorRGB(0, 0, 0)
-            c.drawString(60, y_pos - 8, label)
-            c.drawString(300, y_pos - 8, str(value))
-            y_pos -= 15
-        
-        # Important Terms and Conditions
-        y_pos -= 20
-        c.setFont("Helvetica-Bold", 11)
-        c.drawString(50, y_pos, "IMPORTANT TERMS & CONDITIONS:")
-        
-        y_pos -= 20
-        c.setFont("Helvetica", 9)
-        terms = [
-            "1. This sanction letter is valid for 30 days from the date of issue.",
-            "2. Loan disbursal is subject to completion of documentation and verification.",
-            "3. Interest will be charged from the date of disbursal at the rate mentioned above.",
-            "4. EMI will commence from the month following disbursal as per the schedule.",
-            "5. Prepayment: Allowed after 6 months with 2% + GST charges on outstanding principal.",
-            "6. Late Payment: Penal charges of 2% per month will be levied on overdue amounts.",
-            "7. The loan is secured by post-dated cheques/ECS mandate for EMI payments.",
-            "8. Any change in personal/employment details must be intimated immediately.",
-            "9. This loan is governed by the terms of the loan agreement to be executed.",
-            "10. For any queries, please contact our customer care at 1800-209-8800."
-        ]
-        
-        for term in terms:
-            if y_pos < 100:  # Check if we need a new page
-                c.showPage()
-                y_pos = height - 50
-            c.drawString(50, y_pos, term)
-            y_pos -= 12
-        
-        # Congratulations message
-        y_pos -= 20
-        c.setFont("Helvetica-Bold", 11)
-        c.setFillColorRGB(0.1, 0.6, 0.1)  # Green color
-        c.drawString(50, y_pos, "🎉 Congratulations on your loan approval!")
-        
-        # Footer section
-        y_pos = 120
-        c.setFillColorRGB(0, 0, 0)  # Black text
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(50, y_pos, "For Tata Capital Financial Services Limited")
-        
-        y_pos -= 30
-        c.drawString(50, y_pos, "Authorized Signatory")
-        c.drawString(50, y_pos - 15, "Branch Manager")
-        
-        # Contact information (right side)
-        c.drawString(350, y_pos + 15, "Customer Care: 1800-209-8800")
-        c.drawString(350, y_pos, "Email: customercare@tatacapital.com")
-        c.drawString(350, y_pos - 15, "Website: www.tatacapital.com")
-        
-        # Footer line
-        c.setStrokeColorRGB(0.1, 0.2, 0.5)
-        c.line(50, 50, width - 50, 50)
+        c.setFont("Helvetica", 10)
+        c.setFillColorRGB(0, 0, 0)
+        for y_pos, value in zip(template.detail_rows_y, loan_details):
+            c.drawString(300, y_pos, str(value))
         
-        c.setFont("Helvetica", 8)
-        footer_text = "This is a computer generated document and does not require physical signature."
-        footer_width = c.stringWidth(footer_text, "Helvetica", 8)
-        c.drawString((width - footer_width) / 2, 35, footer_text)
+        # Remaining pages (terms, congratulations, footer) are fully static
+        for page in range(1, template.pages):
+            c.showPage()
+            template.draw_layer(c, page)
         
         c.save()
     
-    def _get_first_emi_date(self) -> str:
-        """Calculate first EMI date (next month)"""
-        from datetime import datetime, timedelta
-        import calendar
-        
-        today = datetime.now()
+    def _get_first_emi_date(self, today: datetime) -> str:
+        """Calculate first EMI date (the 5th of next month)"""
         if today.month == 12:
             next_month = today.replace(year=today.year + 1, month=1, day=5)
         else:
             next_month = today.replace(month=today.month + 1, day=5)
         
         return next_month.strftime("%B %d, %Y")
-    
-    def _calculate_emi(self, amount: int, tenure: int) -> int:
-        """Calculate EMI for sanction letter"""
-        rate = 0.1299 / 12  # 12.99% annual rate
-        if amount == 0 or tenure == 0:
-            return 0
-        emi = amount * rate * (1 + rate)**tenure / ((1 + rate)**tenure - 1)
-        return int(emi)
\ No newline at end of file
+
+
+@job("sanction.render_pdf", priority=PRIORITY_HIGH, retries=1)
+def render_sanction_letter_pdf(context: Dict[str, Any], approval_id: str, approval_date: str,
+                               disbursal_date: str, first_emi_date: str) -> bytes:
+    """Render a sanction letter into memory, on a job queue worker"""
+    buffer = io.BytesIO()
+    SanctionLetterAgent(in_memory=True)._create_sanction_letter_pdf(
+        buffer, context, approval_id, approval_date, disbursal_date, first_emi_date)
+    return buffer.getvalue()
@@ -0,0 +1,286 @@
+"""
+Static layers of the sanction letter.
+
+Everything on the letter except the customer, loan and date fields is the
+same for every applicant: the branded header band, title, table labels,
+terms and conditions and footer. Those parts are drawn once per process on
+a scratch canvas and their PDF drawing operators are kept. Each letter then
+replays them into its page streams and only draws its variable fields.
+
+Replaying operators relies on reportlab canvas internals, so it is only used
+with the reportlab versions in REPLAY_VERSIONS. With any other version each
+letter draws the static layers as form XObjects through the public API
+instead: correct, but without the savings.
+"""
+import io
+from typing import List, Optional
+
+# Fixed layout of the letter (PDF points, origin bottom-left)
+MARGIN = 50
+LABEL_X = 60
+VALUE_X = 300
+ROW_HEIGHT = 15
+TERM_LINE_HEIGHT = 12
+PAGE_BREAK_Y = 100  # Content below this starts a new page
+
+# reportlab major versions whose canvas internals (_code, _doc) the replay is tested against
+REPLAY_VERSIONS = range(3, 6)
+
+# Fonts are registered in this order on every canvas so the internal font
+# names baked into the cached operators (/F1, /F2, ...) always match.
+# ZapfDingbats is what reportlab substitutes for the emoji and rupee sign.
+FONTS = ("Helvetica", "Helvetica-Bold", "ZapfDingbats")
+
+LOAN_DETAIL_LABELS = (
+    "Applicant Name",
+    "Customer ID",
+    "Loan Amount Sanctioned",
+    "Rate of Interest",
+    "Loan Tenure",
+    "EMI Amount",
+    "Processing Fee",
+    "Total Processing Fee",
+    "Credit Score",
+    "Pre-approved Limit",
+    "Loan Purpose",
+    "Disbursal Mode",
+    "Expected Disbursal Date",
+    "First EMI Due Date",
+)
+
+TERMS = (
+    "1. This sanction letter is valid for 30 days from the date of issue.",
+    "2. Loan disbursal is subject to completion of documentation and verification.",
+    "3. Interest will be charged from the date of disbursal at the rate mentioned above.",
+    "4. EMI will commence from the month following disbursal as per the schedule.",
+    "5. Prepayment: Allowed after 6 months with 2% + GST charges on outstanding principal.",
+    "6. Late Payment: Penal charges of 2% per month will be levied on overdue amounts.",
+    "7. The loan is secured by post-dated cheques/ECS mandate for EMI payments.",
+    "8. Any change in personal/employment details must be intimated immediately.",
+    "9. This loan is governed by the terms of the loan agreement to be executed.",
+    "10. For any queries, please contact our customer care at 1800-209-8800.",
+)
+
+
+def replay_supported() -> bool:
+    """Whether the installed reportlab can have cached operators replayed into its canvases"""
+    import reportlab
+    try:
+        major = int(reportlab.Version.split(".")[0])
+    except ValueError:
+        return False
+    return major in REPLAY_VERSIONS
+
+
+def _binary_canvas_class():
+    """Canvas whose page streams are compressed without ASCII85 wrapping.
+
+    reportlab picks stream filters from the process-wide ``rl_config.useA85``
+    when the document is saved; building each page's stream here keeps the
+    setting to letters instead of changing it for every canvas in the process.
+    """
+    from reportlab.pdfbase import pdfdoc
+    from reportlab.pdfgen import canvas
+
+    class BinaryStreamCanvas(canvas.Canvas):
+        def showPage(self):
+            super().showPage()
+            page = self._doc.Pages.pages[-1]
+            if page.compression and page.stream:
+                page.Contents = pdfdoc.PDFStream(content=page.stream, filters=[pdfdoc.PDFZCompress])
+                page.Contents.__Comment__ = "page stream"
+
+    return BinaryStreamCanvas
+
+
+def _layer_name(page: int) -> str:
+    return f"layer_{page}"
+
+
+class SanctionLetterTemplate:
+    def __init__(self, replay: Optional[bool] = None):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+
+        self.replay = replay_supported() if replay is None else replay
+        # Letters are only ever served as binary downloads, so skip the
+        # ASCII85 wrapping of compressed streams: ~25% smaller and no pure
+        # Python encoding pass on every save
+        self.canvas_class = _binary_canvas_class() if self.replay else canvas.Canvas
+        self.pagesize = letter
+        self.width, self.height = letter
+
+        # Positions of the variable fields, filled in while drawing the layers
+        self.address_y: List[float] = []
+        self.salutation_y: float = 0
+        self.detail_rows_y: List[float] = []
+
+        # Cached drawing operators, one list per page (replay only)
+        self.layers: List[List[str]] = []
+        self.pages = 0
+        self._draw_static_layers(self.new_canvas(io.BytesIO()), record=self.replay)
+
+    def new_canvas(self, target):
+        """Create a canvas for a letter with the template's fonts pre-registered"""
+        c = self.canvas_class(target, pagesize=self.pagesize)
+        if self.replay:
+            for font in FONTS:
+                c._doc.getInternalFontName(font)
+        return c
+
+    def draw_layer(self, c, page: int):
+        """Draw the static layer of ``page`` onto the canvas' current page.
+
+        When replaying, the operators are spliced straight into the page
+        stream rather than wrapped in a form XObject, which keeps letters as
+        small as before. They leave font and colour changed, so callers set
+        both explicitly before drawing variable fields.
+        """
+        if self.replay:
+            c._code.extend(self.layers[page])
+            return
+        if not c.hasForm(_layer_name(0)):
+            self._draw_static_layers(c)
+        c.doForm(_layer_name(page))
+
+    def _begin_layer(self, c):
+        c.beginForm(_layer_name(self.pages))
+
+    def _end_layer(self, c, record: bool):
+        if record:
+            self.layers.append(list(c._code))
+        c.endForm()
+        self.pages += 1
+
+    def _draw_static_layers(self, c, record: bool = False):
+        """Draw every page's static layer as a form on ``c``, noting where the variable fields go"""
+        width, height = self.width, self.height
+        self.pages = 0
+        self.detail_rows_y = []
+        self._begin_layer(c)
+
+        # Header with Tata Capital branding
+        c.setFillColorRGB(0.1, 0.2, 0.5)  # Dark blue color
+        c.rect(0, height - 120, width, 120, fill=1)
+
+        # Company Logo and Name
+        c.setFillColorRGB(1, 1, 1)  # White text
+        c.setFont("Helvetica-Bold", 24)
+        c.drawString(MARGIN, height - 60, "TATA CAPITAL")
+        c.setFont("Helvetica", 14)
+        c.drawString(MARGIN, height - 80, "Financial Services Limited")
+        c.drawString(MARGIN, height - 100, "CIN: U65923MH2007PLC169607")
+
+        # Document title
+        c.setFillColorRGB(0, 0, 0)  # Black text
+        c.setFont("Helvetica-Bold", 18)
+        title = "PERSONAL LOAN SANCTION LETTER"
+        title_width = c.stringWidth(title, "Helvetica-Bold", 18)
+        c.drawString((width - title_width) / 2, height - 160, title)
+
+        # Customer address block: name, city and mobile are variable
+        y_pos = height - 200
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(MARGIN, y_pos, "To,")
+        y_pos -= 20
+        self.address_y = [y_pos, y_pos - 15, y_pos - 30]
+        y_pos -= 30
+
+        # Salutation is variable, the subject and opening paragraph are not
+        y_pos -= 40
+        self.salutation_y = y_pos
+
+        y_pos -= 30
+        c.setFont("Helvetica", 11)
+        c.drawString(MARGIN, y_pos, "Subject: Approval of Personal Loan Application")
+
+        y_pos -= 25
+        c.drawString(MARGIN, y_pos, "We are pleased to inform you that your Personal Loan application has been")
+        y_pos -= 15
+        c.drawString(MARGIN, y_pos, "APPROVED. The loan is sanctioned subject to the terms and conditions mentioned below:")
+
+        # Loan details table: header, row shading and labels
+        y_pos -= 40
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(MARGIN, y_pos, "LOAN SANCTION DETAILS:")
+
+        y_pos -= 25
+        c.setFillColorRGB(0.9, 0.9, 0.9)  # Light gray background
+        c.rect(MARGIN, y_pos - 15, width - 100, 20, fill=1)
+
+        c.setFillColorRGB(0, 0, 0)  # Black text
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(LABEL_X, y_pos - 10, "PARTICULARS")
+        c.drawString(VALUE_X, y_pos - 10, "DETAILS")
+
+        y_pos -= 25
+        c.setFont("Helvetica", 10)
+        for i, label in enumerate(LOAN_DETAIL_LABELS):
+            # Alternate row colors
+            if i % 2 == 0:
+                c.setFillColorRGB(0.95, 0.95, 0.95)
+                c.rect(MARGIN, y_pos - 12, width - 100, 15, fill=1)
+
+            c.setFillColorRGB(0, 0, 0)
+            c.drawString(LABEL_X, y_pos - 8, label)
+            self.detail_rows_y.append(y_pos - 8)
+            y_pos -= ROW_HEIGHT
+
+        # Important Terms and Conditions
+        y_pos -= 20
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(MARGIN, y_pos, "IMPORTANT TERMS & CONDITIONS:")
+
+        y_pos -= 20
+        c.setFont("Helvetica", 9)
+        for term in TERMS:
+            if y_pos < PAGE_BREAK_Y:
+                # Close this page's layer and start the next one's
+                self._end_layer(c, record)
+                self._begin_layer(c)
+                y_pos = height - 50
+                c.setFont("Helvetica", 12)  # A new page starts in the canvas default font
+            c.drawString(MARGIN, y_pos, term)
+            y_pos -= TERM_LINE_HEIGHT
+
+        # Congratulations message
+        y_pos -= 20
+        c.setFont("Helvetica-Bold", 11)
+        c.setFillColorRGB(0.1, 0.6, 0.1)  # Green color
+        c.drawString(MARGIN, y_pos, "🎉 Congratulations on your loan approval!")
+
+        # Footer section
+        y_pos = 120
+        c.setFillColorRGB(0, 0, 0)  # Black text
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(MARGIN, y_pos, "For Tata Capital Financial Services Limited")
+
+        y_pos -= 30
+        c.drawString(MARGIN, y_pos, "Authorized Signatory")
+        c.drawString(MARGIN, y_pos - 15, "Branch Manager")
+
+        # Contact information (right side)
+        c.drawString(350, y_pos + 15, "Customer Care: 1800-209-8800")
+        c.drawString(350, y_pos, "Email: customercare@tatacapital.com")
+        c.drawString(350, y_pos - 15, "Website: www.tatacapital.com")
+
+        # Footer line
+        c.setStrokeColorRGB(0.1, 0.2, 0.5)
+        c.line(MARGIN, 50, width - 50, 50)
+
+        c.setFont("Helvetica", 8)
+        footer_text = "This is a computer generated document and does not require physical signature."
+        footer_width = c.stringWidth(footer_text, "Helvetica", 8)
+        c.drawString((width - footer_width) / 2, 35, footer_text)
+        self._end_layer(c, record)
+
+
+_template: Optional[SanctionLetterTemplate] = None
+
+
+def get_sanction_letter_template() -> SanctionLetterTemplate:
+    """Get the process-wide template, rendering the static layers on first use"""
+    global _template
+    if _template is None:
+        _template = SanctionLetterTemplate()
+    return _template
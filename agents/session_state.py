@@ -0,0 +1,48 @@
+"""
+Everything the agents remember about one conversation.
+
+The agents themselves hold only services and configuration, so one set of
+them serves every session of a worker; each turn is handed the session's
+``SessionState``. Apart from an in-flight prefetch, the state is plain data
+and round-trips through ``to_dict``/``from_dict``.
+"""
+from typing import Any, Dict, Optional
+
+from .prefetch import CustomerPrefetch
+
+
+class SessionState:
+    __slots__ = ("session_id", "conversation_state", "user_context", "sales_step", "sales_data",
+                 "verification_step", "stage_since", "prefetch")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.conversation_state = "greeting"
+        self.user_context: Dict[str, Any] = {}
+        self.sales_step = "loan_amount"
+        self.sales_data: Optional[Dict[str, Any]] = None  # Created when sales collects the first answer
+        self.verification_step = "phone_otp"
+        self.stage_since = 0.0  # When the session entered its funnel stage (utils/funnel.py)
+        self.prefetch: Optional[CustomerPrefetch] = None  # Background lookups; never serialized
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "conversation_state": self.conversation_state,
+            "user_context": self.user_context,
+            "sales_step": self.sales_step,
+            "sales_data": self.sales_data or {},
+            "verification_step": self.verification_step,
+            "stage_since": self.stage_since,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SessionState":
+        state = cls(data["session_id"])
+        state.conversation_state = data.get("conversation_state", state.conversation_state)
+        state.user_context = dict(data.get("user_context") or {})
+        state.sales_step = data.get("sales_step", state.sales_step)
+        state.sales_data = dict(data["sales_data"]) if data.get("sales_data") else None
+        state.verification_step = data.get("verification_step", state.verification_step)
+        state.stage_since = data.get("stage_since", state.stage_since)
+        return state
@@ -0,0 +1,110 @@
+"""
+Declarative conversation flow.
+
+MasterAgent's flow is a table of transitions: for a conversation state and
+an event, the handler that answers the turn and the states it may leave the
+conversation in. An event is the message's intent in states that branch on
+intent; ANY_EVENT rows take every other message and ANY_STATE rows apply in
+every state. The table is checked when it is built, at import: every state
+has a catch-all row, every state is reachable from the initial one and every
+handler is callable. Dispatching a turn is then at most three dict lookups.
+
+Each dispatched turn counts the edge it took, (state, event, next state), so
+``coverage`` can show which declared edges traffic or a replay never took and
+which edges were taken without being declared.
+"""
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+ANY_STATE = "*"
+ANY_EVENT = "*"
+
+
+class TransitionError(ValueError):
+    """The transition table is inconsistent"""
+
+
+class Transition:
+    __slots__ = ("state", "event", "handler", "next_states")
+
+    def __init__(self, state: str, event: str, handler: Callable, next_states: Sequence[str]):
+        self.state = state
+        self.event = event
+        self.handler = handler  # Coroutine function taking (agent, session state, user message)
+        self.next_states = tuple(next_states)
+
+
+class TransitionTable:
+    def __init__(self, transitions: Iterable[Transition], initial: str):
+        self.rows: Dict[Tuple[str, str], Transition] = {}
+        for transition in transitions:
+            key = (transition.state, transition.event)
+            if key in self.rows:
+                raise TransitionError(f"duplicate transition for state {key[0]!r} on {key[1]!r}")
+            self.rows[key] = transition
+        self.initial = initial
+        self.states = sorted({state for state, _ in self.rows if state != ANY_STATE}
+                             | {state for row in self.rows.values() for state in row.next_states})
+        # States whose rows depend on the intent; elsewhere the intent isn't worked out
+        self.branching_states = frozenset(state for state, event in self.rows
+                                          if state != ANY_STATE and event != ANY_EVENT)
+        self.edges: Counter = Counter()  # (state, event, next state) -> turns, keyed by the row taken
+        self._validate()
+
+    def _validate(self):
+        for row in self.rows.values():
+            if not callable(row.handler):
+                raise TransitionError(f"handler for {row.state!r} on {row.event!r} is not callable")
+            if not row.next_states:
+                raise TransitionError(f"transition for {row.state!r} on {row.event!r} has no next states")
+        if self.initial not in self.states:
+            raise TransitionError(f"initial state {self.initial!r} has no transitions")
+        # A state without a catch-all would leave some messages with nowhere to go
+        dead = [state for state in self.states if (state, ANY_EVENT) not in self.rows]
+        if dead:
+            raise TransitionError(f"states without a catch-all transition: {', '.join(dead)}")
+        reached, pending = {self.initial}, [self.initial]
+        while pending:
+            state = pending.pop()
+            for (source, _), row in self.rows.items():
+                if source not in (state, ANY_STATE):
+                    continue
+                for next_state in row.next_states:
+                    if next_state not in reached:
+                        reached.add(next_state)
+                        pending.append(next_state)
+        unreachable = [state for state in self.states if state not in reached]
+        if unreachable:
+            raise TransitionError(f"states unreachable from {self.initial!r}: {', '.join(unreachable)}")
+
+    def lookup(self, state: str, event: str) -> Optional[Transition]:
+        """The row for ``event`` in ``state``; None only for a state the table doesn't know"""
+        rows = self.rows
+        return rows.get((state, event)) or rows.get((ANY_STATE, event)) or rows.get((state, ANY_EVENT))
+
+    def record(self, transition: Transition, next_state: str):
+        self.edges[(transition.state, transition.event, next_state)] += 1
+
+    def coverage(self, edges: Optional[Counter] = None) -> List[Dict]:
+        """Turns per declared edge, then any edges taken that the table doesn't declare"""
+        edges = self.edges if edges is None else edges
+        declared = [(row.state, row.event, next_state)
+                    for row in self.rows.values() for next_state in row.next_states]
+        rows = [{"state": state, "event": event, "next_state": next_state,
+                 "turns": edges.get((state, event, next_state), 0), "declared": True}
+                for state, event, next_state in declared]
+        declared = set(declared)
+        rows += [{"state": state, "event": event, "next_state": next_state, "turns": turns, "declared": False}
+                 for (state, event, next_state), turns in sorted(edges.items()) if (state, event, next_state) not in declared]
+        return rows
+
+    def format_coverage(self, edges: Optional[Counter] = None) -> str:
+        rows = self.coverage(edges)
+        declared = [row for row in rows if row["declared"]]
+        taken = sum(1 for row in declared if row["turns"])
+        lines = [f"Transition coverage: {taken} of {len(declared)} declared edges taken",
+                 f"  {'state':<16} {'event':<14} {'next state':<16} {'turns':>8}"]
+        for row in rows:
+            note = "" if row["turns"] and row["declared"] else "  never taken" if row["declared"] else "  UNDECLARED"
+            lines.append(f"  {row['state']:<16} {row['event']:<14} {row['next_state']:<16} {row['turns']:>8,}{note}")
+        return "\n".join(lines)
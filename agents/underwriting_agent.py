@@ -1,12 +1,33 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from mock_services.adapters import as_bureau_adapter
+from utils.tracing import traced
+
+from .prefetch import CustomerPrefetch
+from .pricing import RateCardStore, format_rate, get_rate_card_store, price_loan
+from .underwriting_policy import PolicyStore, get_policy_store
 
 class UnderwritingAgent:
-    def __init__(self, credit_service):
-        self.credit_service = credit_service
-        
-    async def evaluate_loan(self, context: Dict[str, Any]) -> Dict[str, Any]:
+    def __init__(self, credit_service, policy_store: Optional[PolicyStore] = None,
+                 rate_cards: Optional[RateCardStore] = None):
+        self.bureau = as_bureau_adapter(credit_service)
+        # Thresholds come from config/underwriting_policy.json, rates from config/rate_card.json; both hot-reloaded
+        self.policy_store = policy_store or get_policy_store()
+        self.rate_cards = rate_cards or get_rate_card_store()
+        
+    @traced("underwriting.evaluate_loan")
+    async def evaluate_loan(self, context: Dict[str, Any],
+                            prefetch: Optional[CustomerPrefetch] = None) -> Dict[str, Any]:
         """Main underwriting logic"""
         
+        # Keep the bureau report with the application; the decision itself is
+        # still made on the CRM credit score and pre-approved limit
+        phone = context.get("phone")
+        if prefetch is not None and prefetch.phone == phone:
+            context["bureau_report"] = await prefetch.bureau_report()
+        elif phone and "bureau_report" not in context:
+            context["bureau_report"] = await self.bureau.get_bureau_report(phone)
+        
         # Get customer data
         credit_score = context.get("credit_score", 0)
         loan_amount = context.get("loan_amount", 0)
@@ -14,72 +35,73 @@ class UnderwritingAgent:
         
         # Apply underwriting rules
         decision = self._apply_underwriting_rules(credit_score, loan_amount, preapproved_limit)
+        self._record_decision(context, decision)
+        self._price(context)
+        policy = {"policy_version": decision["policy_version"], "rule": decision["rule"]}
         
         if decision["status"] == "rejected":
             return {
-                "content": self._format_rejection_message(decision["reason"]),
+                "content": self._format_rejection_message(decision),
                 "decision": "rejected",
                 "reason": decision["reason"],
-                "metadata": {"underwriting_complete": True}
+                "metadata": {"underwriting_complete": True, **policy}
             }
             
         elif decision["status"] == "approved":
             return {
                 "content": self._format_approval_message(context),
                 "decision": "approved",
-                "metadata": {"underwriting_complete": True}
+                "metadata": {"underwriting_complete": True, **policy}
             }
             
         elif decision["status"] == "salary_required":
             return {
                 "content": self._request_salary_slip(context),
                 "decision": "pending",
-                "metadata": {"salary_required": True}
+                "metadata": {"salary_required": True, **policy}
             }
     
     def _apply_underwriting_rules(self, credit_score: int, loan_amount: int, preapproved_limit: int) -> Dict[str, Any]:
-        """Apply Tata Capital underwriting rules"""
-        
-        # Rule 1: Credit score check
-        if credit_score < 700:
-            return {"status": "rejected", "reason": "credit_score_low"}
-        
-        # Rule 2: Within pre-approved limit
-        if loan_amount <= preapproved_limit:
-            return {"status": "approved"}
-        
-        # Rule 3: Up to 2x pre-approved limit (need salary verification)
-        if loan_amount <= (2 * preapproved_limit):
-            return {"status": "salary_required"}
-        
-        # Rule 4: Above 2x limit
-        return {"status": "rejected", "reason": "amount_too_high"}
+        """Apply the current Tata Capital underwriting policy (eligibility table)"""
+        evaluate = self.policy_store.current().tables["eligibility"]
+        return evaluate(credit_score=credit_score, loan_amount=loan_amount, preapproved_limit=preapproved_limit)
     
+    def _record_decision(self, context: Dict[str, Any], decision: Dict[str, Any]):
+        """Keep which policy version and rule decided this application"""
+        context["underwriting_decision"] = dict(decision)
+    
+    def _price(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Price the application and keep the quote, so the letter shows the rate it was approved at"""
+        context["loan_quote"] = price_loan(self.rate_cards.current(), context)
+        return context["loan_quote"]
+    
+    @traced("underwriting.evaluate_with_salary")
     async def evaluate_with_salary(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Evaluate loan with salary information"""
         
         salary = context.get("salary", 0)
-        loan_amount = context.get("loan_amount", 0)
-        tenure = context.get("tenure", 12)
         
-        # Calculate EMI
-        emi = self._calculate_emi(loan_amount, tenure)
+        # The EMI at the applicant's own rate
+        emi = self._price(context)["emi"]
         
-        # Check EMI to salary ratio (should be <= 50%)
-        emi_ratio = (emi / salary) * 100
+        # Check EMI to salary ratio against the policy's salary table
+        decision = self.policy_store.current().tables["salary"](emi=emi, salary=salary)
+        self._record_decision(context, decision)
         
-        if emi_ratio <= 50:
+        if decision["status"] == "approved":
             return {
                 "content": self._format_approval_message(context),
                 "decision": "approved"
             }
         else:
+            reason = decision.get("reason", "high_emi_ratio")
             return {
-                "content": self._format_rejection_message("high_emi_ratio"),
+                "content": self._format_rejection_message(decision),
                 "decision": "rejected",
-                "reason": "high_emi_ratio"
+                "reason": reason
             }
     
+    @traced("underwriting.process_message")
     async def process_message(self, user_message: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Process underwriting related messages"""
         
@@ -89,18 +111,13 @@ class UnderwritingAgent:
             "metadata": {"processing": True}
         }
     
-    def _calculate_emi(self, amount: int, tenure: int) -> int:
-        """Calculate EMI"""
-        rate = 0.15 / 12  # 15% annual rate
-        emi = amount * rate * (1 + rate)**tenure / ((1 + rate)**tenure - 1)
-        return int(emi)
-    
     def _format_approval_message(self, context: Dict[str, Any]) -> str:
         """Format loan approval message"""
         amount = context.get("loan_amount", 0)
         tenure = context.get("tenure", 12)
         name = context.get("name", "").split()[0] if context.get("name") else "there"
-        emi = self._calculate_emi(amount, tenure)
+        quote = context.get("loan_quote") or self._price(context)
+        emi = quote["emi"]
         
         return f"""
 🎊 **CONGRATULATIONS {name.upper()}!** 🎊
@@ -111,7 +128,7 @@ I am SO excited to share this news with you! 🥳 This is honestly one of my fav
 
 ✅ **Your Approved Loan Details:**
 💰 **Amount**: ₹{amount:,} *(Exactly what you asked for!)*
-🏷️ **Interest Rate**: 12.99% per annum *(Great rate for your profile!)*
+🏷️ **Interest Rate**: {format_rate(quote["rate"])} per annum *(Great rate for your profile!)*
 📅 **Tenure**: {tenure} months ({tenure//12} years {f'{tenure%12} months' if tenure%12 > 0 else ''})
 💳 **Monthly EMI**: ₹{emi:,} *(Fits perfectly in your budget!)*
 🚀 **Processing Fee**: ₹999 + GST *(Very reasonable!)*
@@ -126,14 +143,32 @@ You've made an excellent choice, and I'm confident this loan is going to help yo
 *Generating your official sanction letter now... almost there!* ✨
         """.strip()
     
-    def _format_rejection_message(self, reason: str) -> str:
-        """Format loan rejection message"""
+    def _credit_score_requirement(self, decision: Dict[str, Any]) -> str:
+        """The score floor of the rule that rejected the application, as the policy states it now"""
+        policy = self.policy_store.current()
+        condition = (policy.threshold("eligibility", "credit_score", decision.get("rule"))
+                     or policy.threshold("eligibility", "credit_score"))
+        if condition is None or condition.field or condition.op not in ("lt", "le"):
+            return "below our minimum requirement"
+        minimum = condition.value if condition.op == "lt" else condition.value + 1
+        return f"below our minimum requirement of {minimum:g}"
+    
+    def _emi_limit(self) -> str:
+        """The share of monthly income the salary table lets the EMI take"""
+        condition = self.policy_store.current().threshold("salary", "emi")
+        if condition is None or condition.field != "salary" or condition.op not in ("lt", "le"):
+            return "exceed the share of your monthly income our policy allows"
+        return f"exceed {condition.value * 100:g}% of your monthly income"
+    
+    def _format_rejection_message(self, decision: Dict[str, Any]) -> str:
+        """Format loan rejection message from the rule that rejected it"""
+        reason = decision.get("reason", "high_emi_ratio")
         
         rejection_messages = {
-            "credit_score_low": """
+            "credit_score_low": lambda: f"""
 ❌ **Application Status: Not Approved**
 
-Unfortunately, we cannot approve your loan at this time due to your current credit score being below our minimum requirement of 700.
+Unfortunately, we cannot approve your loan at this time due to your current credit score being {self._credit_score_requirement(decision)}.
 
 🔄 **What you can do:**
 • Improve your credit score by paying bills on time
@@ -148,7 +183,7 @@ Unfortunately, we cannot approve your loan at this time due to your current cred
 Would you like me to help you with any of these options?
             """,
             
-            "amount_too_high": """
+            "amount_too_high": lambda: """
 ❌ **Application Status: Not Approved**
 
 The requested loan amount exceeds our lending policy for your profile.
@@ -161,10 +196,10 @@ The requested loan amount exceeds our lending policy for your profile.
 Would you like to apply for a smaller amount?
             """,
             
-            "high_emi_ratio": """
+            "high_emi_ratio": lambda: f"""
 ❌ **Application Status: Not Approved**
 
-Your EMI would exceed 50% of your monthly income, which is beyond our policy limits.
+Your EMI would {self._emi_limit()}, which is beyond our policy limits.
 
 💡 **Options Available:**
 • Increase loan tenure to reduce EMI
@@ -175,7 +210,8 @@ Would you like to explore these options?
             """
         }
         
-        return rejection_messages.get(reason, "Unfortunately, we cannot approve your loan at this time.")
+        message = rejection_messages.get(reason)
+        return message() if message else "Unfortunately, we cannot approve your loan at this time."
     
     def _request_salary_slip(self, context: Dict[str, Any]) -> str:
         """Request salary slip for verification"""
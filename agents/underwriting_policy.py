@@ -0,0 +1,232 @@
+"""
+Declarative underwriting policy.
+
+The policy lives in a JSON file (config/underwriting_policy.json) as ordered
+decision tables: each rule has conditions on applicant facts and an outcome,
+and the first matching rule decides. At load time every table is compiled to
+a plain Python function taking the facts as keyword arguments, a straight
+run of ``if`` comparisons, so evaluating an applicant costs a handful of
+comparisons and no interpretation.
+
+Workers check the file's mtime at most every few seconds and swap in the
+recompiled policy with a single reference assignment; a broken file is
+logged and the previous policy stays in force. Every decision carries the
+policy version and rule that produced it.
+"""
+import json
+import logging
+import math
+import os
+import time
+from typing import Dict, Any, Callable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   "config", "underwriting_policy.json")
+
+# Applicant facts a rule may test; anything else is rejected at load time
+FACTS = ("credit_score", "loan_amount", "preapproved_limit", "tenure", "salary", "emi", "age")
+OPERATORS = {"lt": "<", "le": "<=", "gt": ">", "ge": ">=", "eq": "==", "ne": "!="}
+STATUSES = ("approved", "rejected", "salary_required")
+
+
+class PolicyError(ValueError):
+    """The policy file is malformed"""
+
+
+class Condition(NamedTuple):
+    """One comparison of a rule: ``fact op value``, or ``fact op field * value``"""
+    rule: str
+    fact: str
+    op: str
+    value: float
+    field: Optional[str] = None
+
+
+class CompiledPolicy:
+    def __init__(self, version: str, tables: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]],
+                 source: str = "", conditions: Optional[Dict[str, List[Condition]]] = None):
+        self.version = version
+        self.tables = tables
+        self.source = source
+        # The comparisons of each table in rule order, for explaining decisions
+        self.conditions = conditions or {}
+
+    def threshold(self, table: str, fact: str, rule: Optional[str] = None) -> Optional[Condition]:
+        """The first condition on ``fact`` in ``table`` (in ``rule`` if given), or None"""
+        for condition in self.conditions.get(table, ()):
+            if condition.fact == fact and (rule is None or condition.rule == rule):
+                return condition
+        return None
+
+    def evaluate(self, table: str, facts: Dict[str, Any]) -> Dict[str, Any]:
+        """Outcome of the first matching rule: status, reason, rule and policy_version.
+
+        The returned dict is shared between calls and must not be modified.
+        Hot paths can call ``tables[table](**facts)`` directly with keywords.
+        """
+        return self.tables[table](**facts)
+
+
+def _is_number(value) -> bool:
+    # JSON accepts NaN and Infinity, which would compile to comparisons that never or always hold
+    return not isinstance(value, bool) and isinstance(value, (int, float)) and math.isfinite(value)
+
+
+def _operand(value, where: str) -> str:
+    """Source for a condition's right-hand side: a number or a multiple of another fact"""
+    if not isinstance(value, dict):
+        if not _is_number(value):
+            raise PolicyError(f"{where}: expected a finite number or {{'field': ..., 'times': ...}}")
+        return repr(value)
+
+    field, times = value.get("field"), value.get("times", 1)
+    if field not in FACTS:
+        raise PolicyError(f"{where}: unknown field {field!r}")
+    if not _is_number(times):
+        raise PolicyError(f"{where}: 'times' must be a finite number")
+    return field if times == 1 else f"{field} * {times!r}"
+
+
+def _conditions(name: str, rules: list) -> List[Condition]:
+    """The comparisons of an already compiled table"""
+    conditions = []
+    for i, rule in enumerate(rules):
+        if not rule.get("when"):
+            break  # The catch-all; nothing after it is reachable
+        for fact, tests in rule["when"].items():
+            for op, value in tests.items():
+                if isinstance(value, dict):
+                    conditions.append(Condition(rule.get("rule", f"{name}[{i}]"), fact, op,
+                                                value.get("times", 1), value["field"]))
+                else:
+                    conditions.append(Condition(rule.get("rule", f"{name}[{i}]"), fact, op, value))
+    return conditions
+
+
+def compile_table(name: str, rules: list, version: str) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Compile one ordered rule table into an evaluator function"""
+    if not rules or rules[-1].get("when"):
+        raise PolicyError(f"table {name!r} must end with a catch-all rule (no 'when')")
+
+    outcomes = []
+    lines = []
+    used_facts = set()
+    for i, rule in enumerate(rules):
+        where = f"{name}[{i}]"
+        outcome = dict(rule.get("then") or {})
+        if outcome.get("status") not in STATUSES:
+            raise PolicyError(f"{where}: 'then.status' must be one of {STATUSES}")
+        outcome.update(rule=rule.get("rule", where), policy_version=version)
+        outcomes.append(outcome)
+
+        conditions = []
+        for fact, tests in (rule.get("when") or {}).items():
+            if fact not in FACTS:
+                raise PolicyError(f"{where}: unknown field {fact!r}")
+            used_facts.add(fact)
+            for op, value in tests.items():
+                if op not in OPERATORS:
+                    raise PolicyError(f"{where}: unknown operator {op!r}")
+                operand = _operand(value, where)
+                if isinstance(value, dict):
+                    used_facts.add(value["field"])
+                conditions.append(f"{fact} {OPERATORS[op]} {operand}")
+
+        if conditions:
+            lines.append(f"    if {' and '.join(conditions)}:")
+            lines.append(f"        return outcome_{i}")
+        else:
+            lines.append(f"    return outcome_{i}")
+            break  # Anything after a catch-all can never match
+
+    # Only names from FACTS and numeric literals ever reach the generated source;
+    # facts a table does not test are accepted and ignored
+    params = "".join(f"{fact}=0, " for fact in sorted(used_facts))
+    source = f"def evaluate_{name}(*, {params}**_):\n" + "\n".join(lines) + "\n"
+    namespace = {f"outcome_{i}": outcome for i, outcome in enumerate(outcomes)}
+    exec(compile(source, f"<policy {version}:{name}>", "exec"), namespace)
+    return namespace[f"evaluate_{name}"]
+
+
+def compile_policy(document: Dict[str, Any]) -> CompiledPolicy:
+    version = str(document.get("version") or "")
+    if not version:
+        raise PolicyError("policy has no 'version'")
+    tables = document.get("tables") or {}
+    compiled = {name: compile_table(name, rules, version) for name, rules in tables.items()}
+    return CompiledPolicy(version, compiled,
+                          conditions={name: _conditions(name, rules) for name, rules in tables.items()})
+
+
+def load_policy(path: str) -> CompiledPolicy:
+    with open(path) as f:
+        document = json.load(f)
+    policy = compile_policy(document)
+    policy.source = path
+    return policy
+
+
+_monotonic = time.monotonic
+
+
+class PolicyStore:
+    """The current policy, recompiled when its file changes"""
+
+    # Subclasses reuse the reloading for other versioned config files
+    kind = "underwriting policy"
+    loader = staticmethod(load_policy)
+
+    def __init__(self, path: str = DEFAULT_POLICY_PATH, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = os.stat(path).st_mtime_ns
+        self.policy = self.loader(path)
+        self._next_check = time.monotonic() + check_interval
+
+    @classmethod
+    def from_env(cls) -> "PolicyStore":
+        return cls(
+            os.getenv("UNDERWRITING_POLICY_PATH", DEFAULT_POLICY_PATH),
+            float(os.getenv("UNDERWRITING_POLICY_CHECK_SECONDS", "2")),
+        )
+
+    def current(self) -> CompiledPolicy:
+        if _monotonic() < self._next_check:
+            return self.policy
+        self._next_check = _monotonic() + self.check_interval
+        self.reload_if_changed()
+        return self.policy
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            logger.exception("The %s %s is unreadable, keeping %s", self.kind, self.path, self.policy.version)
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            policy = self.loader(self.path)
+        except (OSError, ValueError) as e:
+            # Covers JSON errors and PolicyError; a half-written file is retried next check
+            logger.error("Rejected %s %s: %s (keeping %s)", self.kind, self.path, e, self.policy.version)
+            return False
+
+        self._mtime = mtime
+        self.policy = policy  # Single reference swap: evaluations see the old or new policy, never a mix
+        logger.info("Loaded %s %s", self.kind, policy.version)
+        return True
+
+
+_policy_store: Optional[PolicyStore] = None
+
+
+def get_policy_store() -> PolicyStore:
+    """Process-wide policy store, loaded on first use"""
+    global _policy_store
+    if _policy_store is None:
+        _policy_store = PolicyStore.from_env()
+    return _policy_store
@@ -1,19 +1,38 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import random
 
+from mock_services.adapters import as_crm_adapter, as_bureau_adapter, fetch_customer_and_bureau
+from utils.otp_store import (
+    OTP_EXPIRED, OTP_LOCKED, OTP_VERIFIED, OTPStore, OTPThrottled, get_otp_store
+)
+from utils.tracing import traced
+
+from .session_state import SessionState
+
 class VerificationAgent:
-    def __init__(self, crm_service):
-        self.crm_service = crm_service
-        self.verification_step = "phone_otp"
+    def __init__(self, crm_service, credit_service=None, rng: Optional[random.Random] = None,
+                 otp_store: Optional[OTPStore] = None):
+        self.crm = as_crm_adapter(crm_service)
+        # With a bureau, KYC also pulls the bureau report for underwriting in parallel
+        self.bureau = as_bureau_adapter(credit_service) if credit_service is not None else None
+        # Seeded by the replay engine so OTPs are reproducible
+        self.rng = rng or random
+        # Only a challenge id is kept in the context; codes live hashed in the store
+        self.otp_store = otp_store or get_otp_store()
         
+    @traced("verification.start_verification")
     async def start_verification(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Start KYC verification process"""
         phone = context.get("phone")
         
         # Generate mock OTP
-        otp = str(random.randint(1000, 9999))
-        context["generated_otp"] = otp
+        otp = str(self.rng.randint(1000, 9999))
+        context["otp_challenge"] = await self.otp_store.issue(phone, otp)
         
+        return self._otp_prompt(phone, otp)
+    
+    def _otp_prompt(self, phone: str, otp: str) -> Dict[str, Any]:
+        """Prompt shown after issuing or resending an OTP"""
         message = f"""
 🔐 **Quick Security Check!**
 
@@ -34,17 +53,22 @@ Just type the 4 digits when you get them! 😊
             "suggestions": [otp, "Resend OTP", "Change number"]
         }
     
-    async def process_message(self, user_message: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    @traced("verification.process_message")
+    async def process_message(self, user_message: str, state: SessionState) -> Dict[str, Any]:
         """Process verification steps"""
+        context = state.user_context
         
-        if self.verification_step == "phone_otp":
-            if self._verify_otp(user_message, context):
-                self.verification_step = "fetch_kyc"
-                return await self._fetch_kyc_data(context)
+        if state.verification_step == "phone_otp":
+            if "resend" in user_message.lower():
+                return await self._resend_otp(context)
+            status = await self._verify_otp(user_message, context)
+            if status == OTP_VERIFIED:
+                state.verification_step = "fetch_kyc"
+                return await self._fetch_kyc_data(state)
             else:
-                return self._otp_error()
+                return self._otp_error(status)
                 
-        elif self.verification_step == "kyc_confirmation":
+        elif state.verification_step == "kyc_confirmation":
             # Be more flexible with confirmation responses
             user_lower = user_message.lower()
             positive_responses = ["yes", "correct", "right", "looks good", "yes, correct", "no, update details"]
@@ -53,32 +77,52 @@ Just type the 4 digits when you get them! 😊
                 return await self._complete_verification(context)
             elif any(neg in user_lower for neg in ["no", "update", "wrong", "incorrect"]):
                 # User wants to update details
-                self.verification_step = "collecting_details"
+                state.verification_step = "collecting_details"
                 return await self._handle_kyc_mismatch()
             else:
                 # Default to proceeding if unclear
                 return await self._complete_verification(context)
                 
-        elif self.verification_step == "collecting_details":
+        elif state.verification_step == "collecting_details":
             # Handle new customer details collection
             return await self._process_new_customer_details(user_message, context)
     
-    def _verify_otp(self, user_otp: str, context: Dict[str, Any]) -> bool:
-        """Verify OTP"""
-        generated_otp = context.get("generated_otp")
-        return user_otp.strip() == generated_otp
+    async def _verify_otp(self, user_otp: str, context: Dict[str, Any]) -> str:
+        """Verify OTP against the store; returns an OTP_* status"""
+        return await self.otp_store.verify(context.get("otp_challenge"), context.get("phone"), user_otp.strip())
     
-    async def _fetch_kyc_data(self, context: Dict[str, Any]) -> Dict[str, Any]:
+    async def _resend_otp(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a new OTP on the same challenge, subject to the resend cooldown and cap"""
+        phone = context.get("phone")
+        otp = str(self.rng.randint(1000, 9999))
+        try:
+            context["otp_challenge"] = await self.otp_store.resend(context.get("otp_challenge"), phone, otp)
+        except OTPThrottled as e:
+            return {
+                "content": f"⏳ We've just sent you an OTP. Please wait {int(e.retry_after) + 1} seconds before requesting another one.",
+                "metadata": {"error": "otp_throttled", "retry_after": int(e.retry_after) + 1},
+                "suggestions": ["Try again", "Change number"]
+            }
+        return self._otp_prompt(phone, otp)
+    
+    @traced("verification.fetch_kyc_data")
+    async def _fetch_kyc_data(self, state: SessionState) -> Dict[str, Any]:
         """Fetch customer data from CRM"""
+        context, prefetch = state.user_context, state.prefetch
         phone = context.get("phone")
         
-        # Mock KYC fetch from CRM
-        customer_data = self.crm_service.get_customer_by_phone(phone)
+        # Usually already fetched in the background while the user typed the OTP
+        if prefetch is not None and prefetch.phone == phone:
+            customer_data = await prefetch.customer()
+        elif self.bureau is not None:
+            customer_data, context["bureau_report"] = await fetch_customer_and_bureau(self.crm, self.bureau, phone)
+        else:
+            customer_data = await self.crm.get_customer_by_phone(phone)
         
         if customer_data:
             # Update the context with customer data
             context.update(customer_data)
-            self.verification_step = "kyc_confirmation"
+            state.verification_step = "kyc_confirmation"
             
             message = f"""
 🎉 **Fantastic news!** 
@@ -153,11 +197,17 @@ Let me now check your loan eligibility and get you that instant decision. This i
             "suggestions": ["Continue processing", "Check status", "Wait for result"]
         }
     
-    def _otp_error(self) -> Dict[str, Any]:
+    def _otp_error(self, status: str) -> Dict[str, Any]:
         """Handle OTP verification error"""
+        if status == OTP_EXPIRED:
+            content, error = "⌛ That OTP has expired. Tap *Resend OTP* and I'll send you a new one.", "otp_expired"
+        elif status == OTP_LOCKED:
+            content, error = "🔒 Too many incorrect attempts. Please request a new OTP to continue.", "otp_locked"
+        else:
+            content, error = "❌ Invalid OTP. Please check and enter the correct 4-digit OTP sent to your mobile.", "invalid_otp"
         return {
-            "content": "❌ Invalid OTP. Please check and enter the correct 4-digit OTP sent to your mobile.",
-            "metadata": {"error": "invalid_otp"},
+            "content": content,
+            "metadata": {"error": error},
             "suggestions": ["Resend OTP", "Try again", "Change number"]
         }
     
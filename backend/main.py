@@ -1,19 +1,74 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi import APIRouter, Depends, FastAPI, Request, WebSocket, WebSocketDisconnect, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, Response
 import json
 import asyncio
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
 
-from agents.master_agent import MasterAgent
+from agents.master_agent import TRANSITIONS, MasterAgent
+from agents.session_state import SessionState
+from agents.pricing import get_rate_card_store
+from agents.underwriting_policy import get_policy_store
 from mock_services.crm_api import CRMService
 from mock_services.credit_bureau import CreditBureauService
+from mock_services.adapters import QueuedCreditBureauAdapter, as_bureau_adapter
+from utils.admin_auth import require_admin
 from utils.session_manager import SessionManager
+from utils.document_cache import get_document_cache
+from utils.archive_index import get_archive_index
+from utils.connection_manager import ConnectionManager
+from utils.document_server import get_document_server
+from utils.download_tokens import get_download_signer
+from utils.event_stream import EventChannel, EventStreamManager
+from utils.funnel import get_funnel
+from utils.job_queue import PRIORITY_HIGH, get_job_queue, job
+from utils.metrics import render_metrics
+from utils.salary_slip_parser import get_salary_slip_parser
+from utils.tracing import tracer
 
-app = FastAPI(title="Tata Capital Agentic Loan Chatbot")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fail at boot rather than on the first letter if the download secret can't be set up
+    get_download_signer()
+    yield
+    # Archive open sessions and tell clients to reconnect to another worker
+    await manager.shutdown()
+    await event_streams.shutdown()
+    # Archives of the sessions just closed are among the queued jobs
+    await job_queue.shutdown()
+    get_archive_index().close()
+    get_salary_slip_parser().shutdown()
+    # Letters are rendered in memory; make sure they reach disk before the worker exits
+    await get_document_cache().flush()
+    tracer.flush()
+
+app = FastAPI(title="Tata Capital Agentic Loan Chatbot", lifespan=lifespan)
+
+class ChatTurnMiddleware:
+    """Serves ``POST /chat/{session_id}/messages`` ahead of the router.
+
+    Every turn of an HTTP session comes through here, so it skips FastAPI's
+    routing, dependency solving and request/response wrappers. Added before
+    the CORS middleware, it runs inside it: preflights and CORS headers are
+    handled as for any other route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            parts = scope["path"].split("/")
+            if len(parts) == 4 and parts[1] == "chat" and parts[3] == "messages" and parts[2]:
+                await chat_message(scope, receive, send, parts[2])
+                return
+        await self.app(scope, receive, send)
+
+app.add_middleware(ChatTurnMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -25,133 +80,304 @@ app.add_middleware(
 )
 
 # Initialize services
+job_queue = get_job_queue()
 crm_service = CRMService()
-credit_service = CreditBureauService()
-session_manager = SessionManager()
+bureau_service = as_bureau_adapter(CreditBureauService(rate_card=get_rate_card_store().current))
+# Agents pull bureau reports through the job queue
+credit_service = QueuedCreditBureauAdapter(bureau_service, job_queue)
+session_manager = SessionManager(jobs=job_queue)
+document_server = get_document_server()
+
+@job("bureau.report", priority=PRIORITY_HIGH, retries=2)
+async def pull_bureau_report(phone: str, pan: str = None):
+    return await bureau_service.get_bureau_report(phone, pan)
+
+manager = ConnectionManager.from_env()
+# One set of agents serves every session; each turn is handed the session's state
+master_agent = MasterAgent(
+    crm_service=crm_service,
+    credit_service=credit_service,
+    session_manager=session_manager,
+    jobs=job_queue
+)
+# State of the sessions connected to this worker, for uploads that continue their conversation
+session_states: Dict[str, SessionState] = {}
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+def _bot_frame(response) -> Dict[str, Any]:
+    """The frame a bot reply is sent as, over either transport"""
+    # Handle both old string format and new dict format
+    if isinstance(response, dict):
+        return {
+            "type": "message",
+            "content": response["content"],
+            "sender": "bot",
+            "timestamp": datetime.now().isoformat(),
+            "metadata": response.get("metadata", {}),
+            "suggestions": response.get("suggestions", [])
+        }
+    # Backward compatibility for string responses
+    return {
+        "type": "message",
+        "content": response,
+        "sender": "bot",
+        "timestamp": datetime.now().isoformat()
+    }
 
-    async def connect(self, websocket: WebSocket, session_id: str):
-        await websocket.accept()
-        self.active_connections[session_id] = websocket
+async def send_frame(session_id: str, frame: Dict[str, Any]):
+    """Push a frame to the session's client, whichever transport it is connected over"""
+    if not await event_streams.send_message(session_id, frame):
+        await manager.send_message(session_id, frame)
 
-    def disconnect(self, session_id: str):
-        if session_id in self.active_connections:
-            del self.active_connections[session_id]
+def start_chat(session_id: str) -> SessionState:
+    state = SessionState(session_id)
+    session_manager.create_session(session_id)
+    session_states[session_id] = state
+    return state
 
-    async def send_message(self, session_id: str, message: dict):
-        if session_id in self.active_connections:
-            await self.active_connections[session_id].send_text(json.dumps(message))
+async def chat_turn(state: SessionState, content: str) -> Dict[str, Any]:
+    """Run one user message through the agents and record both sides of the turn"""
+    session_id = state.session_id
+    response = await master_agent.process_message(state, content)
+    
+    # Archived with the session; tools/replay.py can replay it
+    session_manager.add_message(session_id, {"sender": "user", "content": content})
+    session_manager.add_message(session_id, {
+        "sender": "bot",
+        "content": response["content"] if isinstance(response, dict) else response,
+        "metadata": response.get("metadata", {}) if isinstance(response, dict) else {}
+    })
+    return _bot_frame(response)
 
-manager = ConnectionManager()
+def end_chat(state: SessionState):
+    session_id = state.session_id
+    # Lookups still in flight must not outlive the session
+    if state.prefetch is not None:
+        state.prefetch.discard()
+        state.prefetch = None
+    if session_states.get(session_id) is not state:
+        # Replaced by a reconnect under the same id; the session record is the new connection's
+        return
+    del session_states[session_id]
+    get_funnel().session_ended(state.conversation_state)
+    # Archive what the agents collected, including the underwriting decision
+    session_manager.update_context(session_id, state.user_context)
+    session_manager.update_conversation_state(session_id, state.conversation_state)
+    session_manager.end_session(session_id)
 
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    await manager.connect(websocket, session_id)
+    connection = await manager.connect(websocket, session_id)
+    if connection is None:
+        return  # Worker at capacity; the client was told when to retry
     
-    # Initialize master agent for this session
-    master_agent = MasterAgent(
-        session_id=session_id,
-        crm_service=crm_service,
-        credit_service=credit_service,
-        session_manager=session_manager
-    )
+    state = start_chat(session_id)
     
     try:
         # Send welcome message
-        welcome_response = await master_agent.start_conversation()
-        
-        # Handle both old string format and new dict format
-        if isinstance(welcome_response, dict):
-            await manager.send_message(session_id, {
-                "type": "message",
-                "content": welcome_response["content"],
-                "sender": "bot",
-                "timestamp": datetime.now().isoformat(),
-                "metadata": welcome_response.get("metadata", {}),
-                "suggestions": welcome_response.get("suggestions", [])
-            })
-        else:
-            # Backward compatibility for string responses
-            await manager.send_message(session_id, {
-                "type": "message",
-                "content": welcome_response,
-                "sender": "bot",
-                "timestamp": datetime.now().isoformat()
-            })
+        await manager.send_message(session_id, _bot_frame(await master_agent.start_conversation(state)))
         
         while True:
             # Receive message from client
             data = await websocket.receive_text()
             message_data = json.loads(data)
+            if not connection.received(message_data):
+                continue  # Heartbeat reply
             
-            # Process message through master agent
-            response = await master_agent.process_message(message_data["content"])
-            
-            # Send response back - handle both dict and string responses
-            if isinstance(response, dict):
-                await manager.send_message(session_id, {
-                    "type": "message",
-                    "content": response["content"],
-                    "sender": "bot",
-                    "timestamp": datetime.now().isoformat(),
-                    "metadata": response.get("metadata", {}),
-                    "suggestions": response.get("suggestions", [])
-                })
-            else:
-                # Backward compatibility for string responses
-                await manager.send_message(session_id, {
-                    "type": "message",
-                    "content": response,
-                    "sender": "bot",
-                    "timestamp": datetime.now().isoformat()
-                })
+            # Process message through master agent and send the reply back
+            frame = await chat_turn(state, message_data["content"])
+            await manager.send_message(session_id, frame)
             
     except WebSocketDisconnect:
-        manager.disconnect(session_id)
-        session_manager.end_session(session_id)
+        pass
+    except asyncio.CancelledError:
+        if connection.close_code is None:
+            raise
+        # Reaped for idling, a dead peer or shutdown; closed once archived
+        asyncio.current_task().uncancel()
+    finally:
+        manager.disconnect(connection)
+        end_chat(state)
+    if connection.close_code is not None:
+        await manager.close(connection)
+
+def _end_http_chat(session_id: str):
+    state = session_states.get(session_id)
+    if state is not None:
+        end_chat(state)
+
+# Sessions served over SSE/long-poll, for clients whose network blocks WebSockets
+event_streams = EventStreamManager.from_env(on_close=_end_http_chat)
+
+async def _http_channel(session_id: str):
+    """The session's HTTP channel, opened and greeted on first use, or the error response"""
+    channel = event_streams.get(session_id)
+    if channel is not None:
+        return channel
+    if session_id in session_states:
+        return JSONResponse({"type": "error", "error": "session_in_use"}, status_code=409)
+    channel = event_streams.open(session_id)
+    if channel is None:
+        # Worker at capacity, like a 1013 close on the WebSocket
+        return JSONResponse({"type": "error", "error": "server_busy", "retry_after": event_streams.retry_after},
+                            status_code=503, headers={"Retry-After": str(event_streams.retry_after)})
+    state = start_chat(session_id)
+    await channel.publish(_bot_frame(await master_agent.start_conversation(state)))
+    return channel
+
+@app.get("/chat/{session_id}/events")
+async def chat_events(session_id: str, request: Request, last_event_id: int = 0):
+    """Server-Sent Events stream of the session's frames; opens the session on first connect"""
+    # EventSource sends the header when it reconnects; the query parameter is for other clients.
+    # Checked before the session is opened, so a bad value opens nothing
+    header = request.headers.get("last-event-id")
+    if header:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            return JSONResponse({"type": "error", "error": "invalid_last_event_id"}, status_code=400)
+    channel = await _http_channel(session_id)
+    if not isinstance(channel, EventChannel):
+        return channel
+    return event_streams.stream(channel, last_event_id)
+
+@app.get("/chat/{session_id}/poll")
+async def chat_poll(session_id: str, after: int = 0, timeout: float = 25.0):
+    """Long-poll alternative to the event stream, for proxies that buffer SSE"""
+    channel = await _http_channel(session_id)
+    if not isinstance(channel, EventChannel):
+        return channel
+    body = await event_streams.poll(channel, after, timeout)
+    return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-cache"})
+
+async def chat_message(scope, receive, send, session_id: str):
+    """Take one user turn; the bot's reply is published on the session's event stream.
+
+    A plain ASGI handler, called by ChatTurnMiddleware for ``POST /chat/{session_id}/messages``.
+    """
+    channel = event_streams.get(session_id)
+    state = session_states.get(session_id)
+    if channel is None or state is None:
+        response = JSONResponse({"status": "error", "message": "No active chat session"}, status_code=404)
+        await response(scope, receive, send)
+        return
+    
+    body, more_body = b"", True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    try:
+        content = json.loads(body)["content"]
+    except (ValueError, TypeError, KeyError):
+        content = None
+    if not isinstance(content, str):
+        response = JSONResponse({"status": "error", "message": "Expected a JSON body with a string content"},
+                                status_code=422)
+        await response(scope, receive, send)
+        return
+    
+    channel.received()
+    async with channel.lock:
+        frame = await chat_turn(state, content)
+        # Written to the session's open streams before the POST is answered
+        event_id = await channel.publish(frame)
+    await send({"type": "http.response.start", "status": 200, "headers": _ACCEPTED_HEADERS})
+    await send({"type": "http.response.body", "body": b'{"status": "accepted", "event_id": %d}' % event_id})
+
+_ACCEPTED_HEADERS = [(b"content-type", b"application/json")]
+
+@app.delete("/chat/{session_id}")
+async def end_http_chat(session_id: str):
+    """End an SSE/long-poll session and archive it"""
+    channel = event_streams.get(session_id)
+    if channel is not None:
+        event_streams.reap(channel, "closed")
+    return {"status": "closed"}
 
 @app.post("/upload-salary-slip/{session_id}")
 async def upload_salary_slip(session_id: str, file: UploadFile = File(...)):
-    """Handle salary slip upload for loan verification"""
+    """Parse an uploaded salary slip and continue the session's underwriting over its WebSocket or event stream"""
+    state = session_states.get(session_id)
+    if state is None:
+        return {"status": "error", "message": "No active chat session for this upload"}
+    
     try:
-        # Save file temporarily
-        file_path = f"temp/{session_id}_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        parser = get_salary_slip_parser()
+        content = await file.read(parser.max_bytes + 1)
+        await send_frame(session_id, {"type": "upload_status", "stage": "parsing", "filename": file.filename})
         
-        # Process through master agent
-        master_agent = MasterAgent(
-            session_id=session_id,
-            crm_service=crm_service,
-            credit_service=credit_service,
-            session_manager=session_manager
-        )
+        # Parsed in a worker process; the same file uploaded again comes from the cache
+        slip = await parser.parse(content)
+        await send_frame(session_id, {
+            "type": "upload_status",
+            "stage": slip["status"],
+            "cached": slip["cached"],
+            "salary_slip": {key: slip[key] for key in ("gross_salary", "net_salary", "employer")}
+        })
         
-        result = await master_agent.process_salary_slip(file_path)
+        response = await master_agent.process_salary_slip(state, slip)
+        session_manager.add_message(session_id, {"sender": "user", "content": f"📎 Salary slip uploaded: {file.filename}"})
+        session_manager.add_message(session_id, {
+            "sender": "bot", "content": response["content"], "metadata": response.get("metadata", {})
+        })
+        await send_frame(session_id, _bot_frame(response))
         
-        return {"status": "success", "message": result}
+        return {"status": "success", "message": response["content"], "salary_slip_status": slip["status"]}
         
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.get("/download/{filename}")
-async def download_file(filename: str):
-    """Download generated sanction letter"""
-    file_path = f"generated_docs/{filename}"
-    
-    if os.path.exists(file_path):
-        from fastapi.responses import FileResponse
-        return FileResponse(
-            path=file_path,
-            filename=filename,
-            media_type='application/pdf'
-        )
-    else:
-        return {"error": "File not found"}
+async def download_file(filename: str, request: Request):
+    """Download generated sanction letter via a signed, expiring link"""
+    return await document_server.serve(request, filename)
+
+# Support and operations endpoints; every one needs the admin token (utils/admin_auth.py)
+admin = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+@admin.get("/traces")
+async def recent_traces(limit: int = 20):
+    """Most recent sampled turn traces (set TRACE_SAMPLE_RATE to enable)"""
+    ring_buffer = tracer.ring_buffer
+    traces = ring_buffer.recent_traces(limit) if ring_buffer else []
+    return {"sample_rate": tracer.sample_rate, "traces": traces}
+
+@admin.get("/policy")
+async def underwriting_policy():
+    """Underwriting policy version currently in force"""
+    store = get_policy_store()
+    policy = store.current()
+    return {"version": policy.version, "path": store.path, "tables": sorted(policy.tables)}
+
+@admin.get("/rate-card")
+async def rate_card():
+    """Rate card currently in force, with the rate range of each credit score band"""
+    return get_rate_card_store().current().summary()
+
+@admin.get("/transitions")
+async def transition_coverage():
+    """Conversation transitions taken by this worker's turns, per declared edge"""
+    return {"transitions": TRANSITIONS.coverage()}
+
+@admin.get("/archives/search")
+async def search_archives(q: str, limit: int = 20):
+    """Archived sessions matching a support query such as ``phone:98765*`` or ``"wrong details"``"""
+    return await asyncio.to_thread(get_archive_index().search, q, limit)
+
+@admin.get("/funnel")
+async def conversion_funnel(window: Optional[int] = None, step: Optional[int] = None):
+    """This worker's conversion funnel over the last ``window`` seconds in ``step``-second buckets, or since it started"""
+    return get_funnel().snapshot(window, step)
+
+app.include_router(admin)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,23 @@
+"""
+Service adapters with injected latency: CRM and bureau lookups one after the
+other vs. fanned out concurrently, as VerificationAgent does
+"""
+from agents.pricing import get_rate_card_store
+from mock_services.adapters import as_crm_adapter, as_bureau_adapter, fetch_customer_and_bureau
+
+from .bench_prefetch import SlowCRMService, SlowCreditBureauService
+from .harness import benchmark
+
+crm = as_crm_adapter(SlowCRMService())
+bureau = as_bureau_adapter(SlowCreditBureauService(rate_card=get_rate_card_store().current))
+
+
+@benchmark("adapters.customer_and_bureau.sequential", number=1, repeat=5)
+async def bench_sequential():
+    await crm.get_customer_by_phone("9876543210")
+    await bureau.get_bureau_report("9876543210")
+
+
+@benchmark("adapters.customer_and_bureau.parallel", number=1, repeat=5)
+async def bench_parallel():
+    await fetch_customer_and_bureau(crm, bureau, "9876543210")
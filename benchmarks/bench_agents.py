@@ -0,0 +1,299 @@
+"""
+Benchmarks for the agent hot paths: the turn loop, extraction, EMI maths,
+underwriting, PDF rendering, session handling and CRM search
+"""
+import json
+import os
+import tempfile
+
+from agents.master_agent import TRANSITIONS, MasterAgent
+from agents.sales_agent import SalesAgent
+from agents.session_state import SessionState
+from agents.underwriting_agent import UnderwritingAgent
+from agents.sanction_letter_agent import SanctionLetterAgent
+from agents.prompt_builder import RESPONSE_PROMPT
+from agents.pricing import DEFAULT_RATE_CARD_PATH, compile_rate_card, get_rate_card_store, price_loan
+from mock_services.crm_api import CRMService
+from mock_services.credit_bureau import CreditBureauService
+from utils.session_manager import SessionManager
+
+from .harness import benchmark
+
+crm_service = CRMService()
+credit_service = CreditBureauService(rate_card=get_rate_card_store().current)
+session_manager = SessionManager()
+
+sales_agent = SalesAgent()
+underwriting_agent = UnderwritingAgent(credit_service)
+sanction_letter_agent = SanctionLetterAgent()
+
+APPROVED_CONTEXT = {
+    "name": "Rahul Sharma",
+    "city": "Bangalore",
+    "phone": "9876543210",
+    "customer_id": "TC1001",
+    "credit_score": 780,
+    "preapproved_limit": 500000,
+    "loan_amount": 500000,
+    "tenure": 24,
+    "purpose": "Home renovation",
+}
+
+
+master_agent = MasterAgent(
+    crm_service=crm_service,
+    credit_service=credit_service,
+    session_manager=session_manager
+)
+
+
+def _session_state(conversation_state: str, **context) -> SessionState:
+    """A session parked in the given conversation state"""
+    state = SessionState("bench")
+    state.conversation_state = conversation_state
+    state.user_context.update({"name": "Rahul"}, **context)
+    return state
+
+
+# MasterAgent.process_message, one benchmark per conversation state
+
+def _setup_greeting():
+    return _session_state("greeting")
+
+
+@benchmark("master.process_message.greeting", number=2000, setup=_setup_greeting)
+async def bench_greeting(state):
+    await master_agent.process_message(state, "Yes, I need a personal loan")
+
+
+def _setup_collecting_name():
+    state = _session_state("collecting_name")
+    state.user_context.pop("name")
+    return state
+
+
+@benchmark("master.process_message.collecting_name", number=2000, setup=_setup_collecting_name)
+async def bench_collecting_name(state):
+    await master_agent.process_message(state, "My name is Rahul")
+
+
+def _setup_sales_amount():
+    return _session_state("sales")
+
+
+@benchmark("master.process_message.sales_amount", number=2000, setup=_setup_sales_amount)
+async def bench_sales_amount(state):
+    await master_agent.process_message(state, "5 lakhs")
+
+
+def _setup_sales_phone():
+    state = _session_state("sales")
+    state.sales_step = "phone"
+    state.sales_data = {"loan_amount": 500000, "tenure": 24, "purpose": "Home renovation"}
+    return state
+
+
+@benchmark("master.process_message.sales_phone", number=2000, setup=_setup_sales_phone)
+async def bench_sales_phone(state):
+    await master_agent.process_message(state, "9876543210")
+
+
+def _setup_verification_otp():
+    return _session_state("verification", phone="9876543210")
+
+
+@benchmark("master.process_message.verification_otp", number=2000, setup=_setup_verification_otp)
+async def bench_verification_otp(state):
+    # Issuing is async, so it happens here rather than in setup
+    state.user_context["otp_challenge"] = await master_agent.verification_agent.otp_store.issue("9876543210", "4321")
+    await master_agent.process_message(state, "4321")
+
+
+_bureau_report = credit_service.get_bureau_report("9876543212")
+
+
+def _setup_verification_rejected():
+    state = _session_state("verification", loan_amount=500000, tenure=24,
+                          bureau_report=_bureau_report,
+                          **crm_service.get_customer_by_phone("9876543212"))
+    state.verification_step = "kyc_confirmation"
+    return state
+
+
+@benchmark("master.process_message.underwriting_rejected", number=2000, setup=_setup_verification_rejected)
+async def bench_underwriting_rejected(state):
+    await master_agent.process_message(state, "Yes, correct")
+
+
+def _setup_sanction():
+    return _session_state("sanction")
+
+
+@benchmark("master.process_message.sanction", number=2000, setup=_setup_sanction)
+async def bench_sanction(state):
+    await master_agent.process_message(state, "Thank you")
+
+
+# Dispatch alone: working out the turn's event and looking up its transition
+
+_greeting_state = _session_state("greeting")
+_sales_state = _session_state("sales")
+
+
+@benchmark("master.dispatch.intent", number=20000)
+async def bench_dispatch_intent():
+    # Greeting branches on the intent, so it is worked out first
+    TRANSITIONS.lookup("greeting", await master_agent._event(_greeting_state, "Tell me about interest rates"))
+
+
+@benchmark("master.dispatch.catch_all", number=20000)
+async def bench_dispatch_catch_all():
+    TRANSITIONS.lookup("sales", await master_agent._event(_sales_state, "5 lakhs"))
+
+
+# SalesAgent extraction, and pricing from the rate card
+
+@benchmark("sales.extract_amount.lakhs", number=20000)
+def bench_extract_amount_lakhs():
+    sales_agent._extract_amount("I need around 5.5 lakhs for my wedding")
+
+
+@benchmark("sales.extract_amount.plain", number=20000)
+def bench_extract_amount_plain():
+    sales_agent._extract_amount("500,000")
+
+
+@benchmark("sales.extract_tenure.years", number=20000)
+def bench_extract_tenure_years():
+    sales_agent._extract_tenure("2 years please")
+
+
+@benchmark("sales.extract_tenure.plain", number=20000)
+def bench_extract_tenure_plain():
+    sales_agent._extract_tenure("36")
+
+
+@benchmark("sales.calculate_emi", number=20000)
+def bench_sales_emi():
+    sales_agent._calculate_emi(500000, 36)
+
+
+rate_card = get_rate_card_store().current()
+
+with open(DEFAULT_RATE_CARD_PATH) as f:
+    RATE_CARD_DOCUMENT = json.load(f)
+
+
+@benchmark("pricing.quote", number=20000)
+def bench_pricing_quote():
+    rate_card.quote(780, 500000, 36)
+
+
+@benchmark("pricing.price_loan", number=20000)
+def bench_price_loan():
+    # What underwriting records and the sanction letter prints
+    price_loan(rate_card, APPROVED_CONTEXT)
+
+
+@benchmark("pricing.build_table", number=100, repeat=3)
+def bench_build_rate_table():
+    # Paid once per worker at startup and again on each rate card reload
+    compile_rate_card(RATE_CARD_DOCUMENT)
+
+
+# Underwriting rules, covering every outcome
+
+@benchmark("underwriting.apply_rules", number=20000)
+def bench_underwriting_rules():
+    underwriting_agent._apply_underwriting_rules(780, 400000, 500000)
+    underwriting_agent._apply_underwriting_rules(720, 500000, 300000)
+    underwriting_agent._apply_underwriting_rules(650, 500000, 200000)
+    underwriting_agent._apply_underwriting_rules(780, 2000000, 500000)
+
+
+# Sanction letter rendering
+
+_pdf_path = os.path.join(tempfile.mkdtemp(prefix="bench_pdf_"), "letter.pdf")
+
+
+def _pdf_metrics():
+    return {"bytes": os.path.getsize(_pdf_path)}
+
+
+@benchmark("sanction.create_pdf", number=30, repeat=3, metrics=_pdf_metrics)
+def bench_create_pdf():
+    sanction_letter_agent._create_sanction_letter_pdf(
+        _pdf_path, APPROVED_CONTEXT, "TC20240101ABC123", "January 01, 2024", "January 02, 2024",
+        "February 05, 2024"
+    )
+
+
+memory_letter_agent = SanctionLetterAgent(in_memory=True)
+disk_letter_agent = SanctionLetterAgent(in_memory=False)
+
+
+@benchmark("sanction.generate_letter.in_memory", number=30, repeat=3)
+async def bench_generate_letter_in_memory():
+    await memory_letter_agent.generate_sanction_letter(dict(APPROVED_CONTEXT))
+
+
+@benchmark("sanction.generate_letter.disk", number=30, repeat=3)
+async def bench_generate_letter_disk():
+    await disk_letter_agent.generate_sanction_letter(dict(APPROVED_CONTEXT))
+
+
+# Prompt construction for a long session
+
+LONG_HISTORY = [
+    {"sender": "user" if i % 2 else "bot", "content": "Here are your loan options 💰 with EMI details. " * 8}
+    for i in range(40)
+]
+
+
+@benchmark("prompt.build.response", number=5000)
+def bench_prompt_build():
+    RESPONSE_PROMPT.build("5 lakhs for 2 years", dict(APPROVED_CONTEXT, intent="amount_query"), LONG_HISTORY)
+
+
+# SessionManager operations
+
+@benchmark("session.create_session", number=20000)
+def bench_create_session():
+    session_manager.create_session("bench-create")
+
+
+def _setup_session():
+    session_manager.create_session("bench-session")
+    return "bench-session"
+
+
+@benchmark("session.add_message", number=20000, setup=_setup_session)
+def bench_add_message(session_id):
+    session_manager.add_message(session_id, {"sender": "user", "content": "5 lakhs"})
+
+
+@benchmark("session.update_context", number=20000, setup=_setup_session)
+def bench_update_context(session_id):
+    session_manager.update_context(session_id, {"loan_amount": 500000, "tenure": 24})
+
+
+@benchmark("session.get_session", number=20000, setup=_setup_session)
+def bench_get_session(session_id):
+    session_manager.get_session(session_id)
+
+
+@benchmark("session.end_session", number=500, setup=_setup_session)
+def bench_end_session(session_id):
+    session_manager.end_session(session_id)
+
+
+# CRM search
+
+@benchmark("crm.search_customers.city", number=20000)
+def bench_search_city():
+    crm_service.search_customers(city="Bangalore")
+
+
+@benchmark("crm.search_customers.multi", number=20000)
+def bench_search_multi():
+    crm_service.search_customers(city="Bangalore", credit_score=790)
@@ -0,0 +1,89 @@
+"""
+Support search over archived conversations: indexing one archived session,
+and queries against 100k sessions in one merged segment plus a few fresh
+ones, as after a busy day. The index is built on first use, outside the
+timed region.
+"""
+import random
+import tempfile
+
+from utils.archive_index import ArchiveIndex
+
+from .harness import benchmark
+
+SESSIONS = 100_000
+FRESH_SEGMENTS = 3
+
+_MESSAGES = ["Hi", "My name is {name}", "Yes, I need a personal loan", "{amount} lakhs", "2 years",
+             "Home renovation", "Wedding", "{phone}", "The details are wrong", "wrong details, my city changed",
+             "Yes, correct", "What is the interest rate?", "Can I prepay the loan?"]
+_NAMES = ["Rahul Sharma", "Priya Patel", "Amit Kumar", "Sneha Reddy", "Vikram Singh", "Anjali Gupta"]
+
+_state = {}
+
+
+def _archive(rng: random.Random, i: int):
+    phone = f"9{rng.randrange(10 ** 9):09d}"
+    name = rng.choice(_NAMES)
+    approved = rng.random() < 0.6
+    history = [{"sender": "user", "content": message.format(name=name, amount=rng.randint(1, 30), phone=phone)}
+               for message in rng.sample(_MESSAGES, 8)]
+    history.append({"sender": "bot", "content": "...",
+                    "metadata": {"approval_id": f"TC2024{i:010X}"} if approved else {}})
+    return {
+        "session_id": f"session-{i:07d}",
+        "ended_at": f"2024-01-{1 + i * 28 // SESSIONS:02d}T10:00:00",
+        "final_state": "sanction" if approved else "underwriting",
+        "user_context": {"name": name, "phone": phone, "customer_id": f"CUST{i:07d}",
+                         "underwriting_decision": {"status": "approved"} if approved
+                         else {"status": "rejected", "reason": "credit_score_low"}},
+        "conversation_history": history,
+    }
+
+
+def _index() -> ArchiveIndex:
+    if "index" not in _state:
+        rng = random.Random(0)
+        index = ArchiveIndex(tempfile.mkdtemp(prefix="archive_index_"), flush_docs=SESSIONS, flush_seconds=1e9)
+        archives = [_archive(rng, i) for i in range(SESSIONS + FRESH_SEGMENTS * 1000)]
+        for i, archive in enumerate(archives[:SESSIONS]):
+            index.add(archive)
+            if (i + 1) % (SESSIONS // 8) == 0:
+                index.flush()
+        index.close()
+        index.merge()
+        for i, archive in enumerate(archives[SESSIONS:]):
+            index.add(archive)
+            if (i + 1) % 1000 == 0:
+                index.flush()
+        _state["index"] = index
+        _state["phone"] = archives[SESSIONS // 2]["user_context"]["phone"]
+        _state["archive"] = archives[-1]
+    return _state["index"]
+
+
+def _disk_metrics():
+    stats = _index().stats()
+    return {"segments": stats["segments"], "bytes_per_session": round(stats["bytes"] / stats["documents"])}
+
+
+@benchmark("archive_index.search.phone", number=200, setup=_index, metrics=_disk_metrics)
+def bench_search_phone(index):
+    index.search(f"phone:{_state['phone']}")
+
+
+@benchmark("archive_index.search.prefix", number=200, setup=_index)
+def bench_search_prefix(index):
+    # Phones and approval IDs are looked up by their first digits; about 100 sessions match
+    index.search(_state["phone"][:4] + "*")
+
+
+@benchmark("archive_index.search.phrase", number=20, setup=_index)
+def bench_search_phrase(index):
+    # Two common terms: the worst case, decoding long posting lists
+    index.search('"wrong details" name:priya')
+
+
+@benchmark("archive_index.add", number=2000, setup=_index)
+def bench_index_add(index):
+    index.add(_state["archive"])
@@ -0,0 +1,79 @@
+"""
+Funnel analytics: the cost a turn pays to update the funnel, rolling up a
+day of hour buckets, and memory held by the aggregator after a quiet and a
+busy stretch of traffic (which should be the same).
+"""
+import gc
+import tracemalloc
+
+from utils.funnel import FunnelAggregator
+
+from .harness import benchmark
+
+_last_run = {}
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _simulate(funnel: FunnelAggregator, clock: _Clock, sessions: int, spacing: float):
+    """Sessions through the whole funnel, one every ``spacing`` seconds; every third is rejected"""
+    for i in range(sessions):
+        since = funnel.session_started()
+        clock.now += spacing * 0.2
+        since = funnel.transition("greeting", "sales", since)
+        clock.now += spacing * 0.5
+        since = funnel.transition("sales", "verification", since)
+        clock.now += spacing * 0.3
+        if i % 3:
+            funnel.transition("verification", "sanction", since)
+            funnel.session_ended("sanction")
+        else:
+            funnel.transition("verification", "underwriting", since, "credit_score_low")
+            funnel.session_ended("underwriting")
+
+
+def _retained(sessions: int, spacing: float) -> int:
+    """Bytes the aggregator holds after ``sessions`` sessions spread over a week"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        clock = _Clock()
+        funnel = FunnelAggregator(clock=clock)
+        _simulate(funnel, clock, sessions, spacing)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del funnel
+    return after - before
+
+
+_clock = _Clock()
+_funnel = FunnelAggregator(clock=_clock)
+_simulate(_funnel, _clock, 20000, 9.0)  # Two days of traffic
+
+
+@benchmark("funnel.transition", number=20000)
+def bench_funnel_transition():
+    # A turn that moves a session on: three buckets updated, one sketch sample
+    _funnel.transition("sales", "verification", _clock.now - 42.0)
+
+
+@benchmark("funnel.snapshot.day", number=20, repeat=5)
+def bench_funnel_snapshot_day():
+    _funnel.snapshot(86400, 3600)
+
+
+@benchmark("funnel.memory", number=1, repeat=1, threshold=0.1,
+           metrics=lambda: {"bytes_2k_sessions": _last_run["quiet"], "bytes_20k_sessions": _last_run["busy"]},
+           gate_metrics=("bytes_20k_sessions", "bytes_2k_sessions"))
+def bench_funnel_memory():
+    week = 7 * 86400
+    _last_run["quiet"] = _retained(2000, week / 2000)
+    _last_run["busy"] = _retained(20000, week / 20000)
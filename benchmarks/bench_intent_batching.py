@@ -0,0 +1,81 @@
+"""
+Intent classification against the local LLM stub: throughput of one call per
+message vs. micro-batched, and latency per priority class under a burst
+"""
+import asyncio
+import statistics
+import time
+
+from agents.ai_service import AIService
+from agents.llm_scheduler import LLMScheduler
+from mock_services.llm_stub import StubLLM
+
+from .harness import benchmark
+
+CONCURRENT_MESSAGES = 256
+MESSAGES = [
+    ("Yes, I need a personal loan", {"conversation_state": "greeting"}),
+    ("5 lakhs", {"conversation_state": "sales"}),
+    ("2 years please", {"conversation_state": "sales", "loan_amount": 500000}),
+    ("What is the interest rate?", {"conversation_state": "greeting"}),
+]
+
+# 8 model slots, 20ms per request plus 0.5ms per classified message
+unbatched_stub = StubLLM()
+batched_stub = StubLLM()
+unbatched_service = AIService(complete=unbatched_stub.complete, intent_batch_window_ms=0)
+batched_service = AIService(complete=batched_stub.complete, intent_batch_size=32, intent_batch_window_ms=5)
+
+_last_run = {}
+
+
+async def _classify_all(service: AIService, name: str):
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        service.analyze_intent(*MESSAGES[i % len(MESSAGES)]) for i in range(CONCURRENT_MESSAGES)
+    ))
+    _last_run[name] = CONCURRENT_MESSAGES / (time.perf_counter() - start)
+
+
+def _throughput(name: str):
+    return lambda: {"messages_per_sec": round(_last_run[name])}
+
+
+@benchmark("ai.analyze_intent.unbatched", number=1, repeat=3, metrics=_throughput("unbatched"))
+async def bench_intent_unbatched():
+    await _classify_all(unbatched_service, "unbatched")
+
+
+@benchmark("ai.analyze_intent.batched", number=1, repeat=3, metrics=_throughput("batched"))
+async def bench_intent_batched():
+    await _classify_all(batched_service, "batched")
+
+
+# Priority scheduling: a burst of greeting chit-chat with a few users mid-verification
+
+scheduled_stub = StubLLM(base_latency_ms=10, concurrency=64)
+scheduled_service = AIService(complete=scheduled_stub.complete, intent_batch_window_ms=0,
+                              scheduler=LLMScheduler(max_concurrency=4))
+
+
+async def _timed(coro, latencies):
+    start = time.perf_counter()
+    await coro
+    latencies.append(time.perf_counter() - start)
+
+
+def _median_ms(values):
+    return round(statistics.median(values) * 1000, 1)
+
+
+@benchmark("ai.scheduler.mixed_priority", number=1, repeat=3,
+           metrics=lambda: dict(_last_run["scheduler"]))
+async def bench_scheduler_mixed_priority():
+    low, high = [], []
+    await asyncio.gather(
+        *(_timed(scheduled_service.analyze_intent("hello", {"conversation_state": "greeting"}), low)
+          for _ in range(64)),
+        *(_timed(scheduled_service.analyze_intent("yes", {"conversation_state": "verification"}), high)
+          for _ in range(8)),
+    )
+    _last_run["scheduler"] = {"high_median_ms": _median_ms(high), "low_median_ms": _median_ms(low)}
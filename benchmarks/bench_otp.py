@@ -0,0 +1,24 @@
+"""
+OTP store cost per issue and check, and an issuance spike: many sessions
+reaching verification at once against one store
+"""
+import asyncio
+
+from utils.otp_store import InMemoryOTPBackend, OTPStore
+
+from .harness import benchmark
+
+SPIKE = 10000
+
+otp_store = OTPStore(InMemoryOTPBackend(), b"bench-secret")
+
+
+@benchmark("otp.issue_and_verify", number=5000)
+async def bench_otp_issue_and_verify():
+    challenge = await otp_store.issue("9876543210", "4321")
+    await otp_store.verify(challenge, "9876543210", "4321")
+
+
+@benchmark("otp.issue_spike", number=1, repeat=5)
+async def bench_otp_issue_spike():
+    await asyncio.gather(*(otp_store.issue(f"98765{i:05d}", "4321") for i in range(SPIKE)))
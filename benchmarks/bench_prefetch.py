@@ -0,0 +1,72 @@
+"""
+KYC-to-decision latency with realistic CRM and bureau latency, with and
+without prefetching them when the phone number is captured
+"""
+import asyncio
+import time
+
+from agents.master_agent import MasterAgent
+from agents.pricing import get_rate_card_store
+from agents.session_state import SessionState
+from mock_services.crm_api import CRMService
+from mock_services.credit_bureau import CreditBureauService
+
+from .harness import benchmark
+
+BACKEND_LATENCY = 0.05  # Per CRM / bureau call
+OTP_THINK_TIME = 0.2    # User reading the SMS and typing the OTP
+
+
+class SlowCRMService(CRMService):
+    blocking = True
+
+    def get_customer_by_phone(self, phone):
+        time.sleep(BACKEND_LATENCY)
+        return super().get_customer_by_phone(phone)
+
+
+class SlowCreditBureauService(CreditBureauService):
+    blocking = True
+
+    def get_bureau_report(self, phone, pan=None):
+        time.sleep(BACKEND_LATENCY)
+        return super().get_bureau_report(phone, pan)
+
+
+crm_service = SlowCRMService()
+credit_service = SlowCreditBureauService(rate_card=get_rate_card_store().current)
+
+agents = {prefetch: MasterAgent(crm_service, credit_service, None, prefetch=prefetch) for prefetch in (True, False)}
+
+_last_run = {}
+
+
+def _session_state() -> SessionState:
+    state = SessionState("bench-prefetch")
+    state.conversation_state = "sales"
+    state.user_context["name"] = "Rahul"
+    state.sales_step = "phone"
+    state.sales_data = {"loan_amount": 200000, "tenure": 24, "purpose": "Wedding"}
+    return state
+
+
+async def _kyc_to_decision(prefetch: bool):
+    agent, state = agents[prefetch], _session_state()
+    prompt = await agent.process_message(state, "9876543210")
+    otp = prompt["metadata"]["otp"]
+    await asyncio.sleep(OTP_THINK_TIME)
+
+    start = time.perf_counter()
+    await agent.process_message(state, otp)
+    await agent.process_message(state, "Yes, correct")
+    _last_run[prefetch] = {"kyc_to_decision_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+@benchmark("master.kyc_to_decision.prefetch", number=1, repeat=5, metrics=lambda: _last_run[True])
+async def bench_kyc_to_decision_prefetch():
+    await _kyc_to_decision(prefetch=True)
+
+
+@benchmark("master.kyc_to_decision.inline", number=1, repeat=5, metrics=lambda: _last_run[False])
+async def bench_kyc_to_decision_inline():
+    await _kyc_to_decision(prefetch=False)
@@ -0,0 +1,22 @@
+"""
+Replay of the synthetic conversation corpus through MasterAgent: whole-turn
+CPU cost of the agent layer, including sanction letter rendering
+"""
+import time
+
+from tools.replay import replay_corpus, synthetic_corpus
+
+from .harness import benchmark
+
+SESSIONS = 50
+CORPUS = list(synthetic_corpus(SESSIONS))
+
+_last_run = {}
+
+
+@benchmark("replay.synthetic_corpus", number=1, repeat=5,
+           metrics=lambda: {"turns_per_sec": round(_last_run["turns_per_sec"])})
+async def bench_replay_synthetic_corpus():
+    start = time.perf_counter()
+    results = await replay_corpus(CORPUS, seed=0, concurrency=16)
+    _last_run["turns_per_sec"] = results["turns"] / (time.perf_counter() - start)
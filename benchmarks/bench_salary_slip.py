@@ -0,0 +1,46 @@
+"""
+Salary slip parsing: extracting the figures from a one-page payroll PDF, and
+a re-upload of the same file answered from the content-hash cache
+"""
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from reportlab.pdfgen import canvas
+
+from utils.salary_slip_parser import SalarySlipParser, parse_salary_slip
+
+from .harness import benchmark
+
+
+def _slip_pdf() -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.drawString(72, 780, "Infosys Technologies Ltd")
+    pdf.setFont("Helvetica", 10)
+    pdf.drawString(72, 760, "Payslip for the month of December 2023")
+    rows = [("Basic Salary", "40,000.00"), ("HRA", "16,000.00"), ("Special Allowance", "19,000.00"),
+            ("Gross Earnings", "75,000.00"), ("Provident Fund", "4,800.00"), ("Professional Tax", "200.00"),
+            ("Net Pay", "Rs. 68,500.00")]
+    for i, (label, amount) in enumerate(rows):
+        pdf.drawString(72, 700 - 18 * i, label)
+        pdf.drawRightString(400, 700 - 18 * i, amount)
+    pdf.save()
+    return buffer.getvalue()
+
+
+SLIP = _slip_pdf()
+
+cached_parser = SalarySlipParser(executor=ThreadPoolExecutor(1))
+asyncio.run(cached_parser.parse(SLIP))  # Every timed call is a cache hit
+
+
+@benchmark("salary_slip.parse_pdf", number=200)
+def bench_parse_pdf():
+    parse_salary_slip(SLIP)
+
+
+@benchmark("salary_slip.parse_cached", number=5000)
+async def bench_parse_cached():
+    await cached_parser.parse(SLIP)
@@ -0,0 +1,79 @@
+"""
+Memory held per session: traced bytes per idle session, per message added
+to a conversation, and for the agents' state of a new conversation. The
+runs are gated on those byte counts; their timing (building the population
+under tracemalloc) is only reported.
+"""
+import gc
+import tracemalloc
+
+from agents.session_state import SessionState
+from utils.session_manager import SessionManager
+
+from .harness import benchmark
+
+SESSIONS = 10000
+MESSAGES = 20
+
+_last_run = {}
+
+
+def _traced(build) -> int:
+    """Bytes still allocated once ``build`` returns, with its result kept alive"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def _idle_sessions() -> SessionManager:
+    manager = SessionManager()
+    for i in range(SESSIONS):
+        manager.create_session(f"session-{i:06d}")
+    return manager
+
+
+def _conversations() -> SessionManager:
+    manager = _idle_sessions()
+    for session_id in manager.sessions:
+        for turn in range(MESSAGES // 2):
+            manager.add_message(session_id, {"sender": "user", "content": "5 lakhs"})
+            manager.add_message(session_id, {"sender": "bot", "content": "Great choice!",
+                                             "metadata": {"loan_amount": 500000}})
+    return manager
+
+
+@benchmark("session.memory.idle", number=1, repeat=1, threshold=0.1,
+           metrics=lambda: {"bytes_per_session": _last_run["idle"]}, gate_metrics=("bytes_per_session",))
+def bench_memory_idle():
+    _last_run["idle"] = round(_traced(_idle_sessions) / SESSIONS)
+
+
+@benchmark("session.memory.messages", number=1, repeat=1, threshold=0.1,
+           metrics=lambda: {"bytes_per_message": _last_run["messages"]}, gate_metrics=("bytes_per_message",))
+def bench_memory_messages():
+    total = _traced(_conversations)
+    # Session ids and the message text are shared by both runs, so the
+    # difference is what the history itself costs
+    idle = _traced(_idle_sessions)
+    _last_run["messages"] = round((total - idle) / (SESSIONS * MESSAGES))
+
+
+_session_ids = [f"session-{i:06d}" for i in range(SESSIONS)]
+
+
+def _agent_states():
+    # Keyed like backend.main.session_states; the agents themselves are shared
+    return {session_id: SessionState(session_id) for session_id in _session_ids}
+
+
+@benchmark("session.memory.agent_state", number=1, repeat=1, threshold=0.1,
+           metrics=lambda: {"bytes_per_session": _last_run["agent_state"]}, gate_metrics=("bytes_per_session",))
+def bench_memory_agent_state():
+    _last_run["agent_state"] = round(_traced(_agent_states) / SESSIONS)
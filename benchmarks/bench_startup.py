@@ -0,0 +1,30 @@
+"""
+Worker cold-start benchmark: a fresh interpreter imports the app and the
+first WebSocket connection is accepted and greeted
+"""
+import os
+import subprocess
+import sys
+
+from .harness import benchmark
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Absolute ceiling for time-to-first-accepted-WebSocket, on top of the baseline gate
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "3000"))
+
+FIRST_WEBSOCKET_SCRIPT = """
+from starlette.testclient import TestClient
+from backend.main import app
+
+with TestClient(app) as client:
+    with client.websocket_connect("/ws/startup-bench") as websocket:
+        websocket.receive_json()
+"""
+
+
+@benchmark("startup.first_websocket", number=1, repeat=5, budget_ns=STARTUP_BUDGET_MS * 1e6)
+def bench_first_websocket():
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    subprocess.run([sys.executable, "-c", FIRST_WEBSOCKET_SCRIPT], env=env, check=True,
+                   stdout=subprocess.DEVNULL)
@@ -0,0 +1,33 @@
+"""
+Tracing overhead: bare spans with sampling off and on, and a full traced
+turn to compare against master.process_message.sales_amount
+"""
+from utils.tracing import Tracer, RingBufferExporter, tracer
+
+from .bench_agents import _setup_sales_amount, master_agent
+from .harness import benchmark
+
+unsampled_tracer = Tracer(sample_rate=0.0)
+sampled_tracer = Tracer(sample_rate=1.0, exporters=[RingBufferExporter()])
+
+
+@benchmark("tracing.span.unsampled", number=100000)
+def bench_span_unsampled():
+    with unsampled_tracer.span("bench"):
+        pass
+
+
+@benchmark("tracing.span.sampled", number=20000)
+def bench_span_sampled():
+    with sampled_tracer.span("bench", state="sales"):
+        with sampled_tracer.span("bench.child"):
+            pass
+
+
+@benchmark("master.process_message.sales_amount.traced", number=2000, setup=_setup_sales_amount)
+async def bench_sales_amount_traced(state):
+    tracer.sample_rate = 1.0
+    try:
+        await master_agent.process_message(state, "5 lakhs")
+    finally:
+        tracer.sample_rate = 0.0
@@ -0,0 +1,153 @@
+"""
+Chat turns per second through the app's two transports: the WebSocket and
+the SSE stream with POSTed turns. Both drive the ASGI app directly, so the
+figures compare the endpoints (routing, framing, the agents behind them)
+without a network in between.
+
+``transport.event_stream.ratio`` gates the gap between them: WebSocket over
+SSE turns per second, the median of back-to-back rounds so a noisy machine
+slows both sides of a pair alike.
+"""
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+
+from tools.replay import OTP_PLACEHOLDER, synthetic_corpus
+
+from .harness import benchmark
+
+SESSIONS = 16
+CORPUS = list(synthetic_corpus(SESSIONS, seed=1))
+TURNS = sum(len(session["turns"]) for session in CORPUS)
+
+_best_run = {}  # Turns per second of the fastest round, like the reported min time
+_paired_runs = []  # WebSocket over SSE turns per second, one per pair of rounds
+
+
+def _app():
+    # Imported on first use: the app starts services that other benchmarks don't need
+    import utils.session_manager
+    from backend import main
+
+    utils.session_manager.ARCHIVE_DIR = tempfile.mkdtemp(prefix="bench-archives-")
+    return main
+
+
+def _scope(kind: str, method: str, path: str) -> dict:
+    return {"type": kind, "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http" if kind == "http" else "ws", "path": path, "raw_path": path.encode(),
+            "root_path": "", "query_string": b"", "headers": [(b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 50000), "server": ("bench", 80), "subprotocols": []}
+
+
+def _next_turn(message: str, otp: str) -> str:
+    return otp if message == OTP_PLACEHOLDER else message
+
+
+async def _websocket_session(app, session: dict):
+    inbox, outbox = asyncio.Queue(), asyncio.Queue()
+    handler = asyncio.create_task(app(_scope("websocket", "GET", f"/ws/{session['session_id']}"),
+                                      inbox.get, outbox.put))
+
+    async def reply() -> dict:
+        while True:
+            event = await outbox.get()
+            if event["type"] == "websocket.send":
+                return json.loads(event["text"])
+
+    await inbox.put({"type": "websocket.connect"})
+    otp = (await reply()).get("metadata", {}).get("otp", "")
+    for message in session["turns"]:
+        await inbox.put({"type": "websocket.receive", "text": json.dumps({"content": _next_turn(message, otp)})})
+        otp = (await reply()).get("metadata", {}).get("otp", otp)
+    await inbox.put({"type": "websocket.disconnect", "code": 1000})
+    await handler
+
+
+async def _request(app, method: str, path: str, body: dict = None) -> int:
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": json.dumps(body).encode() if body else b"", "more_body": False}
+
+    async def send(event):
+        sent.append(event)
+
+    await app(_scope("http", method, path), receive, send)
+    return sent[0]["status"]
+
+
+async def _event_stream_session(app, session: dict):
+    session_id = session["session_id"]
+    disconnected, chunks = asyncio.Event(), asyncio.Queue()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(event):
+        if event["type"] == "http.response.body" and event.get("body"):
+            await chunks.put(event["body"])
+
+    stream = asyncio.create_task(app(_scope("http", "GET", f"/chat/{session_id}/events"), receive, send))
+    buffered = b""
+
+    async def reply() -> dict:
+        nonlocal buffered
+        while True:
+            while b"\n\n" in buffered:
+                event, buffered = buffered.split(b"\n\n", 1)
+                for line in event.split(b"\n"):
+                    if line.startswith(b"data: "):
+                        return json.loads(line[6:])
+            buffered += await chunks.get()
+
+    otp = (await reply()).get("metadata", {}).get("otp", "")
+    for message in session["turns"]:
+        await _request(app, "POST", f"/chat/{session_id}/messages", {"content": _next_turn(message, otp)})
+        otp = (await reply()).get("metadata", {}).get("otp", otp)
+    # Like closing the WebSocket: the session is archived and the stream ends
+    await _request(app, "DELETE", f"/chat/{session_id}")
+    disconnected.set()
+    await stream
+
+
+async def _run(transport) -> float:
+    main = _app()
+    start = time.perf_counter()
+    await asyncio.gather(*(transport(main.app, session) for session in CORPUS))
+    elapsed = time.perf_counter() - start
+    # Leave nothing bound to this round's event loop
+    await main.event_streams.shutdown()
+    await main.manager.shutdown()
+    await main.job_queue.shutdown()
+    return TURNS / elapsed
+
+
+@benchmark("transport.websocket.turns", number=1, repeat=5,
+           metrics=lambda: {"turns_per_sec": round(_best_run["websocket"])})
+async def bench_websocket_turns():
+    turns_per_sec = await _run(_websocket_session)
+    _best_run["websocket"] = max(_best_run.get("websocket", 0), turns_per_sec)
+
+
+@benchmark("transport.event_stream.turns", number=1, repeat=5,
+           metrics=lambda: {"turns_per_sec": round(_best_run["event_stream"])})
+async def bench_event_stream_turns():
+    turns_per_sec = await _run(_event_stream_session)
+    _best_run["event_stream"] = max(_best_run.get("event_stream", 0), turns_per_sec)
+
+
+@benchmark("transport.event_stream.ratio", number=1, repeat=7, threshold=0.2,
+           metrics=lambda: {"ws_over_sse": round(statistics.median(_paired_runs), 2)},
+           gate_metrics=("ws_over_sse",))
+async def bench_transport_ratio():
+    event_stream = await _run(_event_stream_session)
+    _paired_runs.append(await _run(_websocket_session) / event_stream)
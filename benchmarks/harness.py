@@ -0,0 +1,228 @@
+"""
+Microbenchmark harness with JSON baselines and regression gating
+"""
+import asyncio
+import gc
+import inspect
+import json
+import os
+import statistics
+import time
+from typing import Dict, Any, Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_THRESHOLD = 0.25  # Fail when a benchmark gets 25% slower than its baseline
+
+# Registry of all benchmarks, filled in by the @benchmark decorator
+BENCHMARKS: Dict[str, "Benchmark"] = {}
+
+
+class Benchmark:
+    def __init__(self, name: str, func: Callable, setup: Optional[Callable] = None,
+                 number: int = 1000, repeat: int = 7, threshold: Optional[float] = None,
+                 budget_ns: Optional[float] = None, metrics: Optional[Callable] = None,
+                 gate_metrics: Sequence[str] = ()):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.number = number
+        self.repeat = repeat
+        self.threshold = threshold
+        self.budget_ns = budget_ns
+        self.metrics = metrics
+        self.gate_metrics = tuple(gate_metrics)
+        self.is_async = inspect.iscoroutinefunction(func)
+
+
+def benchmark(name: str, number: int = 1000, repeat: int = 7, setup: Optional[Callable] = None,
+              threshold: Optional[float] = None, budget_ns: Optional[float] = None,
+              metrics: Optional[Callable] = None, gate_metrics: Sequence[str] = ()):
+    """Register a benchmark.
+
+    When ``setup`` is given it is called before every iteration (outside the
+    timed region) and its return value is passed to the benchmarked function.
+    ``budget_ns`` is an absolute ceiling that fails the run regardless of the
+    stored baseline. ``metrics`` returns extra, non-timing figures (e.g. output
+    size) collected once after timing and reported alongside the result.
+    ``gate_metrics`` names metrics to gate on instead of the timing, for
+    benchmarks whose figure of interest is not how long they take (e.g. bytes
+    held); a rise beyond the threshold in any of them is a regression.
+    """
+    def decorator(func: Callable) -> Callable:
+        BENCHMARKS[name] = Benchmark(name, func, setup, number, repeat, threshold, budget_ns, metrics,
+                                     gate_metrics)
+        return func
+    return decorator
+
+
+def _time_sync(bench: Benchmark) -> float:
+    """Time one round of a synchronous benchmark, returns total nanoseconds"""
+    func, setup = bench.func, bench.setup
+    if setup is None:
+        start = time.perf_counter_ns()
+        for _ in range(bench.number):
+            func()
+        return time.perf_counter_ns() - start
+
+    total = 0
+    for _ in range(bench.number):
+        args = setup()
+        start = time.perf_counter_ns()
+        func(args)
+        total += time.perf_counter_ns() - start
+    return total
+
+
+async def _time_async(bench: Benchmark) -> float:
+    """Time one round of a coroutine benchmark, returns total nanoseconds"""
+    func, setup = bench.func, bench.setup
+    if setup is None:
+        start = time.perf_counter_ns()
+        for _ in range(bench.number):
+            await func()
+        return time.perf_counter_ns() - start
+
+    total = 0
+    for _ in range(bench.number):
+        args = setup()
+        start = time.perf_counter_ns()
+        await func(args)
+        total += time.perf_counter_ns() - start
+    return total
+
+
+def run_benchmark(bench: Benchmark) -> Dict[str, Any]:
+    """Run a benchmark ``repeat`` times and summarise nanoseconds per operation"""
+    rounds: List[float] = []
+    for _ in range(bench.repeat):
+        # Like timeit, keep collector pauses out of the measurement
+        gc.collect()
+        gc.disable()
+        try:
+            if bench.is_async:
+                total = asyncio.run(_time_async(bench))
+            else:
+                total = _time_sync(bench)
+        finally:
+            gc.enable()
+        rounds.append(total / bench.number)
+
+    result = {
+        "min_ns": round(min(rounds), 1),
+        "median_ns": round(statistics.median(rounds), 1),
+        "number": bench.number,
+        "repeat": bench.repeat,
+    }
+    if bench.metrics:
+        result["metrics"] = bench.metrics()
+    return result
+
+
+def load_baselines(path: str) -> Dict[str, Dict[str, Any]]:
+    """Load stored baselines, an empty mapping when none were saved yet"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("benchmarks", {})
+
+
+def save_baselines(path: str, results: Dict[str, Dict[str, Any]]):
+    """Merge results into the baseline file, keeping benchmarks that were not run"""
+    baselines = load_baselines(path)
+    for name, result in results.items():
+        entry = {"min_ns": result["min_ns"], "median_ns": result["median_ns"]}
+        if "metrics" in result:
+            entry["metrics"] = result["metrics"]
+        # Keep hand-tuned per-benchmark thresholds across baseline refreshes
+        if "threshold" in baselines.get(name, {}):
+            entry["threshold"] = baselines[name]["threshold"]
+        baselines[name] = entry
+
+    with open(path, "w") as f:
+        json.dump({"benchmarks": dict(sorted(baselines.items()))}, f, indent=2)
+        f.write("\n")
+
+
+def gated_change(result: Dict[str, Any], baseline: Dict[str, Any],
+                 bench: Optional[Benchmark]) -> Tuple[Optional[float], Optional[str]]:
+    """Relative change a result is gated on and the metric it came from.
+
+    That is the change in ``min_ns``, or the worst change among the
+    benchmark's ``gate_metrics``; ``(None, None)`` when the baseline has none
+    of those metrics to compare with.
+    """
+    if not (bench and bench.gate_metrics):
+        return (result["min_ns"] - baseline["min_ns"]) / baseline["min_ns"], None
+    current, stored = result.get("metrics", {}), baseline.get("metrics", {})
+    worst, worst_metric = None, None
+    for metric in bench.gate_metrics:
+        if not stored.get(metric):
+            continue
+        change = (current.get(metric, float("inf")) - stored[metric]) / stored[metric]
+        if worst is None or change > worst:
+            worst, worst_metric = change, metric
+    return worst, worst_metric
+
+
+def gate_value(result: Dict[str, Any], bench: Optional[Benchmark],
+               baseline: Optional[Dict[str, Any]] = None) -> float:
+    """The figure a result is gated on, lower being better: the same change
+    ``compare`` gates on, or min_ns when there is nothing to compare with"""
+    if baseline:
+        change, _ = gated_change(result, baseline, bench)
+        if change is not None:
+            return change
+    return result["min_ns"]
+
+
+def compare(results: Dict[str, Dict[str, Any]], baselines: Dict[str, Dict[str, Any]],
+            threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """Compare results against baselines, returning one row per benchmark.
+
+    ``min_ns`` is used for gating because it is the least noisy statistic on
+    shared CI machines, unless the benchmark names ``gate_metrics``: then the
+    worst change among those metrics is gated and the timing is only shown.
+    The threshold can be overridden per benchmark either in the baseline file
+    or via ``@benchmark(threshold=...)``.
+    """
+    rows = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        bench = BENCHMARKS.get(name)
+        row = {"name": name, "min_ns": result["min_ns"], "baseline_ns": None,
+               "change": None, "regressed": False, "gated_metric": None}
+
+        if baseline:
+            limit = baseline.get("threshold")
+            if limit is None:
+                limit = bench.threshold if bench and bench.threshold is not None else threshold
+            row["baseline_ns"] = baseline["min_ns"]
+            change, metric = gated_change(result, baseline, bench)
+            row["change"] = change
+            row["regressed"] = change is not None and change > limit
+            if metric:
+                row.update(gated_metric=metric, value=result.get("metrics", {}).get(metric),
+                           baseline_value=baseline["metrics"][metric])
+
+        if bench and bench.budget_ns is not None and result["min_ns"] > bench.budget_ns:
+            row["regressed"] = True
+
+        rows.append(row)
+    return rows
+
+
+def format_ns(value: Optional[float]) -> str:
+    """Human friendly duration"""
+    if value is None:
+        return "-"
+    if value >= 1e6:
+        return f"{value / 1e6:.2f} ms"
+    if value >= 1e3:
+        return f"{value / 1e3:.2f} us"
+    return f"{value:.0f} ns"
+
+
+def format_metric(value: Optional[float]) -> str:
+    """Metric value with thousands separators, "-" when it was not reported"""
+    if value is None:
+        return "-"
+    return f"{value:,}"
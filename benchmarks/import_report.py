@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Import-time report: per-module import cost of a module, e.g. what a
+gunicorn worker pays before it can accept its first connection.
+
+    python -m benchmarks.import_report                  # backend.main
+    python -m benchmarks.import_report agents.master_agent --top 15
+    python -m benchmarks.import_report --by-package
+
+Runs the import in a fresh interpreter with ``-X importtime`` so nothing
+already imported by the caller hides the real cost.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def profile_imports(module: str) -> List[Dict]:
+    """Import ``module`` in a clean interpreter and parse the importtime log"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return entries
+
+
+def by_package(entries: List[Dict]) -> Dict[str, int]:
+    """Total self time per top-level package"""
+    totals: Dict[str, int] = {}
+    for entry in entries:
+        package = entry["module"].split(".")[0]
+        totals[package] = totals.get(package, 0) + entry["self_us"]
+    return totals
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Report per-module import cost")
+    parser.add_argument("module", nargs="?", default="backend.main")
+    parser.add_argument("--top", type=int, default=25, help="number of rows to show")
+    parser.add_argument("--by-package", action="store_true", help="aggregate self time by top-level package")
+    args = parser.parse_args(argv)
+
+    entries = profile_imports(args.module)
+    total_us = sum(entry["self_us"] for entry in entries)
+    print(f"Importing {args.module}: {total_us / 1000:.1f} ms across {len(entries)} modules\n")
+
+    if args.by_package:
+        rows = sorted(by_package(entries).items(), key=lambda item: item[1], reverse=True)
+        print(f"{'package':<40} {'self ms':>9} {'share':>7}")
+        for package, self_us in rows[:args.top]:
+            print(f"{package:<40} {self_us / 1000:>9.1f} {self_us / total_us:>7.1%}")
+        return 0
+
+    rows = sorted(entries, key=lambda entry: entry["cumulative_us"], reverse=True)
+    print(f"{'module':<50} {'self ms':>9} {'cumul. ms':>10}")
+    for entry in rows[:args.top]:
+        name = "  " * entry["depth"] + entry["module"]
+        print(f"{name:<50} {entry['self_us'] / 1000:>9.1f} {entry['cumulative_us'] / 1000:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
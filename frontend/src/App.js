@@ -3,6 +3,7 @@ import './App.css';
 import FloatingChatbot from './components/FloatingChatbot';
 
 const WEBSOCKET_URL = 'ws://localhost:8000/ws';
+const API_URL = 'http://localhost:8000';
 
 function App() {
   const [messages, setMessages] = useState([]);
@@ -14,15 +15,22 @@ function App() {
   const [showMainChat, setShowMainChat] = useState(false);
   
   const websocket = useRef(null);
+  // Set when WebSockets are blocked and the chat runs over SSE + POST instead
+  const eventSource = useRef(null);
+  const reconnectTimer = useRef(null);
   const messagesEndRef = useRef(null);
   const fileInputRef = useRef(null);
 
   useEffect(() => {
     connectWebSocket();
     return () => {
+      clearTimeout(reconnectTimer.current);
       if (websocket.current) {
         websocket.current.close();
       }
+      if (eventSource.current) {
+        eventSource.current.close();
+      }
     };
   }, []);
 
@@ -30,38 +38,63 @@ function App() {
     scrollToBottom();
   }, [messages]);
 
+  const handleFrame = (data) => {
+    if (data.error === 'server_busy') {
+      // This server is full; try again when it says to
+      reconnectTimer.current = setTimeout(connectWebSocket, (data.retry_after || 5) * 1000);
+      return;
+    }
+    if (data.type === 'upload_status') {
+      // The bot's reply to the slip follows as a normal message
+      setIsTyping(data.stage === 'parsing' || data.stage === 'parsed');
+      return;
+    }
+    setIsTyping(false);
+    
+    setMessages(prev => [...prev, {
+      id: Date.now(),
+      content: data.content,
+      sender: 'bot',
+      timestamp: data.timestamp,
+      metadata: {
+        ...data.metadata || {},
+        suggestions: data.suggestions || []
+      }
+    }]);
+    
+    // Check if salary slip upload is required
+    if (data.metadata?.salary_required) {
+      setShowUpload(true);
+    }
+  };
+
   const connectWebSocket = () => {
+    let opened = false;
     websocket.current = new WebSocket(`${WEBSOCKET_URL}/${sessionId}`);
     
     websocket.current.onopen = () => {
+      opened = true;
       setIsConnected(true);
       console.log('Connected to chatbot');
     };
     
     websocket.current.onmessage = (event) => {
       const data = JSON.parse(event.data);
-      setIsTyping(false);
-      
-      setMessages(prev => [...prev, {
-        id: Date.now(),
-        content: data.content,
-        sender: 'bot',
-        timestamp: data.timestamp,
-        metadata: {
-          ...data.metadata || {},
-          suggestions: data.suggestions || []
-        }
-      }]);
-      
-      // Check if salary slip upload is required
-      if (data.metadata?.salary_required) {
-        setShowUpload(true);
+      if (data.type === 'ping') {
+        websocket.current.send(JSON.stringify({ type: 'pong' }));
+        return;
       }
+      handleFrame(data);
     };
     
     websocket.current.onclose = () => {
       setIsConnected(false);
       console.log('Disconnected from chatbot');
+      if (!opened) {
+        // The socket never opened, e.g. a proxy that blocks WebSockets
+        websocket.current = null;
+        connectEventStream();
+      }
     };
     
     websocket.current.onerror = (error) => {
@@ -69,10 +102,44 @@ function App() {
     };
   };
 
+  const connectEventStream = () => {
+    // EventSource reconnects by itself and resumes from the last frame it saw
+    eventSource.current = new EventSource(`${API_URL}/chat/${sessionId}/events`);
+    
+    eventSource.current.onopen = () => {
+      setIsConnected(true);
+      console.log('Connected to chatbot over SSE');
+    };
+    
+    eventSource.current.onmessage = (event) => {
+      handleFrame(JSON.parse(event.data));
+    };
+    
+    eventSource.current.onerror = () => {
+      setIsConnected(false);
+      if (eventSource.current.readyState === EventSource.CLOSED) {
+        // Refused (e.g. the server is full); EventSource won't retry that on its own
+        reconnectTimer.current = setTimeout(connectEventStream, 5000);
+      }
+    };
+  };
+
+  const sendToServer = (message) => {
+    if (eventSource.current) {
+      fetch(`${API_URL}/chat/${sessionId}/messages`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(message)
+      }).catch(error => console.error('Send error:', error));
+    } else {
+      websocket.current.send(JSON.stringify(message));
+    }
+  };
+
   const sendMessage = (messageText = null) => {
     const textToSend = messageText || inputMessage.trim();
     
-    if (textToSend && websocket.current && isConnected) {
+    if (textToSend && isConnected) {
       const message = {
         content: textToSend,
         sender: 'user',
@@ -83,7 +150,7 @@ function App() {
       setMessages(prev => [...prev, { ...message, id: Date.now() }]);
       
       // Send to server
-      websocket.current.send(JSON.stringify(message));
+      sendToServer(message);
       
       setInputMessage('');
       setIsTyping(true);
@@ -108,31 +175,36 @@ function App() {
     const formData = new FormData();
     formData.append('file', file);
 
+    // Shown before the upload, so the bot's reply over the WebSocket or event stream lands after it
+    setMessages(prev => [...prev, {
+      id: Date.now(),
+      content: `📎 Salary slip uploaded: ${file.name}`,
+      sender: 'user',
+      timestamp: new Date().toISOString()
+    }]);
+
     try {
-      const response = await fetch(`http://localhost:8000/upload-salary-slip/${sessionId}`, {
+      const response = await fetch(`${API_URL}/upload-salary-slip/${sessionId}`, {
         method: 'POST',
         body: formData
       });
       
       const result = await response.json();
       
-      // Add upload confirmation message
-      setMessages(prev => [...prev, {
-        id: Date.now(),
-        content: `📎 Salary slip uploaded: ${file.name}`,
-        sender: 'user',
-        timestamp: new Date().toISOString()
-      }]);
-      
-      // Add bot response
-      setMessages(prev => [...prev, {
-        id: Date.now() + 1,
-        content: result.message,
-        sender: 'bot',
-        timestamp: new Date().toISOString()
-      }]);
+      if (result.status === 'error') {
+        setMessages(prev => [...prev, {
+          id: Date.now() + 1,
+          content: result.message,
+          sender: 'bot',
+          timestamp: new Date().toISOString()
+        }]);
+        return;
+      }
       
-      setShowUpload(false);
+      // The bot's reply arrives over the WebSocket or event stream; keep the upload open if the slip was unreadable
+      if (result.salary_slip_status === 'parsed') {
+        setShowUpload(false);
+      }
       
     } catch (error) {
       console.error('Upload error:', error);
@@ -150,13 +222,13 @@ function App() {
     if (messages.length === 0) {
       // Auto-start conversation
       setTimeout(() => {
-        if (websocket.current && isConnected) {
+        if (isConnected) {
           const welcomeMessage = {
             content: "start",
             sender: 'user',
             timestamp: new Date().toISOString()
           };
-          websocket.current.send(JSON.stringify(welcomeMessage));
+          sendToServer(welcomeMessage);
           setIsTyping(true);
         }
       }, 500);
@@ -0,0 +1,119 @@
+"""
+Async adapters for the CRM and credit bureau services.
+
+Agents only talk to these protocols. The bundled mocks are in-memory and
+cheap, so they are wrapped in-process; any other synchronous client (e.g. a
+requests-based CRM SDK) is assumed to block and is bridged onto a thread
+pool so it never stalls the event loop. Async-native clients that already
+implement the protocol are used as they are.
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+from concurrent.futures import Executor
+from typing import Any, Dict, Optional, Protocol, Tuple
+
+
+class CRMAdapter(Protocol):
+    async def get_customer_by_phone(self, phone: str) -> Optional[Dict[str, Any]]: ...
+
+    async def get_customer_by_id(self, customer_id: str) -> Optional[Dict[str, Any]]: ...
+
+    async def update_customer(self, phone: str, updates: Dict[str, Any]) -> bool: ...
+
+    async def create_customer(self, customer_data: Dict[str, Any]) -> str: ...
+
+
+class CreditBureauAdapter(Protocol):
+    async def get_credit_score(self, phone: str, pan: str = None) -> Dict[str, Any]: ...
+
+    async def get_bureau_report(self, phone: str, pan: str = None) -> Dict[str, Any]: ...
+
+    async def validate_pan(self, pan: str) -> Dict[str, Any]: ...
+
+
+class _SyncAdapter:
+    """Exposes a synchronous client's methods as coroutines"""
+
+    def __init__(self, client, executor: Optional[Executor] = None, threaded: bool = True):
+        self.client = client
+        self.executor = executor
+        self.threaded = threaded
+
+    async def _call(self, method: str, *args):
+        func = getattr(self.client, method)
+        if not self.threaded:
+            return func(*args)
+        # Carry the caller's context (e.g. the active trace span) into the worker thread
+        call = functools.partial(contextvars.copy_context().run, func, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+
+class SyncCRMAdapter(_SyncAdapter):
+    async def get_customer_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
+        return await self._call("get_customer_by_phone", phone)
+
+    async def get_customer_by_id(self, customer_id: str) -> Optional[Dict[str, Any]]:
+        return await self._call("get_customer_by_id", customer_id)
+
+    async def update_customer(self, phone: str, updates: Dict[str, Any]) -> bool:
+        return await self._call("update_customer", phone, updates)
+
+    async def create_customer(self, customer_data: Dict[str, Any]) -> str:
+        return await self._call("create_customer", customer_data)
+
+
+class SyncCreditBureauAdapter(_SyncAdapter):
+    async def get_credit_score(self, phone: str, pan: str = None) -> Dict[str, Any]:
+        return await self._call("get_credit_score", phone, pan)
+
+    async def get_bureau_report(self, phone: str, pan: str = None) -> Dict[str, Any]:
+        return await self._call("get_bureau_report", phone, pan)
+
+    async def validate_pan(self, pan: str) -> Dict[str, Any]:
+        return await self._call("validate_pan", pan)
+
+
+class QueuedCreditBureauAdapter:
+    """Bureau reports pulled as background jobs: retried on failure, and concurrent
+    pulls for the same applicant (prefetch and underwriting, say) share one call"""
+
+    def __init__(self, bureau: CreditBureauAdapter, jobs, job_name: str = "bureau.report"):
+        self.bureau = bureau
+        self.jobs = jobs
+        self.job_name = job_name
+
+    async def get_credit_score(self, phone: str, pan: str = None) -> Dict[str, Any]:
+        return await self.bureau.get_credit_score(phone, pan)
+
+    async def get_bureau_report(self, phone: str, pan: str = None) -> Dict[str, Any]:
+        return await self.jobs.run(self.job_name, phone, pan, idempotency_key=f"bureau:{phone}:{pan or ''}")
+
+    async def validate_pan(self, pan: str) -> Dict[str, Any]:
+        return await self.bureau.validate_pan(pan)
+
+
+def _adapt(client, adapter_class, probe: str, executor: Optional[Executor]):
+    if isinstance(client, _SyncAdapter) or inspect.iscoroutinefunction(getattr(client, probe, None)):
+        return client
+    # Clients declare ``blocking = False`` when their calls never do I/O
+    return adapter_class(client, executor, threaded=getattr(client, "blocking", True))
+
+
+def as_crm_adapter(client, executor: Optional[Executor] = None) -> CRMAdapter:
+    return _adapt(client, SyncCRMAdapter, "get_customer_by_phone", executor)
+
+
+def as_bureau_adapter(client, executor: Optional[Executor] = None) -> CreditBureauAdapter:
+    return _adapt(client, SyncCreditBureauAdapter, "get_bureau_report", executor)
+
+
+async def fetch_customer_and_bureau(crm: CRMAdapter, bureau: CreditBureauAdapter,
+                                    phone: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """CRM record and bureau report for one phone number, looked up concurrently"""
+    if not getattr(crm, "threaded", True) and not getattr(bureau, "threaded", True):
+        # Both run inline without awaiting anything; tasks would only add overhead
+        return await crm.get_customer_by_phone(phone), await bureau.get_bureau_report(phone)
+    customer, report = await asyncio.gather(crm.get_customer_by_phone(phone), bureau.get_bureau_report(phone))
+    return customer, report
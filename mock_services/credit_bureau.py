@@ -1,12 +1,28 @@
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional
 import random
 from datetime import datetime, timedelta
 
+from agents.pricing import format_rate, get_rate_card_store
+from utils.tracing import traced
+
+# Risk and approval odds reported for the lender's score bands, best band first;
+# a rate card with more or fewer bands is spread across them
+RISK_LEVELS = (("Low", "High"), ("Medium", "Good"), ("Medium-High", "Moderate"), ("High", "Low"))
+
 class CreditBureauService:
-    def __init__(self):
+    # In-memory lookups; adapters call them directly instead of via a thread pool
+    blocking = False
+    
+    def __init__(self, rng: Optional[random.Random] = None, rate_card: Optional[Callable[[], Any]] = None):
         # Mock credit bureau responses
         self.credit_data = {}
+        # Score jitter and enquiries; the replay engine passes a seeded generator
+        self.rng = rng or random
+        # Returns the lender's current rate card, whose score bands and rates the risk
+        # assessment follows; the app's hot-reloaded card unless another is injected
+        self.rate_card = rate_card or get_rate_card_store().current
     
+    @traced("credit_bureau.get_credit_score")
     def get_credit_score(self, phone: str, pan: str = None) -> Dict[str, Any]:
         """Fetch credit score from bureau"""
         
@@ -17,7 +33,7 @@ class CreditBureauService:
         base_score = 650 + (phone_last_digit * 15)
         
         # Add some randomness
-        score = base_score + random.randint(-20, 50)
+        score = base_score + self.rng.randint(-20, 50)
         score = max(300, min(900, score))  # Keep within valid range
         
         return {
@@ -82,13 +98,13 @@ class CreditBureauService:
         enquiries = []
         
         # Generate 0-3 recent enquiries
-        for i in range(random.randint(0, 3)):
-            enquiry_date = datetime.now() - timedelta(days=random.randint(1, 90))
+        for i in range(self.rng.randint(0, 3)):
+            enquiry_date = datetime.now() - timedelta(days=self.rng.randint(1, 90))
             
             enquiries.append({
                 "date": enquiry_date.strftime("%Y-%m-%d"),
-                "enquiry_type": random.choice(["Credit Card", "Personal Loan", "Auto Loan"]),
-                "institution": random.choice(["HDFC Bank", "ICICI Bank", "SBI", "Axis Bank"])
+                "enquiry_type": self.rng.choice(["Credit Card", "Personal Loan", "Auto Loan"]),
+                "institution": self.rng.choice(["HDFC Bank", "ICICI Bank", "SBI", "Axis Bank"])
             })
         
         return sorted(enquiries, key=lambda x: x["date"], reverse=True)
@@ -113,6 +129,7 @@ class CreditBureauService:
                 "error": "Invalid PAN format"
             }
     
+    @traced("credit_bureau.get_bureau_report")
     def get_bureau_report(self, phone: str, pan: str = None) -> Dict[str, Any]:
         """Get comprehensive credit bureau report"""
         
@@ -131,32 +148,18 @@ class CreditBureauService:
         }
     
     def _assess_risk(self, credit_score: int) -> Dict[str, Any]:
-        """Assess lending risk based on credit score"""
+        """Assess lending risk from the rate card's band for the credit score"""
+        rate_card = self.rate_card()
+        bands = rate_card.score_bands  # (name, min_score, rate), highest first
+        band = next((i for i, (_, min_score, _) in enumerate(bands) if credit_score >= min_score), len(bands) - 1)
+        risk_level, approval_probability = RISK_LEVELS[band * (len(RISK_LEVELS) - 1) // max(len(bands) - 1, 1)]
+        low, high = rate_card.rate_range(credit_score)
         
-        if credit_score >= 750:
-            return {
-                "risk_level": "Low",
-                "approval_probability": "High",
-                "recommended_rate": "10.99% - 12.99%"
-            }
-        elif credit_score >= 700:
-            return {
-                "risk_level": "Medium",
-                "approval_probability": "Good", 
-                "recommended_rate": "12.99% - 16.99%"
-            }
-        elif credit_score >= 650:
-            return {
-                "risk_level": "Medium-High",
-                "approval_probability": "Moderate",
-                "recommended_rate": "16.99% - 20.99%"
-            }
-        else:
-            return {
-                "risk_level": "High",
-                "approval_probability": "Low",
-                "recommended_rate": "20.99%+"
-            }
+        return {
+            "risk_level": risk_level,
+            "approval_probability": approval_probability,
+            "recommended_rate": f"{format_rate(low)} - {format_rate(high)}"
+        }
     
     def _get_recommendations(self, credit_score: int) -> list:
         """Get recommendations for credit improvement"""
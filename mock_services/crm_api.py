@@ -1,7 +1,12 @@
 from typing import Dict, Any, Optional
 import json
 
+from utils.tracing import traced
+
 class CRMService:
+    # In-memory lookups; adapters call them directly instead of via a thread pool
+    blocking = False
+    
     def __init__(self):
         # Mock customer database
         self.customers = {
@@ -117,6 +122,7 @@ class CRMService:
             }
         }
     
+    @traced("crm.get_customer_by_phone")
     def get_customer_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
         """Fetch customer data by phone number"""
         return self.customers.get(phone)
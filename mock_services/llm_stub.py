@@ -0,0 +1,107 @@
+"""
+Local stand-in for the LLM endpoint.
+
+Answers OpenAI-style chat completions for intent classification with the
+latency profile of a real model server: a fixed cost per request, a small
+cost per classified message and a limited number of concurrent slots. Used
+in-process by the intent batching benchmark, or run as a server:
+
+    uvicorn mock_services.llm_stub:app --port 8100
+    OPENAI_API_BASE=http://localhost:8100/v1 python backend/main.py
+"""
+import asyncio
+import os
+import re
+import time
+import uuid
+from typing import Dict, Any, List
+
+from fastapi import FastAPI
+
+# Checked in order, first match wins
+INTENT_KEYWORDS = (
+    ("greeting", ("hi", "hello", "hey")),
+    ("loan_inquiry", ("loan", "borrow", "money")),
+    ("amount_query", ("lakh", "thousand", "₹")),
+    ("tenure_query", ("year", "month", "tenure")),
+    ("rate_query", ("rate", "interest", "%")),
+    ("document_query", ("document", "papers")),
+    ("confirmation", ("yes", "ok", "sure")),
+    ("rejection", ("no", "not interested")),
+)
+
+_NUMBERED_LINE = re.compile(r"^(\d+)\.\s*(.*)$", re.MULTILINE)
+
+
+def classify(message: str) -> str:
+    message_lower = message.lower()
+    for intent, keywords in INTENT_KEYWORDS:
+        if any(word in message_lower for word in keywords):
+            return intent
+    return "general_query"
+
+
+class StubLLM:
+    def __init__(self, base_latency_ms: float = 20.0, per_item_ms: float = 0.5, concurrency: int = 8):
+        self.base_latency = base_latency_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.concurrency = concurrency
+        self.requests = 0
+        self._slots = None
+        self._loop = None
+
+    @classmethod
+    def from_env(cls) -> "StubLLM":
+        return cls(
+            base_latency_ms=float(os.getenv("LLM_STUB_LATENCY_MS", "20")),
+            per_item_ms=float(os.getenv("LLM_STUB_PER_ITEM_MS", "0.5")),
+            concurrency=int(os.getenv("LLM_STUB_CONCURRENCY", "8")),
+        )
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int = 50,
+                       temperature: float = 0.0) -> str:
+        """Reply to a chat completion request with the classified intent(s)"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+        text = messages[-1]["content"]
+        numbered = _NUMBERED_LINE.findall(text)
+        async with self._slots:
+            self.requests += 1
+            await asyncio.sleep(self.base_latency + self.per_item * max(len(numbered), 1))
+
+        if numbered:
+            # Batched prompt: drop each line's bracketed context before classifying
+            return "\n".join(f"{number}: {classify(line.rsplit(' [', 1)[0])}" for number, line in numbered)
+        return classify(text)
+
+
+def create_app(model: StubLLM) -> FastAPI:
+    app = FastAPI(title="LLM stub")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Dict[str, Any]):
+        content = await model.complete(request["messages"], request.get("max_tokens", 50),
+                                       request.get("temperature", 0.0))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+        }
+
+    return app
+
+
+app = create_app(StubLLM.from_env())
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("LLM_STUB_PORT", "8100")))
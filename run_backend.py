@@ -11,6 +11,9 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 if __name__ == "__main__":
+    if sys.version_info < (3, 11):
+        sys.exit("The backend needs Python 3.11 or newer (asyncio.timeout, Task.uncancel)")
+
     # Create necessary directories
     os.makedirs("temp", exist_ok=True)
     os.makedirs("generated_docs", exist_ok=True)
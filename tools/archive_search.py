@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Support search over archived conversations.
+
+    python -m tools.archive_search 'phone:98765*'
+    python -m tools.archive_search '"wrong details" decision:rejected' --limit 50
+    python -m tools.archive_search --backfill session_archives      # index archives written before the index existed
+
+Queries the same index as ``GET /admin/archives/search`` (ARCHIVE_INDEX_DIR,
+see utils/archive_index.py). ``--backfill`` streams every archive under a
+directory into it; segments are merged as they fill up.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, REPO_ROOT)
+
+from tools.backtest import iter_archives  # noqa: E402
+from utils.archive_index import ArchiveIndex, get_archive_index  # noqa: E402
+
+
+def backfill(index: ArchiveIndex, root: str) -> int:
+    count = 0
+    for path in iter_archives(root):
+        try:
+            with open(path) as f:
+                index.add(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  skipped {path}: {e}", file=sys.stderr)
+            continue
+        count += 1
+    index.close()
+    index.merge()
+    return count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Search archived conversations")
+    parser.add_argument("query", nargs="?", help="clauses that must all match, e.g. phone:98765* \"wrong details\"")
+    parser.add_argument("--limit", type=int, default=20, help="results to show (default: %(default)s)")
+    parser.add_argument("--backfill", metavar="ARCHIVES", help="index every archive under this directory first")
+    parser.add_argument("--json", action="store_true", help="print the raw results")
+    args = parser.parse_args(argv)
+    if not args.query and not args.backfill:
+        parser.error("give a query, --backfill or both")
+
+    index = get_archive_index()
+    if args.backfill:
+        start = time.perf_counter()
+        count = backfill(index, os.path.abspath(args.backfill))
+        stats = index.stats()
+        print(f"Indexed {count:,} archives in {time.perf_counter() - start:.1f}s: "
+              f"{stats['documents']:,} sessions in {stats['segments']} segment(s), {stats['bytes']:,} bytes")
+    if not args.query:
+        return 0
+
+    found = index.search(args.query, args.limit)
+    if args.json:
+        print(json.dumps(found, indent=2))
+        return 0
+    print(f"{found['total']:,} session(s) match {args.query!r} ({found['took_ms']} ms)")
+    for document in found["results"]:
+        outcome = document.get("decision") or document.get("final_state") or ""
+        if document.get("reason"):
+            outcome += f" ({document['reason']})"
+        print(f"  {document.get('ended_at') or '':<26} {document['session_id']:<36} {document.get('phone') or '':<12} "
+              f"{document.get('name') or '':<20} {document.get('approval_id') or '':<18} {outcome}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Underwriting policy backtest: how many past applicants would a candidate
+policy decide differently?
+
+    python -m tools.backtest candidate_policy.json
+    python -m tools.backtest candidate_policy.json --archives /data/session_archives --workers 8
+    python -m tools.backtest candidate_policy.json --flips flips.jsonl --json summary.json
+
+Streams session archives (``session_archives/**/*.json``) through a process
+pool, re-runs the candidate's eligibility and salary tables on each archived
+``user_context`` and prints a confusion matrix of the recorded outcome
+against the candidate's. Archives are listed lazily and only a few chunks per
+worker are in flight at a time, so memory stays flat for millions of files.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, REPO_ROOT)
+
+from agents.pricing import get_rate_card_store, price_loan  # noqa: E402
+from agents.underwriting_policy import FACTS, CompiledPolicy, load_policy  # noqa: E402
+
+OUTCOMES = ("approved", "salary_required", "rejected")
+UNKNOWN = "unknown"  # Archived before decisions were recorded, and never sanctioned
+REQUIRED_FACTS = ("credit_score", "loan_amount", "preapproved_limit")
+CHUNK_SIZE = 500
+CHUNKS_IN_FLIGHT_PER_WORKER = 4
+
+_policy: Optional[CompiledPolicy] = None
+
+
+def iter_archives(root: str) -> Iterator[str]:
+    """Paths of every archive under ``root``, without listing them all up front"""
+    pending = [root]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.name.endswith(".json"):
+                    yield entry.path
+
+
+def recorded_outcome(archive: Dict[str, Any]) -> str:
+    decision = archive["user_context"].get("underwriting_decision")
+    if decision and decision.get("status") in OUTCOMES:
+        return decision["status"]
+    # Older archives only have the state the conversation ended in
+    return "approved" if archive.get("final_state") == "sanction" else UNKNOWN
+
+
+def evaluate(policy: CompiledPolicy, context: Dict[str, Any]) -> Dict[str, Any]:
+    """Decide an archived application the way UnderwritingAgent would"""
+    facts = {fact: context[fact] for fact in FACTS if isinstance(context.get(fact), (int, float))}
+    decision = policy.evaluate("eligibility", facts)
+    # The CRM record carries a salary too; only an uploaded slip reaches the EMI check
+    salary = facts.get("salary") if context.get("salary_slip_verified") else None
+    if decision["status"] == "salary_required" and salary and "salary" in policy.tables:
+        # The EMI the applicant was quoted; archives from before pricing are priced with today's rate card
+        quote = context.get("loan_quote") or price_loan(get_rate_card_store().current(),
+                                                        {**context, "tenure": context.get("tenure") or 12})
+        emi = quote["emi"]
+        decision = policy.evaluate("salary", {**facts, "emi": emi})
+    return decision
+
+
+def _init_worker(policy_path: str):
+    global _policy
+    _policy = load_policy(policy_path)
+
+
+def backtest_chunk(paths: List[str]) -> Tuple[Counter, Counter, List[Dict[str, Any]]]:
+    """Confusion counts, skip reasons and flipped sessions for one chunk of archives"""
+    matrix, skipped, flips = Counter(), Counter(), []
+    for path in paths:
+        try:
+            with open(path) as f:
+                archive = json.load(f)
+            context = archive["user_context"]
+        except (OSError, ValueError, KeyError, TypeError):
+            skipped["unreadable"] += 1
+            continue
+        if not all(isinstance(context.get(fact), (int, float)) for fact in REQUIRED_FACTS):
+            skipped["not_underwritten"] += 1
+            continue
+
+        recorded = recorded_outcome(archive)
+        decision = evaluate(_policy, context)
+        candidate = decision["status"]
+        matrix[recorded, candidate] += 1
+        if recorded != candidate and recorded != UNKNOWN:
+            flips.append({
+                "session_id": archive.get("session_id"),
+                "recorded": recorded,
+                "candidate": candidate,
+                "rule": decision["rule"],
+            })
+    return matrix, skipped, flips
+
+
+def _chunks(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _throttled(items: Iterable, slots: threading.Semaphore) -> Iterator:
+    # Pool.imap drains its input eagerly; block the feeder until results are consumed
+    for item in items:
+        slots.acquire()
+        yield item
+
+
+def run_backtest(policy_path: str, archives: str, workers: int, chunk_size: int = CHUNK_SIZE,
+                 flips_out=None) -> Dict[str, Any]:
+    matrix, skipped = Counter(), Counter()
+    flipped = 0
+    chunks = _chunks(iter_archives(archives), chunk_size)
+
+    def merge(result):
+        nonlocal flipped
+        chunk_matrix, chunk_skipped, flips = result
+        matrix.update(chunk_matrix)
+        skipped.update(chunk_skipped)
+        flipped += len(flips)
+        if flips_out:
+            for flip in flips:
+                flips_out.write(json.dumps(flip) + "\n")
+
+    start = time.perf_counter()
+    if workers <= 1:
+        _init_worker(policy_path)
+        for chunk in chunks:
+            merge(backtest_chunk(chunk))
+    else:
+        slots = threading.Semaphore(workers * CHUNKS_IN_FLIGHT_PER_WORKER)
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(policy_path,)) as pool:
+            for result in pool.imap_unordered(backtest_chunk, _throttled(chunks, slots)):
+                slots.release()
+                merge(result)
+    elapsed = time.perf_counter() - start
+
+    evaluated = sum(matrix.values())
+    return {
+        "policy": load_policy(policy_path).version,
+        "evaluated": evaluated,
+        "flipped": flipped,
+        "skipped": dict(skipped),
+        "matrix": {recorded: {candidate: matrix[recorded, candidate] for candidate in OUTCOMES}
+                   for recorded in OUTCOMES + (UNKNOWN,)},
+        "seconds": round(elapsed, 2),
+        "archives_per_sec": round((evaluated + sum(skipped.values())) / elapsed) if elapsed else 0,
+    }
+
+
+def print_report(summary: Dict[str, Any]):
+    print(f"Candidate policy {summary['policy']}: {summary['evaluated']:,} applications "
+          f"in {summary['seconds']}s ({summary['archives_per_sec']:,} archives/s)")
+    for reason, count in sorted(summary["skipped"].items()):
+        print(f"  skipped {reason}: {count:,}")
+
+    header = "recorded \\ candidate"
+    print(f"\n{header:<22}" + "".join(f"{outcome:>17}" for outcome in OUTCOMES))
+    for recorded, row in summary["matrix"].items():
+        if recorded == UNKNOWN and not any(row.values()):
+            continue
+        print(f"{recorded:<22}" + "".join(f"{row[outcome]:>17,}" for outcome in OUTCOMES))
+
+    decided = summary["evaluated"] - sum(summary["matrix"][UNKNOWN].values())
+    share = summary["flipped"] / decided if decided else 0
+    print(f"\n{summary['flipped']:,} of {decided:,} recorded decisions would flip ({share:.1%})")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Backtest an underwriting policy against archived sessions")
+    parser.add_argument("policy", help="candidate policy JSON file")
+    parser.add_argument("--archives", default="session_archives", help="archive directory (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="archives per task (default: %(default)s)")
+    parser.add_argument("--flips", help="write every flipped decision to this JSON lines file")
+    parser.add_argument("--json", dest="json_out", help="also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    # Fail on a broken candidate before starting any workers
+    load_policy(args.policy)
+
+    flips_out = open(args.flips, "w") if args.flips else None
+    try:
+        summary = run_backtest(args.policy, args.archives, args.workers, args.chunk_size, flips_out)
+    finally:
+        if flips_out:
+            flips_out.close()
+
+    print_report(summary)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
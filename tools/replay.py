@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Deterministic conversation replay: the agent layer's CPU reference.
+
+    python -m tools.replay                                   # synthetic corpus, check tools/replay_golden.jsonl
+    python -m tools.replay --sessions 2000 --concurrency 256 --processes 4 --no-golden
+    python -m tools.replay --archives session_archives --golden archived_golden.jsonl --update-golden
+    python -m tools.replay --coverage                        # also list the conversation transitions taken
+
+Feeds recorded conversations (the ``conversation_history`` of session
+archives, or a synthetic corpus) straight into ``MasterAgent.process_message``
+with no WebSocket in between. Every session gets its own seeded random
+generator for OTPs, bureau jitter and approval IDs, and a fixed clock, so the
+same corpus and seed always produce the same replies however the sessions
+interleave. Replies are checked against golden transcripts (stored as a
+digest per turn) and the run reports turns per second of CPU time.
+"""
+import argparse
+import asyncio
+import collections
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_GOLDEN = os.path.join(REPO_ROOT, "tools", "replay_golden.jsonl")
+
+sys.path.insert(0, REPO_ROOT)
+
+from agents.master_agent import TRANSITIONS, MasterAgent  # noqa: E402
+from agents.pricing import get_rate_card_store  # noqa: E402
+from agents.session_state import SessionState  # noqa: E402
+from mock_services.crm_api import CRMService  # noqa: E402
+from mock_services.credit_bureau import CreditBureauService  # noqa: E402
+from utils.document_cache import get_document_cache  # noqa: E402
+from utils.session_manager import OTP_REDACTED  # noqa: E402
+
+OTP_PLACEHOLDER = "{otp}"
+REPLAY_CLOCK = datetime(2024, 1, 15, 10, 30)
+# Signed with the deployment's secret and wall-clock expiry, not produced by the agents
+VOLATILE_METADATA = ("download_url",)
+
+crm_service = CRMService()
+
+
+# Corpora: iterables of {"session_id": ..., "turns": [user message, ...]}
+
+def synthetic_corpus(count: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """Loan conversations across every demo customer, amount band and a few detours"""
+    rng = random.Random(f"corpus:{seed}")
+    phones = sorted(crm_service.customers)
+    for i in range(count):
+        turns = [rng.choice(["Hi", "Hello there", "Good morning"]),
+                 rng.choice(["My name is Rahul", "I'm Priya Patel", "Amit Kumar"])]
+        if rng.random() < 0.3:
+            turns.append(rng.choice(["What is the interest rate?", "What documents do I need?"]))
+        turns += [
+            "Yes, I need a personal loan",
+            rng.choice(["2 lakhs", "5 lakhs", "8 lakhs", "12 lakhs", "30 lakhs"]),
+            rng.choice(["1 year", "2 years", "36 months"]),
+            rng.choice(["Home renovation", "Wedding", "Medical expenses", "Travel"]),
+            rng.choice(phones),
+        ]
+        if rng.random() < 0.1:
+            turns.append("0000")  # Wrong OTP first
+        turns += [OTP_PLACEHOLDER, "Yes, correct"]
+        yield {"session_id": f"synthetic-{seed}-{i:06d}", "turns": turns}
+
+
+def archived_corpus(directory: str) -> Iterator[Dict[str, Any]]:
+    """User turns from session archives; the OTP the user typed becomes a placeholder.
+
+    Archives store it redacted; older ones kept the code shown in the bot's metadata.
+    """
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            archive = json.load(f)
+        turns, otp = [], None
+        for message in archive.get("conversation_history", []):
+            if message.get("sender") == "bot":
+                otp = (message.get("metadata") or {}).get("otp") or otp
+            elif message.get("sender") == "user":
+                content = message.get("content", "")
+                is_otp = content == OTP_REDACTED or (otp and content.strip() == otp)
+                turns.append(OTP_PLACEHOLDER if is_otp else content)
+        if turns:
+            yield {"session_id": archive["session_id"], "turns": turns}
+
+
+# Replay
+
+def _turn_record(user_message: Optional[str], response) -> Dict[str, Any]:
+    if not isinstance(response, dict):
+        response = {"content": response}
+    metadata = {k: v for k, v in (response.get("metadata") or {}).items() if k not in VOLATILE_METADATA}
+    return {"user": user_message, "content": response.get("content"),
+            "suggestions": response.get("suggestions", []), "metadata": metadata}
+
+
+def turn_digest(record: Dict[str, Any]) -> str:
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+async def replay_session(session: Dict[str, Any], seed: int) -> List[Dict[str, Any]]:
+    """Run one conversation through a fresh MasterAgent and return its transcript"""
+    session_id = session["session_id"]
+    rng = random.Random(f"{seed}:{session_id}")
+    # Agents are shared across sessions in the app; here each gets its own so its rng is reproducible
+    agent = MasterAgent(crm_service, CreditBureauService(rng=rng, rate_card=get_rate_card_store().current), None,
+                        rng=rng, clock=lambda: REPLAY_CLOCK)
+    state = SessionState(session_id)
+
+    transcript = [_turn_record(None, await agent.start_conversation(state))]
+    otp = ""
+    for message in session["turns"]:
+        if message == OTP_PLACEHOLDER:
+            message = otp
+        record = _turn_record(message, await agent.process_message(state, message))
+        # The demo shows the OTP it "sent"; the store only keeps its hash
+        otp = record["metadata"].get("otp", otp)
+        transcript.append(record)
+    return transcript
+
+
+async def replay_corpus(sessions: Iterable[Dict[str, Any]], seed: int, concurrency: int,
+                        golden: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+    """Replay sessions with at most ``concurrency`` in flight; compare to golden digests"""
+    sessions = iter(sessions)
+    results = {"sessions": 0, "turns": 0, "mismatches": [], "digests": {}}
+
+    async def worker():
+        for session in sessions:
+            transcript = await replay_session(session, seed)
+            digests = [turn_digest(record) for record in transcript]
+            results["sessions"] += 1
+            results["turns"] += len(transcript) - 1  # The welcome message is not a turn
+            results["digests"][session["session_id"]] = digests
+
+            expected = golden.get(session["session_id"]) if golden is not None else None
+            if expected is not None and expected != digests:
+                turn = next((i for i, (a, b) in enumerate(itertools.zip_longest(expected, digests)) if a != b))
+                actual = transcript[turn] if turn < len(transcript) else None
+                results["mismatches"].append({"session_id": session["session_id"], "turn": turn,
+                                              "actual": actual})
+            elif golden is not None and expected is None:
+                results["mismatches"].append({"session_id": session["session_id"], "turn": None,
+                                              "actual": "no golden transcript"})
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    # Sanction letters are persisted in the background; don't leave tasks pending
+    await get_document_cache().flush()
+    return results
+
+
+def _replay_shard(args) -> Dict[str, Any]:
+    corpus, shard, shards, seed, concurrency, golden = args
+    sessions = itertools.islice(corpus, shard, None, shards)
+    start_cpu = time.process_time()
+    results = asyncio.run(replay_corpus(sessions, seed, concurrency, golden))
+    results["cpu_seconds"] = time.process_time() - start_cpu
+    results["edges"] = TRANSITIONS.edges
+    return results
+
+
+def run_replay(corpus: List[Dict[str, Any]], seed: int, concurrency: int, processes: int,
+               golden: Optional[Dict[str, List[str]]]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    shards = [(corpus, i, processes, seed, concurrency, golden) for i in range(processes)]
+    if processes <= 1:
+        parts = [_replay_shard(shards[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.map(_replay_shard, shards)
+    wall = time.perf_counter() - start
+
+    summary = {"sessions": 0, "turns": 0, "cpu_seconds": 0.0, "mismatches": [], "digests": {},
+               "edges": collections.Counter()}
+    for part in parts:
+        for key in ("sessions", "turns", "cpu_seconds", "edges"):
+            summary[key] += part[key]
+        summary["mismatches"] += part["mismatches"]
+        summary["digests"].update(part["digests"])
+    summary["wall_seconds"] = wall
+    summary["turns_per_sec"] = summary["turns"] / wall if wall else 0
+    summary["turns_per_cpu_sec"] = summary["turns"] / summary["cpu_seconds"] if summary["cpu_seconds"] else 0
+    return summary
+
+
+def load_golden(path: str) -> Dict[str, List[str]]:
+    golden = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                golden[entry["session_id"]] = entry["turns"]
+    return golden
+
+
+def save_golden(path: str, digests: Dict[str, List[str]]):
+    with open(path, "w") as f:
+        for session_id in sorted(digests):
+            f.write(json.dumps({"session_id": session_id, "turns": digests[session_id]}) + "\n")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay conversations through MasterAgent in-process")
+    parser.add_argument("--archives", help="replay session archives from this directory instead of the synthetic corpus")
+    parser.add_argument("--sessions", type=int, default=200, help="synthetic sessions (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the corpus and every session (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=64, help="sessions in flight per process (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=1, help="replay processes (default: %(default)s)")
+    parser.add_argument("--golden", default=DEFAULT_GOLDEN, help="golden transcript digests (default: %(default)s)")
+    parser.add_argument("--no-golden", action="store_true", help="only measure throughput")
+    parser.add_argument("--update-golden", action="store_true", help="store this run's transcripts as golden")
+    parser.add_argument("--coverage", action="store_true", help="report which conversation transitions were taken")
+    args = parser.parse_args(argv)
+
+    corpus = list(archived_corpus(os.path.abspath(args.archives)) if args.archives
+                  else synthetic_corpus(args.sessions, args.seed))
+    golden_path = os.path.abspath(args.golden)
+    golden = None if args.no_golden or args.update_golden else load_golden(golden_path)
+
+    # Sanction letters are written relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="replay_"))
+    summary = run_replay(corpus, args.seed, args.concurrency, args.processes, golden)
+
+    print(f"Replayed {summary['sessions']:,} sessions, {summary['turns']:,} turns "
+          f"in {summary['wall_seconds']:.2f}s with {args.processes} process(es)")
+    print(f"  {summary['turns_per_sec']:,.0f} turns/s wall, "
+          f"{summary['turns_per_cpu_sec']:,.0f} turns/s per core")
+    if args.coverage:
+        print("\n" + TRANSITIONS.format_coverage(summary["edges"]))
+
+    if args.update_golden:
+        save_golden(golden_path, summary["digests"])
+        print(f"\nGolden transcripts written to {golden_path}")
+        return 0
+
+    if summary["mismatches"]:
+        print(f"\n{len(summary['mismatches'])} session(s) differ from the golden transcripts")
+        for mismatch in summary["mismatches"][:5]:
+            print(f"  {mismatch['session_id']} turn {mismatch['turn']}: "
+                  f"{json.dumps(mismatch['actual'], ensure_ascii=False)[:300]}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+"""
+Authentication for the ``/admin`` API.
+
+The admin routes search archived conversations (names, phone numbers,
+approval IDs) and expose policy, pricing and funnel internals, so every
+request must carry ``Authorization: Bearer <ADMIN_API_TOKEN>``. Without
+ADMIN_API_TOKEN set the admin API is disabled and refuses every request.
+"""
+import hmac
+import os
+
+from fastapi import HTTPException, Request
+
+
+def require_admin(request: Request):
+    """FastAPI dependency: the request carries the admin token"""
+    expected = os.getenv("ADMIN_API_TOKEN", "")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin API is disabled; set ADMIN_API_TOKEN to enable it")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
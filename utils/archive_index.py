@@ -0,0 +1,576 @@
+"""
+Full-text index over archived conversations, for support lookups.
+
+    get_archive_index().search('phone:98765* "wrong details"')
+
+Every archived session is added to the index as it is written
+(``session.archive`` job). A document's terms are:
+
+- the words of the user's messages, and each pair of adjacent words so
+  quoted phrases can be matched without positions
+- the applicant's name, phone, customer ID and approval ID, both as plain
+  words and as ``name:``, ``phone:`` and ``id:`` terms, plus ``session:``,
+  ``state:`` (the final conversation state), ``decision:`` and ``reason:``
+
+Queries are whitespace-separated clauses that must all match: a word, a
+``field:value`` term or a "quoted phrase". A trailing ``*`` matches by prefix,
+e.g. ``98765*`` or ``id:TC2024*``.
+
+Added sessions are buffered in memory and written out as an immutable segment
+every ARCHIVE_INDEX_FLUSH_DOCS sessions or ARCHIVE_INDEX_FLUSH_SECONDS, so
+other workers can search a session within that delay. A segment file
+(ARCHIVE_INDEX_DIR/*.seg) holds:
+
+- postings: per term, the sorted local doc ids as deltas, stored as an array
+  of the narrowest integer type that fits, and zlib-compressed when that is
+  smaller
+- stored fields: one JSON object per session, enough to show a result
+- the term dictionary: sorted terms in blocks of TERM_BLOCK, with a sparse
+  index of each block's first term, so a lookup or prefix scan decodes only
+  the blocks it needs
+- offset tables, read in place
+
+Segments are opened with mmap and only the sparse term index is loaded into
+memory. Once MERGE_FACTOR segments of the same size tier exist, a background
+thread merges them into one. A lock file keeps workers sharing the directory
+from merging the same segments. Queries therefore touch a logarithmic number
+of segments. While a merge removes its inputs, a session can be found in both
+the merged segment and an input; it is returned once but counted twice.
+"""
+import bisect
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = "archive_index"
+
+MAGIC = b"TCAIX001"
+FOOTER = struct.Struct("<10Q")
+TERM_BLOCK = 128
+MERGE_FACTOR = 8
+MAX_PREFIX_TERMS = 4096  # A prefix matching more terms than this is cut off there
+MERGE_LOCK_STALE_SECONDS = 600
+
+# Fields matched on their whole value rather than word by word
+KEYWORD_FIELDS = ("session", "state", "decision", "reason")
+
+_WORD = re.compile(r"[a-z0-9]+")
+_CLAUSE = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+# Postings are stored little-endian in the narrowest of these that fits the largest delta
+_TYPECODES = ("B", "H", "I", "Q")
+_TYPE_LIMITS = (1 << 8, 1 << 16, 1 << 32, 1 << 64)
+_COMPRESSED = 0x10
+_SWAP = sys.byteorder != "little"
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _field_term(field: str, value: Any) -> str:
+    return f"{field}:{''.join(str(value).lower().split())}"
+
+
+def archive_document(archive: Dict[str, Any]) -> Tuple[Dict[str, Any], Set[str]]:
+    """The fields a search result shows, and the terms a session is found by"""
+    context = archive.get("user_context") or {}
+    decision = context.get("underwriting_decision") or {}
+    history = archive.get("conversation_history") or []
+    approval_id = next((message["metadata"]["approval_id"] for message in reversed(history)
+                        if (message.get("metadata") or {}).get("approval_id")), None)
+    stored = {
+        "session_id": archive["session_id"],
+        "ended_at": archive.get("ended_at"),
+        "final_state": archive.get("final_state"),
+        "name": context.get("name"),
+        "phone": context.get("phone"),
+        "approval_id": approval_id,
+        "decision": decision.get("status"),
+        "reason": decision.get("reason"),
+    }
+
+    terms = {_field_term("session", stored["session_id"])}
+    for field, value in (("state", stored["final_state"]), ("decision", stored["decision"]),
+                         ("reason", stored["reason"])):
+        if value:
+            terms.add(_field_term(field, value))
+    for field, value in (("name", stored["name"]), ("phone", stored["phone"]),
+                         ("id", context.get("customer_id")), ("id", approval_id)):
+        if value:
+            for word in _words(str(value)):
+                terms.add(word)
+                terms.add(f"{field}:{word}")
+    for message in history:
+        if message.get("sender") == "user":
+            words = _words(message.get("content") or "")
+            terms.update(words)
+            terms.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return stored, terms
+
+
+def parse_query(query: str) -> List[Tuple[str, bool]]:
+    """(term, is prefix) clauses that must all match"""
+    clauses = []
+    for match in _CLAUSE.finditer(query):
+        phrase, phrase_prefix, token = match.groups()
+        if phrase is not None:
+            words, prefix = _words(phrase), bool(phrase_prefix)
+            if len(words) == 1:
+                clauses.append((words[0], prefix))
+            else:
+                pairs = [f"{a} {b}" for a, b in zip(words, words[1:])]
+                clauses += [(pair, prefix and i == len(pairs) - 1) for i, pair in enumerate(pairs)]
+            continue
+        prefix = token.endswith("*")
+        token = token.rstrip("*")
+        field, _, value = token.partition(":")
+        if value and field.isalpha():
+            field = field.lower()
+            if field in KEYWORD_FIELDS:
+                clauses.append((_field_term(field, value), prefix))
+            else:
+                words = _words(value)
+                clauses += [(f"{field}:{word}", prefix and i == len(words) - 1)
+                            for i, word in enumerate(words)]
+        else:
+            words = _words(token)
+            clauses += [(word, prefix and i == len(words) - 1) for i, word in enumerate(words)]
+    return clauses
+
+
+def encode_postings(doc_ids: List[int]) -> bytes:
+    deltas = [doc_ids[0]] + [b - a for a, b in zip(doc_ids, doc_ids[1:])]
+    widest = max(deltas)
+    kind = next(i for i, limit in enumerate(_TYPE_LIMITS) if widest < limit)
+    packed = array(_TYPECODES[kind], deltas)
+    if _SWAP:
+        packed.byteswap()
+    payload = packed.tobytes()
+    if len(payload) > 64:
+        compressed = zlib.compress(payload, 6)
+        if len(compressed) < len(payload):
+            return bytes([kind | _COMPRESSED]) + compressed
+    return bytes([kind]) + payload
+
+
+def decode_postings(data: bytes) -> List[int]:
+    flags = data[0]
+    payload = zlib.decompress(data[1:]) if flags & _COMPRESSED else data[1:]
+    deltas = array(_TYPECODES[flags & 0x0F])
+    deltas.frombytes(payload)
+    if _SWAP:
+        deltas.byteswap()
+    return list(itertools.accumulate(deltas))
+
+
+def _table(values: array) -> bytes:
+    if _SWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class SegmentWriter:
+    """Writes a segment: terms in sorted order, then the stored documents"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp = f"{path}.tmp"
+        self._file = open(self._tmp, "wb")
+        self._file.write(MAGIC)
+        self._position = len(MAGIC)
+        self._term_offsets = array("Q")
+        self._term_df = array("I")
+        self._blocks = bytearray()
+        self._block_offsets = array("Q", [0])
+        self._first_terms: List[str] = []
+        self._block: List[str] = []
+        self._docs = bytearray()
+        self._doc_offsets = array("Q", [0])
+
+    def add_term(self, term: str, doc_ids: List[int]):
+        data = encode_postings(doc_ids)
+        self._term_offsets.append(self._position)
+        self._term_df.append(len(doc_ids))
+        self._file.write(data)
+        self._position += len(data)
+        if not self._block:
+            self._first_terms.append(term)
+        self._block.append(term)
+        if len(self._block) == TERM_BLOCK:
+            self._close_block()
+
+    def _close_block(self):
+        self._blocks += "\n".join(self._block).encode()
+        self._block_offsets.append(len(self._blocks))
+        self._block = []
+
+    def add_document(self, data: bytes):
+        self._docs += data
+        self._doc_offsets.append(len(self._docs))
+
+    def finish(self) -> str:
+        if self._block:
+            self._close_block()
+        self._term_offsets.append(self._position)  # End of the last posting list
+        sections = [bytes(self._docs), _table(self._doc_offsets), bytes(self._blocks),
+                    _table(self._block_offsets), "\n".join(self._first_terms).encode(),
+                    _table(self._term_offsets), _table(self._term_df)]
+        offsets = []
+        for section in sections:
+            offsets.append(self._position)
+            self._file.write(section)
+            self._position += len(section)
+        self._file.write(FOOTER.pack(len(self._doc_offsets) - 1, len(self._term_df),
+                                     len(self._first_terms), *offsets))
+        self._file.write(MAGIC)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        # Readers only ever see complete segments
+        os.replace(self._tmp, self.path)
+        return self.path
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+class Segment:
+    """A segment file, read in place through mmap"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = len(self._map) - len(MAGIC)
+        if self._map[:len(MAGIC)] != MAGIC or self._map[end:] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not an archive index segment")
+        (self.doc_count, self.term_count, self._block_count, self._docs, self._doc_offsets, self._blocks,
+         self._block_offsets, first_terms, self._term_offsets, self._term_df) = \
+            FOOTER.unpack_from(self._map, end - FOOTER.size)
+        self._first_terms = self._map[first_terms:self._term_offsets].decode().split("\n") \
+            if self._block_count else []
+
+    def _offset(self, table: int, i: int) -> int:
+        return struct.unpack_from("<Q", self._map, table + 8 * i)[0]
+
+    def _block(self, b: int) -> List[str]:
+        start = self._blocks + self._offset(self._block_offsets, b)
+        end = self._blocks + self._offset(self._block_offsets, b + 1)
+        return self._map[start:end].decode().split("\n")
+
+    def lookup(self, term: str) -> Optional[int]:
+        """Ordinal of ``term``, if the segment has it"""
+        b = bisect.bisect_right(self._first_terms, term) - 1
+        if b < 0:
+            return None
+        block = self._block(b)
+        i = bisect.bisect_left(block, term)
+        return b * TERM_BLOCK + i if i < len(block) and block[i] == term else None
+
+    def prefixed(self, prefix: str) -> Iterator[int]:
+        """Ordinals of the terms starting with ``prefix``, in term order"""
+        b = max(bisect.bisect_right(self._first_terms, prefix) - 1, 0)
+        while b < self._block_count:
+            block = self._block(b)
+            for i in range(bisect.bisect_left(block, prefix), len(block)):
+                if not block[i].startswith(prefix):
+                    return
+                yield b * TERM_BLOCK + i
+            b += 1
+
+    def terms(self) -> Iterator[Tuple[str, int]]:
+        for b in range(self._block_count):
+            for i, term in enumerate(self._block(b)):
+                yield term, b * TERM_BLOCK + i
+
+    def df(self, ordinal: int) -> int:
+        return struct.unpack_from("<I", self._map, self._term_df + 4 * ordinal)[0]
+
+    def postings(self, ordinal: int) -> List[int]:
+        start, end = struct.unpack_from("<QQ", self._map, self._term_offsets + 8 * ordinal)
+        return decode_postings(self._map[start:end])
+
+    def document_bytes(self, doc_id: int) -> bytes:
+        start, end = struct.unpack_from("<QQ", self._map, self._doc_offsets + 8 * doc_id)
+        return self._map[self._docs + start:self._docs + end]
+
+    def document(self, doc_id: int) -> Dict[str, Any]:
+        return json.loads(self.document_bytes(doc_id))
+
+    def match(self, clauses: List[Tuple[str, bool]]) -> List[int]:
+        """Doc ids matching every clause"""
+        exact, prefixes = [], []
+        for term, prefix in clauses:
+            if prefix:
+                prefixes.append(term)
+                continue
+            ordinal = self.lookup(term)
+            if ordinal is None:
+                return []
+            exact.append(ordinal)
+        # Start from the rarest term so the candidate set is small from the outset
+        exact.sort(key=self.df)
+        matched: Optional[Set[int]] = None
+        for ordinal in exact:
+            ids = self.postings(ordinal)
+            matched = set(ids) if matched is None else matched.intersection(ids)
+            if not matched:
+                return []
+        for prefix in prefixes:
+            ids = set()
+            for ordinal in itertools.islice(self.prefixed(prefix), MAX_PREFIX_TERMS):
+                ids.update(self.postings(ordinal))
+            matched = ids if matched is None else matched & ids
+            if not matched:
+                return []
+        return sorted(matched or ())
+
+
+def _segment_name() -> str:
+    return f"{time.time_ns():020d}-{os.getpid()}.seg"
+
+
+def write_segment(directory: str, documents: List[Dict[str, Any]], postings: Dict[str, List[int]]) -> str:
+    writer = SegmentWriter(os.path.join(directory, _segment_name()))
+    try:
+        for term in sorted(postings):
+            writer.add_term(term, postings[term])
+        for document in documents:
+            writer.add_document(json.dumps(document, separators=(",", ":")).encode())
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def _tagged_terms(i: int, segment: Segment) -> Iterator[Tuple[str, int, int]]:
+    for term, ordinal in segment.terms():
+        yield term, i, ordinal
+
+
+def merge_segments(directory: str, segments: List[Segment]) -> str:
+    """One segment holding every document and term of ``segments``, in their order"""
+    bases = list(itertools.accumulate([0] + [segment.doc_count for segment in segments]))
+    writer = SegmentWriter(os.path.join(directory, _segment_name()))
+    try:
+        streams = [_tagged_terms(i, segment) for i, segment in enumerate(segments)]
+        for term, entries in itertools.groupby(heapq.merge(*streams), key=itemgetter(0)):
+            doc_ids = []
+            for _, i, ordinal in entries:
+                base = bases[i]
+                doc_ids += [doc_id + base for doc_id in segments[i].postings(ordinal)] if base \
+                    else segments[i].postings(ordinal)
+            writer.add_term(term, doc_ids)
+        for segment in segments:
+            for doc_id in range(segment.doc_count):
+                writer.add_document(segment.document_bytes(doc_id))
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def _tier(doc_count: int) -> int:
+    tier = 0
+    while doc_count >= MERGE_FACTOR:
+        doc_count //= MERGE_FACTOR
+        tier += 1
+    return tier
+
+
+class ArchiveIndex:
+    def __init__(self, directory: str = DEFAULT_INDEX_DIR, flush_docs: int = 1000, flush_seconds: float = 30.0):
+        self.directory = directory
+        self.flush_docs = flush_docs
+        self.flush_seconds = flush_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Sessions added since the last flush, searchable in this process only
+        self._documents: List[Dict[str, Any]] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._buffered_since = 0.0
+        self._segments: Dict[str, Segment] = {}
+        self._merger: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "ArchiveIndex":
+        return cls(
+            os.getenv("ARCHIVE_INDEX_DIR", DEFAULT_INDEX_DIR),
+            int(os.getenv("ARCHIVE_INDEX_FLUSH_DOCS", "1000")),
+            float(os.getenv("ARCHIVE_INDEX_FLUSH_SECONDS", "30")),
+        )
+
+    def add(self, archive: Dict[str, Any]):
+        stored, terms = archive_document(archive)
+        with self._lock:
+            doc_id = len(self._documents)
+            if not doc_id:
+                self._buffered_since = time.monotonic()
+            self._documents.append(stored)
+            postings = self._postings
+            for term in terms:
+                postings.setdefault(term, []).append(doc_id)
+        self._flush_if_due()
+
+    def _flush_if_due(self):
+        if self._documents and (len(self._documents) >= self.flush_docs
+                                or time.monotonic() - self._buffered_since >= self.flush_seconds):
+            self.flush()
+
+    def flush(self) -> Optional[str]:
+        """Write the buffered sessions out as a segment; merges run in the background when due"""
+        with self._lock:
+            documents, postings = self._documents, self._postings
+            if not documents:
+                return None
+            path = write_segment(self.directory, documents, postings)
+            self._documents, self._postings = [], {}
+        self._start_merge()
+        return path
+
+    def segments(self) -> List[Segment]:
+        """Open segments in creation order, picking up those written or removed by any worker"""
+        with self._lock:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+            for name in set(self._segments) - set(names):
+                # Unmapped once no search still holds it
+                del self._segments[name]
+            for name in names:
+                if name not in self._segments:
+                    try:
+                        self._segments[name] = Segment(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        continue  # Merged away since the listing
+            return [self._segments[name] for name in names if name in self._segments]
+
+    def search(self, query: str, limit: int = 20) -> Dict[str, Any]:
+        """Sessions matching every clause of ``query``, most recently ended first.
+
+        Only the last ``limit`` matches of each segment are read, as documents
+        are stored in the order they were archived. ``total`` counts every match.
+        """
+        start = time.perf_counter()
+        self._flush_if_due()
+        clauses = parse_query(query)
+        found: Dict[str, Dict[str, Any]] = {}
+        total = 0
+        if clauses:
+            for segment in self.segments():
+                doc_ids = segment.match(clauses)
+                total += len(doc_ids)
+                for doc_id in doc_ids[-limit:]:
+                    document = segment.document(doc_id)
+                    found[document["session_id"]] = document
+            buffered = self._match_buffered(clauses)
+            total += len(buffered)
+            for document in buffered[-limit:]:
+                found[document["session_id"]] = document
+        results = sorted(found.values(), key=lambda document: document.get("ended_at") or "", reverse=True)
+        return {"query": query, "total": total, "results": results[:limit],
+                "took_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    def _match_buffered(self, clauses: List[Tuple[str, bool]]) -> List[Dict[str, Any]]:
+        with self._lock:
+            matched: Optional[Set[int]] = None
+            for term, prefix in clauses:
+                if prefix:
+                    ids = {doc_id for candidate, doc_ids in self._postings.items()
+                           if candidate.startswith(term) for doc_id in doc_ids}
+                else:
+                    ids = set(self._postings.get(term, ()))
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    return []
+            return [self._documents[doc_id] for doc_id in sorted(matched)]
+
+    def _merge_candidates(self) -> List[Segment]:
+        tiers: Dict[int, List[Segment]] = {}
+        for segment in self.segments():
+            tiers.setdefault(_tier(segment.doc_count), []).append(segment)
+        full = [tier for tier, segments in tiers.items() if len(segments) >= MERGE_FACTOR]
+        return tiers[min(full)][:MERGE_FACTOR] if full else []
+
+    def _start_merge(self):
+        with self._lock:
+            if self._merger is not None and self._merger.is_alive():
+                return
+            self._merger = threading.Thread(target=self.merge, name="archive-index-merge", daemon=True)
+            self._merger.start()
+
+    def merge(self) -> int:
+        """Merge full size tiers until none is left; returns the segments merged away"""
+        merged = 0
+        lock_path = os.path.join(self.directory, "merge.lock")
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > MERGE_LOCK_STALE_SECONDS:
+                    os.remove(lock_path)  # Left by a worker that died mid-merge; the next flush retries
+            except OSError:
+                pass
+            return 0
+        try:
+            while True:
+                segments = self._merge_candidates()
+                if not segments:
+                    return merged
+                os.utime(lock_path)  # Still merging; not stale
+                merge_segments(self.directory, segments)
+                for segment in segments:
+                    os.remove(segment.path)
+                merged += len(segments)
+        except Exception:
+            logger.exception("Merging archive index segments in %s failed", self.directory)
+            return merged
+        finally:
+            os.close(fd)
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    def close(self):
+        """Write out buffered sessions and wait for a running merge"""
+        self.flush()
+        merger = self._merger
+        if merger is not None:
+            merger.join()
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self.segments()
+        return {"segments": len(segments), "documents": sum(segment.doc_count for segment in segments),
+                "buffered": len(self._documents),
+                "bytes": sum(os.path.getsize(segment.path) for segment in segments if os.path.exists(segment.path))}
+
+
+_archive_index: Optional[ArchiveIndex] = None
+
+
+def get_archive_index() -> ArchiveIndex:
+    """Process-wide archive index, created on first use"""
+    global _archive_index
+    if _archive_index is None:
+        _archive_index = ArchiveIndex.from_env()
+    return _archive_index
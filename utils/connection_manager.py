@@ -0,0 +1,157 @@
+"""
+Chat WebSocket connections of one worker: admission control, heartbeats and
+idle reaping.
+
+A single sweeper task per worker pings every connection each
+WS_HEARTBEAT_SECONDS and reaps the ones that went quiet:
+
+- clients that answer pings are dropped WS_PEER_TIMEOUT_SECONDS after their
+  last frame, which catches half-open sockets from mobile networks
+- every client is dropped WS_IDLE_TIMEOUT_SECONDS after its last message
+
+Reaping cancels the connection's handler, whose cleanup archives the session
+before the socket closes. New connections beyond WS_MAX_CONNECTIONS get a
+``server_busy`` frame with ``retry_after`` and are closed straight away, so a
+worker never holds more than that many agents and sessions.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import WebSocket
+
+from utils.metrics import WS_CONNECTIONS, WS_REAPED, WS_REJECTED
+
+CLOSE_GOING_AWAY = 1001
+CLOSE_SERVICE_RESTART = 1012
+CLOSE_TRY_AGAIN_LATER = 1013
+
+PING_FRAME = json.dumps({"type": "ping"})
+
+
+class Connection:
+    __slots__ = ("session_id", "websocket", "task", "last_seen", "last_message", "answers_pings",
+                 "close_code")
+
+    def __init__(self, session_id: str, websocket: WebSocket):
+        self.session_id = session_id
+        self.websocket = websocket
+        self.task = asyncio.current_task()
+        self.last_seen = self.last_message = time.monotonic()
+        self.answers_pings = False
+        self.close_code: Optional[int] = None  # Set when the server reaps the connection
+
+    def received(self, frame: Dict[str, Any]) -> bool:
+        """Record an incoming frame; False for heartbeat replies, which are not messages"""
+        self.last_seen = time.monotonic()
+        if frame.get("type") == "pong":
+            self.answers_pings = True
+            return False
+        self.last_message = self.last_seen
+        return True
+
+
+class ConnectionManager:
+    def __init__(self, max_connections: int = 1000, heartbeat_interval: float = 20.0,
+                 peer_timeout: float = 60.0, idle_timeout: float = 900.0, retry_after: int = 5):
+        self.active_connections: Dict[str, Connection] = {}
+        self.max_connections = max_connections
+        self.heartbeat_interval = heartbeat_interval
+        self.peer_timeout = peer_timeout
+        self.idle_timeout = idle_timeout
+        self.retry_after = retry_after
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "ConnectionManager":
+        return cls(
+            max_connections=int(os.getenv("WS_MAX_CONNECTIONS", "1000")),
+            heartbeat_interval=float(os.getenv("WS_HEARTBEAT_SECONDS", "20")),
+            peer_timeout=float(os.getenv("WS_PEER_TIMEOUT_SECONDS", "60")),
+            idle_timeout=float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "900")),
+            retry_after=int(os.getenv("WS_RETRY_AFTER_SECONDS", "5")),
+        )
+
+    async def connect(self, websocket: WebSocket, session_id: str) -> Optional[Connection]:
+        """Accept the socket; None if the worker is full and the client was told to retry"""
+        await websocket.accept()
+        existing = self.active_connections.get(session_id)
+        if existing is not None:
+            # A reconnect under the same session id: the old socket is likely half-open, and once
+            # replaced it would never be pinged or reaped again
+            self.reap(existing, "replaced")
+        if len(self.active_connections) >= self.max_connections:
+            WS_REJECTED.inc()
+            await websocket.send_text(json.dumps({
+                "type": "error", "error": "server_busy", "retry_after": self.retry_after,
+            }))
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            return None
+
+        connection = Connection(session_id, websocket)
+        self.active_connections[session_id] = connection
+        WS_CONNECTIONS.set(len(self.active_connections))
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+        return connection
+
+    def disconnect(self, connection: Connection):
+        # A reconnect under the same session id may already have replaced it
+        if self.active_connections.get(connection.session_id) is connection:
+            del self.active_connections[connection.session_id]
+            WS_CONNECTIONS.set(len(self.active_connections))
+
+    async def send_message(self, session_id: str, message: dict):
+        if session_id in self.active_connections:
+            await self.active_connections[session_id].websocket.send_text(json.dumps(message))
+
+    async def close(self, connection: Connection):
+        """Send the close frame for a reaped connection; the peer may already be gone"""
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=connection.close_code), self.heartbeat_interval)
+        except Exception:
+            pass
+
+    def reap(self, connection: Connection, reason: str, code: int = CLOSE_GOING_AWAY):
+        """Free the slot now and cancel the handler so it persists the session and closes"""
+        if connection.close_code is not None:
+            return
+        connection.close_code = code
+        WS_REAPED.labels(reason).inc()
+        self.disconnect(connection)
+        if connection.task is not None:
+            connection.task.cancel()
+
+    async def _ping(self, connection: Connection):
+        try:
+            await asyncio.wait_for(connection.websocket.send_text(PING_FRAME), self.heartbeat_interval)
+        except Exception:
+            self.reap(connection, "send_failed")
+
+    async def _sweep(self):
+        while self.active_connections:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            pings = []
+            for connection in list(self.active_connections.values()):
+                if now - connection.last_message > self.idle_timeout:
+                    self.reap(connection, "idle")
+                elif connection.answers_pings and now - connection.last_seen > self.peer_timeout:
+                    self.reap(connection, "unresponsive")
+                else:
+                    pings.append(self._ping(connection))
+            if pings:
+                await asyncio.gather(*pings)
+
+    async def shutdown(self):
+        """Stop heartbeats and reap every connection so its session is archived"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        handlers = [connection.task for connection in self.active_connections.values() if connection.task]
+        for connection in list(self.active_connections.values()):
+            self.reap(connection, "shutdown", CLOSE_SERVICE_RESTART)
+        if handlers:
+            await asyncio.wait(handlers, timeout=self.heartbeat_interval)
@@ -0,0 +1,137 @@
+"""
+In-memory store for generated documents.
+
+Sanction letters are rendered into memory, kept in a byte-bounded LRU keyed
+by approval ID and served straight from there; writing them to disk (or an
+object storage stand-in) happens in the background, off the approval path.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class CachedDocument:
+    __slots__ = ("filename", "data", "etag")
+
+    def __init__(self, filename: str, data: bytes):
+        self.filename = filename
+        self.data = data
+        self.etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+
+class ByteLRUCache:
+    """LRU cache bounded by the total size of its values rather than their count"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items: "OrderedDict[str, CachedDocument]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[CachedDocument]:
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def put(self, key: str, item: CachedDocument):
+        if len(item.data) > self.max_bytes:
+            return  # Would evict everything else and still not fit
+        self.pop(key)
+        self._items[key] = item
+        self.current_bytes += len(item.data)
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.current_bytes -= len(evicted.data)
+
+    def pop(self, key: str) -> Optional[CachedDocument]:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.current_bytes -= len(item.data)
+        return item
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+
+class LocalDiskStore:
+    """Persists documents under a directory; stands in for object storage"""
+
+    def __init__(self, directory: str = "generated_docs"):
+        self.directory = directory
+
+    def path_for(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def write(self, filename: str, data: bytes):
+        """Blocking write, called from a worker thread"""
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename, so readers never see a half-written letter
+        path = self.path_for(filename)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+class DocumentCache:
+    def __init__(self, store: LocalDiskStore, max_bytes: int = 64 * 1024 * 1024):
+        self.store = store
+        self.cache = ByteLRUCache(max_bytes)
+        self._pending: Set[asyncio.Task] = set()
+
+    @classmethod
+    def from_env(cls) -> "DocumentCache":
+        max_mb = int(os.getenv("DOCUMENT_CACHE_MB", "64"))
+        return cls(LocalDiskStore(os.getenv("GENERATED_DOCS_DIR", "generated_docs")), max_mb * 1024 * 1024)
+
+    def put(self, approval_id: str, filename: str, data: bytes) -> CachedDocument:
+        """Cache a rendered document and persist it in the background"""
+        document = CachedDocument(filename, data)
+        self.cache.put(approval_id, document)
+
+        task = asyncio.get_running_loop().create_task(self._persist(filename, data))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return document
+
+    def get(self, approval_id: str) -> Optional[CachedDocument]:
+        return self.cache.get(approval_id)
+
+    async def _persist(self, filename: str, data: bytes):
+        try:
+            await asyncio.to_thread(self.store.write, filename, data)
+        except OSError:
+            # Still downloadable while it stays in the cache
+            logger.exception("Failed to persist %s", filename)
+
+    async def flush(self):
+        """Wait for all background writes, e.g. before the worker exits"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self.cache),
+            "bytes": self.cache.current_bytes,
+            "max_bytes": self.cache.max_bytes,
+            "pending_writes": len(self._pending),
+        }
+
+
+_document_cache: Optional[DocumentCache] = None
+
+
+def get_document_cache() -> DocumentCache:
+    """Process-wide document cache, configured from the environment on first use"""
+    global _document_cache
+    if _document_cache is None:
+        _document_cache = DocumentCache.from_env()
+    return _document_cache
@@ -0,0 +1,187 @@
+"""
+Sanction letter download serving.
+
+Freshly generated letters are served from the in-memory document cache.
+Older ones come from disk: letters are immutable once generated (every
+approval ID is unique), so the server caches each file's size and
+content-hash ETag after the first request and answers repeat downloads with
+304s, byte ranges or an nginx X-Accel-Redirect handoff without touching the
+disk again. Download links are HMAC-signed and expire.
+"""
+import asyncio
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+
+from utils.document_cache import DocumentCache, get_document_cache
+from utils.download_tokens import DownloadTokenSigner, get_download_signer
+
+DOCS_DIR = "generated_docs"
+FILENAME_PATTERN = re.compile(r"^sanction_letter_(TC[0-9A-Z]+)\.pdf$")
+CACHE_CONTROL = "private, max-age=86400, immutable"
+
+
+class DocumentMeta:
+    __slots__ = ("path", "size", "etag", "data")
+
+    def __init__(self, path: Optional[str], size: int, etag: str, data: Optional[bytes] = None):
+        self.path = path
+        self.size = size
+        self.etag = etag
+        # Set when the document is served from memory instead of disk
+        self.data = data
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into inclusive (start, end).
+
+    Returns None when the header is malformed or unsatisfiable. Multi-range
+    requests are not worth multipart responses for a few-KB letter and are
+    rejected the same way.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # Suffix range: the final N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+class DocumentServer:
+    def __init__(self, signer: DownloadTokenSigner, documents: DocumentCache, docs_dir: str = DOCS_DIR,
+                 accel_redirect_prefix: Optional[str] = None, max_cached: int = 10000):
+        self.signer = signer
+        self.documents = documents
+        self.docs_dir = docs_dir
+        # e.g. "/protected-docs/": nginx serves the file from an internal location
+        self.accel_redirect_prefix = accel_redirect_prefix
+        self.max_cached = max_cached
+        self._meta: "OrderedDict[str, DocumentMeta]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "DocumentServer":
+        return cls(
+            signer=get_download_signer(),
+            documents=get_document_cache(),
+            docs_dir=get_document_cache().store.directory,
+            accel_redirect_prefix=os.getenv("DOCUMENT_ACCEL_REDIRECT_PREFIX") or None
+        )
+
+    def _load_meta(self, filename: str) -> Optional[DocumentMeta]:
+        """Stat and hash a document (blocking, run in a thread)"""
+        path = os.path.join(self.docs_dir, filename)
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    digest.update(chunk)
+                size = f.tell()
+        except FileNotFoundError:
+            return None
+        return DocumentMeta(path, size, f'"{digest.hexdigest()[:32]}"')
+
+    async def get_meta(self, filename: str) -> Optional[DocumentMeta]:
+        """Cached document metadata; only the first request for a file hits the disk"""
+        meta = self._meta.get(filename)
+        if meta is not None:
+            self._meta.move_to_end(filename)
+            return meta
+
+        meta = await asyncio.to_thread(self._load_meta, filename)
+        if meta is not None:
+            self._meta[filename] = meta
+            if len(self._meta) > self.max_cached:
+                self._meta.popitem(last=False)
+        return meta
+
+    def forget(self, filename: str):
+        """Drop cached metadata, e.g. after a document was deleted"""
+        self._meta.pop(filename, None)
+
+    async def serve(self, request: Request, filename: str) -> Response:
+        """Serve a generated document for GET /download/{filename}"""
+        match = FILENAME_PATTERN.match(filename)
+        if not match:
+            return JSONResponse({"error": "File not found"}, status_code=404)
+
+        params = request.query_params
+        if not self.signer.verify(filename, params.get("expires"), params.get("token")):
+            return JSONResponse({"error": "Download link is invalid or has expired"}, status_code=403)
+
+        cached = self.documents.get(match.group(1))
+        if cached is not None:
+            meta = DocumentMeta(None, len(cached.data), cached.etag, cached.data)
+        else:
+            meta = await self.get_meta(filename)
+        if meta is None:
+            return JSONResponse({"error": "File not found"}, status_code=404)
+
+        headers = {
+            "ETag": meta.etag,
+            "Cache-Control": CACHE_CONTROL,
+            "Accept-Ranges": "bytes",
+        }
+
+        # Conditional GET: the phone already has this exact letter
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and meta.etag in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+        # Let nginx stream the bytes (and handle ranges) from its internal location
+        if self.accel_redirect_prefix and meta.data is None:
+            headers["X-Accel-Redirect"] = f"{self.accel_redirect_prefix}{filename}"
+            return Response(status_code=200, headers=headers, media_type="application/pdf")
+
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (not if_range or if_range.strip() == meta.etag):
+            byte_range = parse_range(range_header, meta.size)
+            if byte_range is None:
+                headers["Content-Range"] = f"bytes */{meta.size}"
+                return Response(status_code=416, headers=headers)
+
+            start, end = byte_range
+            if meta.data is not None:
+                content = meta.data[start:end + 1]
+            else:
+                content = await asyncio.to_thread(self._read_range, meta.path, start, end)
+            headers["Content-Range"] = f"bytes {start}-{end}/{meta.size}"
+            return Response(content=content, status_code=206, headers=headers,
+                            media_type="application/pdf")
+
+        if meta.data is not None:
+            return Response(content=meta.data, headers=headers, media_type="application/pdf")
+        return FileResponse(path=meta.path, headers=headers, media_type="application/pdf")
+
+    def _read_range(self, path: str, start: int, end: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+
+_document_server: Optional[DocumentServer] = None
+
+
+def get_document_server() -> DocumentServer:
+    """Process-wide document server, configured from the environment on first use"""
+    global _document_server
+    if _document_server is None:
+        _document_server = DocumentServer.from_env()
+    return _document_server
@@ -0,0 +1,93 @@
+"""
+Signed, expiring download links for generated documents
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECRET_FILE = ".download_token_secret"
+
+
+def _shared_secret(path: str) -> str:
+    """Secret shared by every worker on this host, created by whichever starts first"""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker created it; wait out the moment between its create and write
+        for _ in range(50):
+            with open(path) as f:
+                secret = f.read().strip()
+            if secret:
+                return secret
+            time.sleep(0.01)
+        raise RuntimeError(f"download token secret file {path} is empty")
+    secret = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(secret)
+    return secret
+
+
+class DownloadTokenSigner:
+    def __init__(self, secret: bytes, ttl_seconds: int = 86400):
+        self.secret = secret
+        self.ttl_seconds = ttl_seconds
+
+    @classmethod
+    def from_env(cls) -> "DownloadTokenSigner":
+        """Build a signer from DOWNLOAD_TOKEN_SECRET (or SECRET_KEY).
+
+        Without either, the workers on this host share a random secret kept in
+        DOWNLOAD_TOKEN_SECRET_FILE, so a link issued by one verifies on the
+        others. Deployments across several hosts must set the secret.
+        """
+        secret = os.getenv("DOWNLOAD_TOKEN_SECRET") or os.getenv("SECRET_KEY")
+        if not secret:
+            path = os.getenv("DOWNLOAD_TOKEN_SECRET_FILE", DEFAULT_SECRET_FILE)
+            logger.warning("DOWNLOAD_TOKEN_SECRET is not set, using the host-wide secret in %s", path)
+            secret = _shared_secret(path)
+        return cls(secret.encode(), int(os.getenv("DOWNLOAD_TOKEN_TTL", "86400")))
+
+    def _signature(self, filename: str, expires: int) -> str:
+        message = f"{filename}:{expires}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()[:32]
+
+    def sign(self, filename: str, now: Optional[float] = None) -> Tuple[int, str]:
+        """Return (expires, token) for a download link"""
+        expires = int((now or time.time()) + self.ttl_seconds)
+        return expires, self._signature(filename, expires)
+
+    def signed_url(self, filename: str) -> str:
+        """Signed, expiring download URL for a generated document"""
+        expires, token = self.sign(filename)
+        return f"/download/{filename}?expires={expires}&token={token}"
+
+    def verify(self, filename: str, expires: Optional[str], token: Optional[str],
+               now: Optional[float] = None) -> bool:
+        """Check a link's signature and expiry in constant time"""
+        if not expires or not token or not expires.isdigit():
+            return False
+        if int(expires) < (now or time.time()):
+            return False
+        return hmac.compare_digest(self._signature(filename, int(expires)), token)
+
+
+_signer: Optional[DownloadTokenSigner] = None
+
+
+def get_download_signer() -> DownloadTokenSigner:
+    """Process-wide signer, configured from the environment on first use"""
+    global _signer
+    if _signer is None:
+        _signer = DownloadTokenSigner.from_env()
+    return _signer
+
+
+def signed_download_url(filename: str) -> str:
+    """Signed download link for a generated document"""
+    return get_download_signer().signed_url(filename)
@@ -0,0 +1,281 @@
+"""
+Chat over plain HTTP for networks that block WebSockets.
+
+The client reads the session's frames from a Server-Sent Events stream
+(``GET /chat/{session_id}/events``) and POSTs its turns; where a proxy
+buffers SSE it can long-poll the same frames instead
+(``GET /chat/{session_id}/poll?after=<id>``). Frames are the JSON objects the
+WebSocket sends, numbered per session, and the last ``SSE_BUFFER_FRAMES`` are
+kept so a client that reconnects with ``Last-Event-ID`` gets what it missed.
+
+Publishing a frame writes it straight to the session's open streams, so a
+turn's reply leaves with the turn instead of waking another task to send it.
+An idle stream carries a comment line every SSE_HEARTBEAT_SECONDS so proxies
+keep the connection open.
+Like WebSocket connections, a session is reaped SSE_IDLE_TIMEOUT_SECONDS after
+its last turn, or SSE_PEER_TIMEOUT_SECONDS after its last stream or poll went
+away, and a worker holds at most SSE_MAX_SESSIONS of them.
+"""
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from starlette.responses import Response
+
+from utils.metrics import HTTP_CHAT_REAPED, HTTP_CHAT_REJECTED, HTTP_CHAT_SESSIONS
+
+logger = logging.getLogger(__name__)
+
+# Tells EventSource how long to wait before reconnecting, in milliseconds
+RETRY_FRAME = b"retry: 3000\n\n"
+HEARTBEAT_FRAME = b": ping\n\n"
+
+
+class EventWriter:
+    """One open SSE stream of a channel, written to by whoever publishes a frame"""
+    __slots__ = ("send", "last_id", "lock", "written", "done")
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]], last_id: int):
+        self.send = send
+        self.last_id = last_id
+        self.lock = asyncio.Lock()  # One write at a time; frames go out in order
+        self.written = False  # Anything sent since the last heartbeat check
+        self.done = asyncio.get_running_loop().create_future()  # Set when the client left or the channel closed
+
+    async def write(self, chunk: bytes):
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": True})
+        self.written = True
+
+    async def catch_up(self, channel: "EventChannel"):
+        """Write every buffered frame this stream hasn't had yet, as one chunk"""
+        async with self.lock:
+            frames = channel.since(self.last_id)
+            if frames and not self.done.done():
+                self.last_id = frames[-1][0]
+                await self.write(b"".join(event for _, event in frames))
+
+    def finish(self):
+        if not self.done.done():
+            self.done.set_result(None)
+
+
+class EventChannel:
+    __slots__ = ("session_id", "frames", "last_id", "lock", "streams", "writers", "last_seen", "last_message",
+                 "closed", "_published")
+
+    def __init__(self, session_id: str, buffer_size: int):
+        self.session_id = session_id
+        # (id, SSE event): encoded once, when published
+        self.frames: Deque[Tuple[int, bytes]] = collections.deque(maxlen=buffer_size)
+        self.last_id = 0
+        self.lock = asyncio.Lock()  # One turn at a time, as over a WebSocket
+        self.streams = 0  # Open SSE streams and pending polls
+        self.writers: List[EventWriter] = []  # The open SSE streams
+        self.last_seen = self.last_message = time.monotonic()
+        self.closed = False
+        self._published: Optional[asyncio.Event] = None  # Created by the first poll waiting
+
+    def received(self):
+        """Record a turn from the client"""
+        self.last_seen = self.last_message = time.monotonic()
+
+    async def publish(self, frame: Dict[str, Any]) -> int:
+        """Buffer the frame and write it to every open stream; returns its id"""
+        self.last_id = event_id = self.last_id + 1
+        self.frames.append((event_id, f"id: {event_id}\ndata: {json.dumps(frame)}\n\n".encode()))
+        self._wake()
+        for writer in tuple(self.writers):
+            try:
+                await writer.catch_up(self)
+            except Exception:
+                # A broken stream must not fail the turn; the client reconnects with Last-Event-ID
+                logger.warning("Dropping event stream of session %s", self.session_id, exc_info=True)
+                writer.finish()
+        return event_id
+
+    def since(self, last_id: int) -> List[Tuple[int, bytes]]:
+        """Buffered frames after ``last_id``; older ones that fell out of the buffer are lost"""
+        missed = min(self.last_id - last_id, len(self.frames))
+        return [self.frames[i] for i in range(len(self.frames) - missed, len(self.frames))]
+
+    async def wait(self, last_id: int, timeout: float) -> List[Tuple[int, bytes]]:
+        """Frames after ``last_id``, waiting up to ``timeout`` seconds for the first one"""
+        frames = self.since(last_id)
+        if frames or self.closed:
+            return frames
+        if self._published is None:
+            self._published = asyncio.Event()
+        try:
+            # Unlike wait_for, no task per wait
+            async with asyncio.timeout(timeout):
+                await self._published.wait()
+        except TimeoutError:
+            pass
+        return self.since(last_id)
+
+    def close(self):
+        self.closed = True
+        self._wake()
+        for writer in self.writers:
+            writer.finish()
+
+    def _wake(self):
+        # Waiters hold the event; the next wait creates a fresh one
+        if self._published is not None:
+            self._published.set()
+            self._published = None
+
+
+def frame_data(event: bytes) -> bytes:
+    """The JSON frame inside an encoded SSE event"""
+    return event[event.index(b"\ndata: ") + 7:-2]
+
+
+class EventStreamResponse(Response):
+    """SSE response: a channel's frames after ``last_event_id``, then live ones.
+
+    Live frames are written by ``EventChannel.publish``; this response's own
+    task only sends the backlog and heartbeats, and watches for the client
+    leaving or the channel closing.
+    """
+    media_type = "text/event-stream"
+
+    def __init__(self, manager: "EventStreamManager", channel: EventChannel, last_event_id: int = 0):
+        self.manager = manager
+        self.channel = channel
+        self.last_event_id = last_event_id
+        self.status_code = 200
+        self.background = None
+        self.init_headers({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def __call__(self, scope, receive, send):
+        channel = self.channel
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        writer = EventWriter(send, self.last_event_id)
+        listener = asyncio.get_running_loop().create_task(self._until_disconnect(receive, writer))
+        channel.streams += 1
+        channel.writers.append(writer)
+        try:
+            async with writer.lock:
+                await writer.write(RETRY_FRAME)
+            await writer.catch_up(channel)
+            while not channel.closed and not writer.done.done():
+                await asyncio.wait((writer.done,), timeout=self.manager.heartbeat_interval)
+                channel.last_seen = time.monotonic()
+                if not writer.written and not writer.done.done():
+                    async with writer.lock:
+                        await writer.write(HEARTBEAT_FRAME)
+                writer.written = False
+            if channel.closed:
+                async with writer.lock:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            listener.cancel()
+            writer.finish()
+            channel.writers.remove(writer)
+            channel.streams -= 1
+            channel.last_seen = time.monotonic()
+
+    @staticmethod
+    async def _until_disconnect(receive, writer: EventWriter):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        writer.finish()
+
+
+class EventStreamManager:
+    def __init__(self, max_sessions: int = 1000, heartbeat_interval: float = 15.0,
+                 peer_timeout: float = 60.0, idle_timeout: float = 900.0, retry_after: int = 5,
+                 buffer_size: int = 64, on_close: Optional[Callable[[str], None]] = None):
+        self.channels: Dict[str, EventChannel] = {}
+        self.max_sessions = max_sessions
+        self.heartbeat_interval = heartbeat_interval
+        self.peer_timeout = peer_timeout
+        self.idle_timeout = idle_timeout
+        self.retry_after = retry_after
+        self.buffer_size = buffer_size
+        self.on_close = on_close  # Called with the session id of every channel that goes away
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, on_close: Optional[Callable[[str], None]] = None) -> "EventStreamManager":
+        return cls(
+            max_sessions=int(os.getenv("SSE_MAX_SESSIONS", "1000")),
+            heartbeat_interval=float(os.getenv("SSE_HEARTBEAT_SECONDS", "15")),
+            peer_timeout=float(os.getenv("SSE_PEER_TIMEOUT_SECONDS", "60")),
+            idle_timeout=float(os.getenv("SSE_IDLE_TIMEOUT_SECONDS", "900")),
+            retry_after=int(os.getenv("SSE_RETRY_AFTER_SECONDS", "5")),
+            buffer_size=int(os.getenv("SSE_BUFFER_FRAMES", "64")),
+            on_close=on_close,
+        )
+
+    def get(self, session_id: str) -> Optional[EventChannel]:
+        return self.channels.get(session_id)
+
+    def open(self, session_id: str) -> Optional[EventChannel]:
+        """A new channel for the session; None if the worker is full"""
+        if len(self.channels) >= self.max_sessions:
+            HTTP_CHAT_REJECTED.inc()
+            return None
+        channel = EventChannel(session_id, self.buffer_size)
+        self.channels[session_id] = channel
+        HTTP_CHAT_SESSIONS.set(len(self.channels))
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+        return channel
+
+    async def send_message(self, session_id: str, message: dict) -> bool:
+        channel = self.channels.get(session_id)
+        if channel is None:
+            return False
+        await channel.publish(message)
+        return True
+
+    def stream(self, channel: EventChannel, last_event_id: int = 0) -> EventStreamResponse:
+        """SSE response: buffered frames after ``last_event_id``, then live ones"""
+        return EventStreamResponse(self, channel, last_event_id)
+
+    async def poll(self, channel: EventChannel, last_event_id: int, timeout: float) -> bytes:
+        """Long-poll body: frames after ``last_event_id``, waiting up to ``timeout`` seconds for one"""
+        channel.streams += 1
+        try:
+            frames = await channel.wait(last_event_id, min(timeout, self.peer_timeout / 2))
+        finally:
+            channel.streams -= 1
+            channel.last_seen = time.monotonic()
+        # Frames are spliced in as already-encoded JSON
+        events = b",".join(b'{"id": %d, "frame": %s}' % (frame_id, frame_data(event)) for frame_id, event in frames)
+        return b'{"events": [%s], "closed": %s}' % (events, json.dumps(channel.closed).encode())
+
+    def reap(self, channel: EventChannel, reason: str):
+        """Drop the channel, end its streams and let the owner archive the session"""
+        if self.channels.get(channel.session_id) is not channel:
+            return
+        del self.channels[channel.session_id]
+        HTTP_CHAT_SESSIONS.set(len(self.channels))
+        HTTP_CHAT_REAPED.labels(reason).inc()
+        channel.close()
+        if self.on_close is not None:
+            self.on_close(channel.session_id)
+
+    async def _sweep(self):
+        while self.channels:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for channel in list(self.channels.values()):
+                if now - channel.last_message > self.idle_timeout:
+                    self.reap(channel, "idle")
+                elif not channel.streams and now - channel.last_seen > self.peer_timeout:
+                    self.reap(channel, "abandoned")
+
+    async def shutdown(self):
+        """Stop sweeping and reap every channel so its session is archived"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for channel in list(self.channels.values()):
+            self.reap(channel, "shutdown")
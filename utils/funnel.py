@@ -0,0 +1,251 @@
+"""
+Live conversion funnel.
+
+MasterAgent reports each turn that moves a session along the funnel
+(greeting -> sales -> verification -> underwriting -> sanction) or rejects
+its application, and ``end_chat`` reports where each session stopped. The
+aggregator updates counters as the events happen, so it never reads session
+archives:
+
+- sessions started, reaching each stage and ending at each stage
+- rejections by reason
+- a latency sketch per stage of how long sessions spent in it before moving on
+
+Events are counted in the current one-minute bucket only, so a turn updates
+one set of counters. When a minute closes, its bucket is merged into its hour
+and the worker's totals. Minutes are kept for the last hour and hours for the
+last FUNNEL_RETENTION_HOURS, each in a ring that reuses its oldest bucket.
+``snapshot`` rolls a window of them up into coarser buckets. Memory depends on
+the retention, not on traffic. The counts are this worker's; the sketches
+merge, so workers' snapshots can be combined.
+"""
+import math
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+FUNNEL_STAGES = ("greeting", "sales", "verification", "underwriting", "sanction")
+# Conversation states outside the funnel count as the stage they belong to
+STAGE_INDEX = {"collecting_name": 0, **{stage: i for i, stage in enumerate(FUNNEL_STAGES)}}
+
+MAX_REJECTION_REASONS = 32  # Further reasons are counted as "other", in every bucket
+
+# Latency sketch: log-linear buckets, SUB_BUCKETS per power of two (quantiles within ~3%)
+SUB_BUCKETS = 16
+SKETCH_RESOLUTION = 0.001  # Seconds; shorter durations fall in the lowest bucket
+
+
+class LatencySketch:
+    """Fixed-precision histogram of durations in the style of HDR histograms; mergeable"""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}  # Bucket index -> count; at most a few hundred buckets
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds: float):
+        mantissa, exponent = math.frexp(max(seconds, SKETCH_RESOLUTION) / SKETCH_RESOLUTION)
+        index = exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other: "LatencySketch"):
+        counts = self.counts
+        for index, n in other.counts.items():
+            counts[index] = counts.get(index, 0) + n
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Midpoint of the bucket holding the q-th duration"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                exponent, sub = divmod(index, SUB_BUCKETS)
+                return math.ldexp(0.5 + (sub + 0.5) / (2 * SUB_BUCKETS), exponent) * SKETCH_RESOLUTION
+        return None
+
+    def summary(self) -> Dict[str, Any]:
+        def rounded(value):
+            return None if value is None else round(value, 3)
+        return {"count": self.count, "mean": rounded(self.total / self.count if self.count else None),
+                "p50": rounded(self.quantile(0.5)), "p90": rounded(self.quantile(0.9)),
+                "p99": rounded(self.quantile(0.99))}
+
+
+class FunnelCounts:
+    """Funnel events within one time bucket"""
+
+    __slots__ = ("start", "reached", "ended", "rejections", "dwell")
+
+    def __init__(self, start: float = 0.0):
+        self.start = start
+        self.reached = [0] * len(FUNNEL_STAGES)  # Reaching greeting is starting a session
+        self.ended = [0] * len(FUNNEL_STAGES)
+        self.rejections: Dict[str, int] = {}
+        self.dwell = [LatencySketch() for _ in FUNNEL_STAGES]
+
+    def merge(self, other: "FunnelCounts"):
+        for i in range(len(FUNNEL_STAGES)):
+            self.reached[i] += other.reached[i]
+            self.ended[i] += other.ended[i]
+            self.dwell[i].merge(other.dwell[i])
+        for reason, n in other.rejections.items():
+            self.rejections[reason] = self.rejections.get(reason, 0) + n
+
+    def to_dict(self) -> Dict[str, Any]:
+        started = self.reached[0]
+        stages = []
+        for i, stage in enumerate(FUNNEL_STAGES):
+            previous = self.reached[i - 1] if i else started
+            stages.append({
+                "stage": stage,
+                "reached": self.reached[i],
+                # Windows can hold later steps of sessions started before them, so these can pass 1
+                "conversion": round(self.reached[i] / started, 4) if started else None,
+                "step_conversion": round(self.reached[i] / previous, 4) if previous else None,
+                "ended_here": self.ended[i],
+                "dwell_seconds": self.dwell[i].summary(),
+            })
+        return {"started": started, "stages": stages,
+                "rejections": dict(sorted(self.rejections.items(), key=lambda item: -item[1]))}
+
+
+class _Ring:
+    """The last ``size`` buckets of ``width`` seconds; a bucket is reset when its slot comes round again"""
+
+    __slots__ = ("width", "size", "buckets")
+
+    def __init__(self, width: float, size: int):
+        self.width = width
+        self.size = size
+        self.buckets: List[Optional[FunnelCounts]] = [None] * size
+
+    def bucket(self, now: float) -> FunnelCounts:
+        start = now - now % self.width
+        slot = int(start // self.width) % self.size
+        bucket = self.buckets[slot]
+        if bucket is None or bucket.start != start:
+            bucket = self.buckets[slot] = FunnelCounts(start)
+        return bucket
+
+    def since(self, start: float) -> List[FunnelCounts]:
+        return sorted((bucket for bucket in self.buckets if bucket is not None and bucket.start >= start),
+                      key=lambda bucket: bucket.start)
+
+
+class FunnelAggregator:
+    def __init__(self, retention_hours: int = 48, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.minutes = _Ring(60, 60)
+        self.hours = _Ring(3600, max(1, retention_hours))
+        self.totals = FunnelCounts()  # Since the worker started, up to the last closed minute
+        self._current: Optional[FunnelCounts] = None  # The open minute
+        self._current_end = 0.0
+        self._reasons = set()  # Rejection reasons counted so far, at most MAX_REJECTION_REASONS
+
+    @classmethod
+    def from_env(cls) -> "FunnelAggregator":
+        return cls(int(os.getenv("FUNNEL_RETENTION_HOURS", "48")))
+
+    def _counts(self, now: float) -> FunnelCounts:
+        if now >= self._current_end:
+            self._close_minute(now)
+        return self._current
+
+    def _close_minute(self, now: float):
+        closed = self._current
+        if closed is not None:
+            self.hours.bucket(closed.start).merge(closed)
+            self.totals.merge(closed)
+        self._current = self.minutes.bucket(now)
+        self._current_end = self._current.start + self.minutes.width
+
+    def session_started(self) -> float:
+        """Count a new session; returns when it entered the greeting stage"""
+        now = self.clock()
+        self._counts(now).reached[0] += 1
+        return now
+
+    def transition(self, from_state: str, to_state: str, since: float, reason: Optional[str] = None) -> float:
+        """Count a turn that moved a session from ``from_state``, where it has been since ``since``.
+
+        Stages passed through within the turn count as reached. Returns when the
+        session entered the stage it is now in.
+        """
+        now = self.clock()
+        start, end = STAGE_INDEX.get(from_state), STAGE_INDEX.get(to_state)
+        advanced = start is not None and end is not None and end > start
+        if not advanced and not reason:
+            return since
+        counts = self._counts(now)
+        if advanced:
+            for i in range(start + 1, end + 1):
+                counts.reached[i] += 1
+            counts.dwell[start].add(now - since)
+        if reason:
+            if reason not in self._reasons:
+                if len(self._reasons) >= MAX_REJECTION_REASONS:
+                    reason = "other"
+                else:
+                    self._reasons.add(reason)
+            counts.rejections[reason] = counts.rejections.get(reason, 0) + 1
+        return now if advanced else since
+
+    def session_ended(self, conversation_state: str):
+        stage = STAGE_INDEX.get(conversation_state)
+        if stage is None:
+            return
+        self._counts(self.clock()).ended[stage] += 1
+
+    def snapshot(self, window: Optional[float] = None, step: Optional[float] = None) -> Dict[str, Any]:
+        """The funnel over the last ``window`` seconds, rolled up into ``step``-second buckets.
+
+        Without a window, the funnel since the worker started. Windows up to an
+        hour use the minute buckets, longer ones the hour buckets; the step is
+        rounded up to a whole number of them.
+        """
+        if window is None:
+            totals = FunnelCounts()
+            totals.merge(self.totals)
+            if self._current is not None:
+                totals.merge(self._current)
+            return {"window_seconds": None, "totals": totals.to_dict(), "buckets": []}
+        ring = self.minutes if window <= self.minutes.width * self.minutes.size else self.hours
+        window = min(window, ring.width * ring.size)
+        step = max(ring.width, math.ceil((step or window) / ring.width) * ring.width)
+        now = self.clock()
+        first = now - now % ring.width - (math.ceil(window / ring.width) - 1) * ring.width
+
+        buckets = ring.since(first)
+        if ring is self.hours and self._current is not None and self._current.start >= first:
+            buckets.append(self._current)  # Merged into its hour when the minute closes
+        totals, rollups = FunnelCounts(first), {}
+        for bucket in buckets:
+            totals.merge(bucket)
+            rollup_start = first + (bucket.start - first) // step * step
+            rollups.setdefault(rollup_start, FunnelCounts(rollup_start)).merge(bucket)
+        return {
+            "window_seconds": window,
+            "step_seconds": step,
+            "totals": totals.to_dict(),
+            "buckets": [{"start": start, **counts.to_dict()} for start, counts in sorted(rollups.items())],
+        }
+
+
+_funnel: Optional[FunnelAggregator] = None
+
+
+def get_funnel() -> FunnelAggregator:
+    """Process-wide funnel aggregator, created on first use"""
+    global _funnel
+    if _funnel is None:
+        _funnel = FunnelAggregator.from_env()
+    return _funnel
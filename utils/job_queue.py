@@ -0,0 +1,490 @@
+"""
+Background jobs: PDF rendering, session archiving and bureau pulls, off the
+request path.
+
+Jobs are plain functions (or coroutine functions) registered by name with
+``@job``; callers submit them with a priority and an optional idempotency
+key and get back a future they can await:
+
+    letter = await get_job_queue().run("sanction.render_pdf", context, ...)
+    get_job_queue().enqueue("session.archive", archive, idempotency_key=session_id)  # From sync code
+
+Two backends share that interface:
+
+- ``InProcessJobQueue`` (default): an asyncio priority queue drained by a
+  few worker tasks; synchronous jobs run on a thread pool
+- ``SQLiteJobQueue`` (``JOB_QUEUE_URL=sqlite:///jobs.db``): a durable broker
+  in a SQLite file. Every worker process sharing the file takes jobs from it,
+  a job whose worker died is picked up again when its lease runs out, and
+  queued jobs survive restarts. Arguments and results are pickled
+
+Failed jobs are retried with exponential backoff up to the job's ``retries``;
+after that the future raises ``JobFailed``. Submitting a key that is queued,
+running, or finished within ``JOB_RESULT_TTL_SECONDS`` returns the existing
+job's future instead of running it again.
+"""
+import abc
+import asyncio
+import collections
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from utils.metrics import JOBS_PROCESSED, JOB_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0    # A user is waiting on the result
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9     # Housekeeping, e.g. archiving
+
+
+class JobFailed(Exception):
+    """A job raised on its last attempt"""
+
+    def __init__(self, name: str, error: str):
+        super().__init__(f"job {name} failed: {error}")
+        self.name = name
+        self.error = error
+
+
+class JobSpec:
+    __slots__ = ("name", "func", "priority", "retries", "backoff", "is_async")
+
+    def __init__(self, name: str, func: Callable, priority: int, retries: int, backoff: float):
+        self.name = name
+        self.func = func
+        self.priority = priority
+        self.retries = retries
+        self.backoff = backoff
+        self.is_async = inspect.iscoroutinefunction(func)
+
+    def retry_delay(self, attempt: int) -> float:
+        return self.backoff * 2 ** (attempt - 1)
+
+
+# Registry of all jobs, filled in by the @job decorator
+JOBS: Dict[str, JobSpec] = {}
+
+
+def job(name: str, priority: int = PRIORITY_NORMAL, retries: int = 0, backoff: float = 0.5):
+    """Register a job under ``name``; every process that runs jobs must import its module"""
+    def decorator(func: Callable) -> Callable:
+        JOBS[name] = JobSpec(name, func, priority, retries, backoff)
+        return func
+    return decorator
+
+
+class _JobQueue(abc.ABC):
+    """What both backends share: submitting, running a job's function and the worker tasks"""
+
+    def __init__(self, workers: int, executor: Optional[Executor], result_ttl: float):
+        self.workers = workers
+        self.executor = executor  # None: the event loop's default thread pool
+        self.result_ttl = result_ttl
+        self._worker_tasks: List[asyncio.Task] = []
+        self._submitting: Set[asyncio.Task] = set()
+
+    def enqueue(self, name: str, *args, **kwargs):
+        """Fire-and-forget submit for synchronous code running on the event loop"""
+        task = asyncio.get_running_loop().create_task(self.submit(name, *args, **kwargs))
+        self._submitting.add(task)
+        task.add_done_callback(self._submitting.discard)
+
+    async def _flush_submissions(self):
+        if self._submitting:
+            await asyncio.gather(*list(self._submitting), return_exceptions=True)
+
+    async def run(self, name: str, *args, **kwargs) -> Any:
+        """Submit a job and wait for its result"""
+        return await (await self.submit(name, *args, **kwargs))
+
+    @abc.abstractmethod
+    async def submit(self, name: str, *args, priority: Optional[int] = None,
+                     idempotency_key: Optional[str] = None, **kwargs) -> asyncio.Future:
+        """Queue a job; the returned future resolves to its result or raises JobFailed"""
+
+    async def _execute(self, spec: JobSpec, args: tuple, kwargs: dict) -> Any:
+        if spec.is_async:
+            return await spec.func(*args, **kwargs)
+        # Carry the caller's context (e.g. the active trace span) into the worker thread
+        call = functools.partial(contextvars.copy_context().run, spec.func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def _start_workers(self):
+        if not self._worker_tasks:
+            loop = asyncio.get_running_loop()
+            self._worker_tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    @abc.abstractmethod
+    async def _work(self):
+        """One worker task: take jobs and run them until cancelled"""
+
+    @abc.abstractmethod
+    async def shutdown(self, timeout: float = 10.0):
+        """Let queued jobs finish for up to ``timeout`` seconds, then stop the workers"""
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """The backend and what it currently holds, for diagnostics"""
+
+    async def _stop_workers(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+
+class _Job:
+    __slots__ = ("spec", "args", "kwargs", "priority", "key", "future", "attempts", "enqueued_at")
+
+    def __init__(self, spec: JobSpec, args: tuple, kwargs: dict, priority: int, key: Optional[str],
+                 future: asyncio.Future):
+        self.spec = spec
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = key
+        self.future = future
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+class InProcessJobQueue(_JobQueue):
+    def __init__(self, workers: int = 4, executor: Optional[Executor] = None, result_ttl: float = 60.0):
+        super().__init__(workers, executor, result_ttl)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = 0  # FIFO within a priority
+        self._by_key: Dict[str, asyncio.Future] = {}
+        # Results are kept for the same time, so finishing order is expiry order
+        self._key_expiry: Deque[Tuple[float, str, asyncio.Future]] = collections.deque()
+        self._retrying = 0
+
+    async def submit(self, name: str, *args, priority: Optional[int] = None,
+                     idempotency_key: Optional[str] = None, **kwargs) -> asyncio.Future:
+        spec = JOBS[name]
+        if idempotency_key is not None:
+            self._expire_keys()
+            existing = self._by_key.get(idempotency_key)
+            if existing is not None:
+                return existing
+
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._start_workers()
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(spec, args, kwargs, spec.priority if priority is None else priority, idempotency_key, future)
+        if idempotency_key is not None:
+            self._by_key[idempotency_key] = future
+        self._put(job)
+        return future
+
+    def _put(self, job: _Job):
+        self._sequence += 1
+        self._queue.put_nowait((job.priority, self._sequence, job))
+
+    async def _work(self):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._attempt(job)
+            finally:
+                self._queue.task_done()
+
+    async def _attempt(self, job: _Job):
+        spec = job.spec
+        job.attempts += 1
+        JOB_QUEUE_WAIT.labels(spec.name).observe(time.monotonic() - job.enqueued_at)
+        try:
+            result = await self._execute(spec, job.args, job.kwargs)
+        except Exception as e:
+            if job.attempts <= spec.retries:
+                JOBS_PROCESSED.labels(spec.name, "retried").inc()
+                logger.warning("Job %s failed (attempt %d), retrying: %s", spec.name, job.attempts, e)
+                self._retrying += 1
+                asyncio.get_running_loop().call_later(spec.retry_delay(job.attempts), self._requeue, job)
+                return
+            JOBS_PROCESSED.labels(spec.name, "failed").inc()
+            logger.error("Job %s failed after %d attempt(s): %s", spec.name, job.attempts, e)
+            if job.key is not None:
+                self._by_key.pop(job.key, None)  # A failed key can be submitted again
+            if not job.future.done():
+                failure = JobFailed(spec.name, repr(e))
+                failure.__cause__ = e
+                job.future.set_exception(failure)
+            return
+
+        JOBS_PROCESSED.labels(spec.name, "done").inc()
+        if job.key is not None:
+            self._key_expiry.append((time.monotonic() + self.result_ttl, job.key, job.future))
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def _requeue(self, job: _Job):
+        self._retrying -= 1
+        job.enqueued_at = time.monotonic()
+        self._put(job)
+
+    def _expire_keys(self):
+        expiry, now = self._key_expiry, time.monotonic()
+        while expiry and expiry[0][0] <= now:
+            _, key, future = expiry.popleft()
+            if self._by_key.get(key) is future:
+                del self._by_key[key]
+
+    async def shutdown(self, timeout: float = 10.0):
+        """Finish queued jobs (up to ``timeout`` seconds), then stop the workers"""
+        await self._flush_submissions()
+        if self._queue is not None:
+            deadline = time.monotonic() + timeout
+            try:
+                # Jobs waiting out a retry delay are not in the queue yet
+                while True:
+                    await asyncio.wait_for(self._queue.join(), max(deadline - time.monotonic(), 0))
+                    if not self._retrying:
+                        break
+                    await asyncio.sleep(0.05)
+            except asyncio.TimeoutError:
+                logger.warning("Stopping with %d job(s) still queued", self._queue.qsize() + self._retrying)
+        await self._stop_workers()
+        # The queue belongs to this event loop; the next submit starts afresh
+        self._queue = None
+        self._retrying = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "queued": self._queue.qsize() if self._queue else 0,
+                "idempotency_keys": len(self._by_key)}
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    priority INTEGER NOT NULL,
+    idempotency_key TEXT UNIQUE,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    lease_until REAL,
+    result BLOB,
+    error TEXT,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, id);
+"""
+
+
+class SQLiteJobQueue(_JobQueue):
+    """Durable broker in a SQLite file, shared by the worker processes on one host"""
+
+    def __init__(self, path: str, workers: int = 4, executor: Optional[Executor] = None,
+                 result_ttl: float = 60.0, lease_seconds: float = 60.0, poll_interval: float = 0.5):
+        super().__init__(workers, executor, result_ttl)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        # One connection, used from one thread: SQLite calls never block the event loop
+        self._db_thread = ThreadPoolExecutor(1, thread_name_prefix="job-queue-db")
+        self._db: Optional[sqlite3.Connection] = None
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._watcher: Optional[asyncio.Task] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    async def _call(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_thread, func, *args)
+
+    async def submit(self, name: str, *args, priority: Optional[int] = None,
+                     idempotency_key: Optional[str] = None, **kwargs) -> asyncio.Future:
+        spec = JOBS[name]
+        payload = pickle.dumps((args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+        job_id, result = await self._call(self._insert, name, payload,
+                                          spec.priority if priority is None else priority, idempotency_key)
+        future = self._waiters.get(job_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            if result is not None:
+                future.set_result(pickle.loads(result))  # Finished recently under the same key
+                return future
+            self._waiters[job_id] = future
+        self._start_workers()
+        self._wakeup.set()
+        return future
+
+    def _insert(self, name: str, payload: bytes, priority: int, key: Optional[str]) -> Tuple[int, Optional[bytes]]:
+        """Id of the new job, or of the live job with the same key and its result if it is done"""
+        db, now = self._connection(), time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if key is not None:
+                row = db.execute("SELECT id, status, result, finished_at FROM jobs WHERE idempotency_key = ?",
+                                 (key,)).fetchone()
+                if row is not None:
+                    job_id, status, result, finished_at = row
+                    if status in ("queued", "running") or (status == "done" and finished_at + self.result_ttl > now):
+                        db.execute("COMMIT")
+                        return job_id, result
+                    db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            job_id = db.execute("INSERT INTO jobs (name, payload, priority, idempotency_key, run_at) "
+                                "VALUES (?, ?, ?, ?, ?)", (name, payload, priority, key, now)).lastrowid
+            db.execute("COMMIT")
+            return job_id, None
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _claim(self, names: Tuple[str, ...]) -> Optional[Tuple[int, str, bytes, int, float]]:
+        """Lease the most urgent runnable job, including ones whose worker stopped renewing"""
+        db, now = self._connection(), time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            placeholders = ",".join("?" * len(names))
+            row = db.execute(
+                f"SELECT id, name, payload, attempts, run_at FROM jobs "
+                f"WHERE name IN ({placeholders}) AND ((status = 'queued' AND run_at <= ?) "
+                f"OR (status = 'running' AND lease_until < ?)) ORDER BY priority, id LIMIT 1",
+                (*names, now, now)).fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ? "
+                           "WHERE id = ?", (now + self.lease_seconds, row[0]))
+            db.execute("COMMIT")
+            return row
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _finish(self, job_id: int, result: Optional[bytes], error: Optional[str], retry_at: Optional[float]):
+        db = self._connection()
+        if retry_at is not None:
+            db.execute("UPDATE jobs SET status = 'queued', run_at = ?, error = ? WHERE id = ?",
+                       (retry_at, error, job_id))
+        else:
+            db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, payload = x'' "
+                       "WHERE id = ?", ("failed" if error else "done", result, error, time.time(), job_id))
+
+    def _outcomes(self, job_ids: List[int]) -> List[Tuple[int, str, Optional[bytes], Optional[str], str]]:
+        placeholders = ",".join("?" * len(job_ids))
+        return self._connection().execute(
+            f"SELECT id, status, result, error, name FROM jobs WHERE id IN ({placeholders}) "
+            f"AND status IN ('done', 'failed')", job_ids).fetchall()
+
+    def _purge(self):
+        self._connection().execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                   (time.time() - self.result_ttl,))
+
+    def _start_workers(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if not self._worker_tasks:
+            super()._start_workers()
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def _work(self):
+        while True:
+            # Only jobs this process can run; another process may have registered more
+            row = await self._call(self._claim, tuple(JOBS))
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, name, payload, attempts, run_at = row
+            spec = JOBS[name]
+            attempt = attempts + 1
+            JOB_QUEUE_WAIT.labels(name).observe(max(time.time() - run_at, 0))
+            try:
+                args, kwargs = pickle.loads(payload)
+                result = await self._execute(spec, args, kwargs)
+            except Exception as e:
+                retry_at = time.time() + spec.retry_delay(attempt) if attempt <= spec.retries else None
+                JOBS_PROCESSED.labels(name, "retried" if retry_at else "failed").inc()
+                logger.warning("Job %s failed (attempt %d): %s", name, attempt, e)
+                await self._call(self._finish, job_id, None, repr(e), retry_at)
+                if retry_at is None:
+                    self._resolve(job_id, name, None, repr(e))
+                continue
+
+            JOBS_PROCESSED.labels(name, "done").inc()
+            await self._call(self._finish, job_id, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+                             None, None)
+            self._resolve(job_id, name, result, None)
+
+    def _resolve(self, job_id: int, name: str, result: Any, error: Optional[str]):
+        future = self._waiters.pop(job_id, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(JobFailed(name, error))
+
+    async def _watch(self):
+        """Resolve futures of jobs that other processes ran, and drop old results"""
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self._waiters:
+                for job_id, status, result, error, name in await self._call(self._outcomes, list(self._waiters)):
+                    self._resolve(job_id, name, pickle.loads(result) if status == "done" else None,
+                                  error if status == "failed" else None)
+            if time.monotonic() - last_purge > self.result_ttl:
+                last_purge = time.monotonic()
+                await self._call(self._purge)
+
+    async def shutdown(self, timeout: float = 10.0):
+        """Wait (up to ``timeout`` seconds) for this process's submissions, then stop taking jobs.
+
+        Anything still queued stays in the file for the next worker.
+        """
+        await self._flush_submissions()
+        pending = [future for future in self._waiters.values() if not future.done()]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        await self._stop_workers()
+        self._wakeup = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "path": self.path, "waiting_futures": len(self._waiters)}
+
+
+def job_queue_from_url(url: Optional[str], workers: int = 4, result_ttl: float = 60.0):
+    if not url:
+        return InProcessJobQueue(workers, result_ttl=result_ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteJobQueue(url[len("sqlite:///"):], workers, result_ttl=result_ttl)
+    raise ValueError(f"unsupported JOB_QUEUE_URL {url!r}")
+
+
+_job_queue = None
+
+
+def get_job_queue():
+    """Process-wide job queue, configured from the environment on first use"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = job_queue_from_url(
+            os.getenv("JOB_QUEUE_URL"),
+            workers=int(os.getenv("JOB_WORKERS", "4")),
+            result_ttl=float(os.getenv("JOB_RESULT_TTL_SECONDS", "60")),
+        )
+    return _job_queue
@@ -0,0 +1,90 @@
+"""
+Prometheus metrics for the chatbot, scraped from GET /metrics
+(see monitoring/prometheus.yml)
+"""
+from typing import Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Estimated prompt size of every LLM call, labelled by the AIService method
+PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens",
+    "Estimated prompt tokens sent to the LLM per call",
+    ["call"],
+    buckets=(50, 100, 200, 400, 800, 1200, 1600, 2400, 3200, 4800),
+)
+
+PROMPT_HISTORY_DROPPED = Counter(
+    "llm_prompt_history_dropped_total",
+    "Conversation history messages left out of prompts to stay within the token budget",
+    ["call"],
+)
+
+INTENT_BATCH_SIZE = Histogram(
+    "llm_intent_batch_size",
+    "Intent classification requests sent per batched LLM call",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time LLM calls spend waiting for a concurrency slot",
+    ["priority"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+LLM_DEADLINE_FALLBACKS = Counter(
+    "llm_deadline_fallbacks_total",
+    "LLM calls answered by the deterministic fallback because their deadline would be missed",
+    ["priority", "call"],
+)
+
+WS_CONNECTIONS = Gauge(
+    "ws_connections",
+    "Open chat WebSocket connections on this worker",
+)
+
+WS_REJECTED = Counter(
+    "ws_connections_rejected_total",
+    "WebSocket connections turned away because the worker was at capacity",
+)
+
+WS_REAPED = Counter(
+    "ws_connections_reaped_total",
+    "WebSocket connections closed by the server",
+    ["reason"],
+)
+
+HTTP_CHAT_SESSIONS = Gauge(
+    "http_chat_sessions",
+    "Open SSE/long-poll chat sessions on this worker",
+)
+
+HTTP_CHAT_REJECTED = Counter(
+    "http_chat_sessions_rejected_total",
+    "SSE/long-poll chat sessions turned away because the worker was at capacity",
+)
+
+HTTP_CHAT_REAPED = Counter(
+    "http_chat_sessions_reaped_total",
+    "SSE/long-poll chat sessions closed by the server",
+    ["reason"],
+)
+
+JOBS_PROCESSED = Counter(
+    "jobs_processed_total",
+    "Background job attempts by outcome (done, retried, failed)",
+    ["job", "outcome"],
+)
+
+JOB_QUEUE_WAIT = Histogram(
+    "job_queue_wait_seconds",
+    "Time a background job waited in the queue before a worker started it",
+    ["job"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text exposition format"""
+    return generate_latest(), CONTENT_TYPE_LATEST
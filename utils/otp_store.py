@@ -0,0 +1,268 @@
+"""
+One-time passwords for phone verification.
+
+Each OTP is a challenge stored under a random id that the session keeps in
+its context; the store itself only holds a keyed hash of the code, its expiry,
+the number of attempts and when it was last sent. Verification compares
+digests in constant time, counts every attempt, locks the challenge after
+too many wrong codes and burns it once it succeeds. Resends reuse the
+challenge, so the cooldown and resend cap cannot be reset by asking again.
+
+With OTP_STORE_URL (``redis://...``) every worker shares the challenges and
+each operation is a single atomic script call; otherwise an in-memory store
+stands in. Neither takes a lock or touches disk per request.
+"""
+import collections
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+from typing import Deque, Dict, Optional, Protocol, Tuple
+
+logger = logging.getLogger(__name__)
+
+OTP_VERIFIED = "verified"
+OTP_INVALID = "invalid"
+OTP_EXPIRED = "expired"
+OTP_LOCKED = "locked"    # Too many wrong attempts
+OTP_MISSING = "missing"  # Unknown challenge, or already used
+
+
+class OTPThrottled(Exception):
+    """A resend was requested too soon or too often"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"OTP resend throttled, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class OTPBackend(Protocol):
+    async def create(self, key: str, digest: str, expires_at: float, retain_seconds: float, now: float): ...
+
+    async def resend(self, key: str, digest: str, expires_at: float, retain_seconds: float, now: float,
+                     interval: float, max_sends: int) -> float:
+        """Replace the code; 0 on success, -1 for an unknown challenge, else seconds to wait"""
+
+    async def attempt(self, key: str) -> Optional[Tuple[str, float, int]]:
+        """Count an attempt; (digest, expires_at, attempts) or None for an unknown challenge"""
+
+    async def delete(self, key: str): ...
+
+
+class _Challenge:
+    __slots__ = ("digest", "expires_at", "attempts", "sends", "last_sent", "purge_at")
+
+    def __init__(self, digest: str, expires_at: float, now: float, purge_at: float):
+        self.digest = digest
+        self.expires_at = expires_at
+        self.attempts = 0
+        self.sends = 1
+        self.last_sent = now
+        self.purge_at = purge_at
+
+
+class InMemoryOTPBackend:
+    """Single-worker stand-in; every operation completes without awaiting, so no locks"""
+
+    def __init__(self):
+        self.challenges: Dict[str, _Challenge] = {}
+        # Every challenge is retained for the same time, so creation order is
+        # purge order and expired entries are dropped from the front in O(1)
+        self._purge_queue: Deque[Tuple[float, str]] = collections.deque()
+
+    def _purge(self, now: float):
+        queue = self._purge_queue
+        while queue and queue[0][0] <= now:
+            _, key = queue.popleft()
+            challenge = self.challenges.get(key)
+            if challenge is not None and challenge.purge_at <= now:
+                del self.challenges[key]
+
+    async def create(self, key: str, digest: str, expires_at: float, retain_seconds: float, now: float):
+        self._purge(now)
+        self.challenges[key] = _Challenge(digest, expires_at, now, now + retain_seconds)
+        self._purge_queue.append((now + retain_seconds, key))
+
+    async def resend(self, key: str, digest: str, expires_at: float, retain_seconds: float, now: float,
+                     interval: float, max_sends: int) -> float:
+        challenge = self.challenges.get(key)
+        if challenge is None or challenge.purge_at <= now:
+            return -1
+        wait = challenge.last_sent + interval - now
+        if wait > 0:
+            return wait
+        if challenge.sends >= max_sends:
+            return challenge.purge_at - now
+        challenge.digest, challenge.expires_at = digest, expires_at
+        challenge.attempts, challenge.last_sent = 0, now
+        challenge.sends += 1
+        challenge.purge_at = now + retain_seconds
+        self._purge_queue.append((challenge.purge_at, key))
+        return 0
+
+    async def attempt(self, key: str) -> Optional[Tuple[str, float, int]]:
+        challenge = self.challenges.get(key)
+        if challenge is None:
+            return None
+        challenge.attempts += 1
+        return challenge.digest, challenge.expires_at, challenge.attempts
+
+    async def delete(self, key: str):
+        self.challenges.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.challenges)
+
+
+_RESEND_SCRIPT = """
+local last = redis.call('HGET', KEYS[1], 'last_sent')
+if not last then return '-1' end
+local now = tonumber(ARGV[4])
+local wait = tonumber(last) + tonumber(ARGV[5]) - now
+if wait > 0 then return tostring(wait) end
+local sends = tonumber(redis.call('HGET', KEYS[1], 'sends'))
+if sends >= tonumber(ARGV[6]) then return tostring(redis.call('PTTL', KEYS[1]) / 1000) end
+redis.call('HSET', KEYS[1], 'digest', ARGV[1], 'expires_at', ARGV[2], 'attempts', 0,
+           'sends', sends + 1, 'last_sent', ARGV[4])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return '0'
+"""
+
+_ATTEMPT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+return {redis.call('HGET', KEYS[1], 'digest'), redis.call('HGET', KEYS[1], 'expires_at'), attempts}
+"""
+
+
+class RedisOTPBackend:
+    """Challenges shared by all workers; each call is one round trip"""
+
+    def __init__(self, client, prefix: str = "otp:"):
+        self.client = client
+        self.prefix = prefix
+        self._resend = client.register_script(_RESEND_SCRIPT)
+        self._attempt = client.register_script(_ATTEMPT_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisOTPBackend":
+        import redis.asyncio  # Only needed when a shared store is configured
+        return cls(redis.asyncio.from_url(url, decode_responses=True))
+
+    async def create(self, key: str, digest: str, expires_at: float, retain_seconds: float, now: float):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.prefix + key, mapping={
+                "digest": digest, "expires_at": expires_at, "attempts": 0, "sends": 1, "last_sent": now,
+            })
+            pipe.pexpire(self.prefix + key, int(retain_seconds * 1000))
+            await pipe.execute()
+
+    async def resend(self, key: str, digest: str, expires_at: float, retain_seconds: float, now: float,
+                     interval: float, max_sends: int) -> float:
+        result = await self._resend(keys=[self.prefix + key],
+                                    args=[digest, expires_at, int(retain_seconds * 1000), now, interval, max_sends])
+        return float(result)
+
+    async def attempt(self, key: str) -> Optional[Tuple[str, float, int]]:
+        result = await self._attempt(keys=[self.prefix + key])
+        if not result:
+            return None
+        digest, expires_at, attempts = result
+        return digest, float(expires_at), int(attempts)
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+
+class OTPStore:
+    def __init__(self, backend: OTPBackend, secret: bytes, ttl_seconds: int = 300, max_attempts: int = 5,
+                 resend_interval: int = 30, max_sends: int = 4):
+        self.backend = backend
+        # Keyed BLAKE2b is a MAC in its own right and several times cheaper
+        # than HMAC-SHA256 per issue and check; its key is at most 64 bytes
+        self._key = hashlib.sha256(secret).digest()
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+        self.resend_interval = resend_interval
+        self.max_sends = max_sends
+        # Keep the record past expiry so "expired" differs from "unknown" and
+        # the resend cap still applies
+        self.retain_seconds = ttl_seconds * 2
+
+    @classmethod
+    def from_env(cls) -> "OTPStore":
+        url = os.getenv("OTP_STORE_URL")
+        backend = RedisOTPBackend.from_url(url) if url else InMemoryOTPBackend()
+        secret = os.getenv("OTP_SECRET") or os.getenv("SECRET_KEY")
+        if not secret:
+            if url:
+                # Other workers could not verify this worker's codes
+                logger.warning("OTP_SECRET is not set, using a per-process OTP secret with a shared store")
+            secret = secrets.token_hex(32)
+        return cls(
+            backend,
+            secret.encode(),
+            ttl_seconds=int(os.getenv("OTP_TTL_SECONDS", "300")),
+            max_attempts=int(os.getenv("OTP_MAX_ATTEMPTS", "5")),
+            resend_interval=int(os.getenv("OTP_RESEND_INTERVAL_SECONDS", "30")),
+            max_sends=int(os.getenv("OTP_MAX_SENDS", "4")),
+        )
+
+    def _digest(self, challenge: str, phone: str, otp: str) -> str:
+        message = f"{challenge}:{phone}:{otp}".encode()
+        return hashlib.blake2b(message, key=self._key, digest_size=32).hexdigest()
+
+    async def issue(self, phone: str, otp: str, now: Optional[float] = None) -> str:
+        """Store a new OTP for ``phone``; returns the challenge id to keep in the session"""
+        now = now or time.time()
+        challenge = secrets.token_urlsafe(16)
+        await self.backend.create(challenge, self._digest(challenge, phone, otp),
+                                  now + self.ttl_seconds, self.retain_seconds, now)
+        return challenge
+
+    async def resend(self, challenge: Optional[str], phone: str, otp: str, now: Optional[float] = None) -> str:
+        """Replace the challenge's code, raising OTPThrottled when sent too recently or too often.
+
+        Returns the challenge id, which is new if the old one is unknown or long gone.
+        """
+        now = now or time.time()
+        if challenge:
+            wait = await self.backend.resend(challenge, self._digest(challenge, phone, otp),
+                                             now + self.ttl_seconds, self.retain_seconds, now,
+                                             self.resend_interval, self.max_sends)
+            if wait == 0:
+                return challenge
+            if wait > 0:
+                raise OTPThrottled(wait)
+        return await self.issue(phone, otp, now)
+
+    async def verify(self, challenge: Optional[str], phone: str, otp: str, now: Optional[float] = None) -> str:
+        """One of OTP_VERIFIED, OTP_INVALID, OTP_EXPIRED, OTP_LOCKED or OTP_MISSING"""
+        if not challenge:
+            return OTP_MISSING
+        record = await self.backend.attempt(challenge)
+        if record is None:
+            return OTP_MISSING
+        digest, expires_at, attempts = record
+        if attempts > self.max_attempts:
+            return OTP_LOCKED
+        if (now or time.time()) >= expires_at:
+            return OTP_EXPIRED
+        if not hmac.compare_digest(digest, self._digest(challenge, phone, otp)):
+            return OTP_LOCKED if attempts == self.max_attempts else OTP_INVALID
+        # One-time: a verified code cannot be replayed
+        await self.backend.delete(challenge)
+        return OTP_VERIFIED
+
+
+_otp_store: Optional[OTPStore] = None
+
+
+def get_otp_store() -> OTPStore:
+    """Process-wide OTP store, configured from the environment on first use"""
+    global _otp_store
+    if _otp_store is None:
+        _otp_store = OTPStore.from_env()
+    return _otp_store
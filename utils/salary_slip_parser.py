@@ -0,0 +1,399 @@
+"""
+Salary slip parsing: gross and net monthly salary and the employer, read from
+the text of an uploaded slip.
+
+Text comes from text-based PDFs (content streams, Flate-compressed or not,
+laid out back into lines by position) or from the text chunks and comments
+embedded in PNG and JPEG images. Scanned slips without a text layer come back
+``unreadable``; nothing here does OCR.
+
+Parsing runs in a small process pool so a large or awkward PDF never blocks
+the event loop, and results are cached by the SHA-256 of the file, so
+uploading the same slip again (or twice at once) parses it only once.
+Compressed streams and chunks may inflate to MAX_INFLATED_BYTES in total;
+a slip that expands past that is unreadable. A worker that crashes or hangs
+past the timeout is replaced along with its pool.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import struct
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLIP_PARSED = "parsed"
+SLIP_INCOMPLETE = "incomplete"  # Text found, but no salary figure in it
+SLIP_UNREADABLE = "unreadable"  # No text layer, unsupported format or parse failure
+
+# Decompressed bytes one slip may produce across all its streams and chunks
+MAX_INFLATED_BYTES = 16 * 1024 * 1024
+
+
+class InflateLimitExceeded(Exception):
+    """A slip decompresses to more than its budget (a decompression bomb, or not a slip)"""
+
+
+class _Inflater:
+    """zlib decompression against a byte budget shared by every stream of one file"""
+
+    def __init__(self, limit: int = MAX_INFLATED_BYTES):
+        self.remaining = limit
+
+    def __call__(self, data: bytes) -> bytes:
+        inflater = zlib.decompressobj()
+        # Never produces more than the budget allows, however small the input
+        output = inflater.decompress(data, self.remaining + 1)
+        if len(output) > self.remaining or inflater.unconsumed_tail:
+            raise InflateLimitExceeded(f"decompresses past {MAX_INFLATED_BYTES} bytes")
+        if not inflater.eof:
+            raise zlib.error("incomplete or truncated stream")
+        self.remaining -= len(output)
+        return output
+
+
+# Text extraction
+
+# Dictionary and data of every stream object; the dictionary may not run into another object
+_STREAM = re.compile(rb"\bobj\b((?:(?!\bendobj\b).)*?)\bstream\r?\n(.*?)(?:\r?\n)?endstream", re.S)
+_FILTER = re.compile(rb"/Filter\s*(\[[^\]]*\]|/\w+)")
+# FlateDecode and Fl are added per file, bound to its _Inflater
+_DECODERS = {
+    b"ASCII85Decode": lambda data: base64.a85decode(data.strip().removesuffix(b"~>"), ignorechars=b" \t\r\n"),
+    b"A85": lambda data: base64.a85decode(data.strip().removesuffix(b"~>"), ignorechars=b" \t\r\n"),
+    b"ASCIIHexDecode": lambda data: binascii.unhexlify(re.sub(rb"\s|>", b"", data)),
+}
+_DECODERS[b"AHx"] = _DECODERS[b"ASCIIHexDecode"]
+_CONTENT_TOKEN = re.compile(rb"\((?:\\.|[^\\()]|\((?:\\.|[^\\()])*\))*\)|<[0-9A-Fa-f\s]*>|\[|\]|"
+                            rb"/[^\s/\[\]()<>]+|[-+]?\d*\.?\d+|[A-Za-z'\"*]+")
+_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f",
+            b"(": b"(", b")": b")", b"\\": b"\\"}
+_ESCAPE = re.compile(rb"\\([nrtbf()\\]|[0-7]{1,3}|\r?\n)")
+
+
+def _unescape(literal: bytes) -> str:
+    def replace(match):
+        code = match.group(1)
+        if code in _ESCAPES:
+            return _ESCAPES[code]
+        if code[:1].isdigit():
+            return bytes([int(code, 8) & 0xFF])
+        return b""  # Line continuation
+    return _ESCAPE.sub(replace, literal[1:-1]).decode("latin-1")
+
+
+def _string_operand(token: bytes) -> str:
+    if token.startswith(b"("):
+        return _unescape(token)
+    hex_digits = re.sub(rb"\s", b"", token[1:-1])
+    return bytes.fromhex((hex_digits + b"0" * (len(hex_digits) % 2)).decode()).decode("latin-1")
+
+
+def _content_fragments(content: bytes, fragments: List[Tuple[float, float, int, str]]):
+    """Append (y, x, order, text) for every string shown by a content stream"""
+    operands: list = []
+    array: Optional[list] = None
+    x = y = line_x = line_y = 0.0
+    for token in _CONTENT_TOKEN.findall(content):
+        first = token[:1]
+        if first in b"(<":
+            (array if array is not None else operands).append(_string_operand(token))
+        elif first == b"[":
+            array = []
+        elif first == b"]":
+            operands.append(array or [])
+            array = None
+        elif first == b"/" or first in b"+-.0123456789":
+            if array is None:
+                operands.append(token)
+        else:
+            op = token
+            if op == b"BT":
+                x = y = line_x = line_y = 0.0
+            elif op == b"Tm" and len(operands) >= 6:
+                x = line_x = float(operands[-2])
+                y = line_y = float(operands[-1])
+            elif op in (b"Td", b"TD") and len(operands) >= 2:
+                line_x += float(operands[-2])
+                line_y += float(operands[-1])
+                x, y = line_x, line_y
+            elif op == b"T*":
+                y = line_y = line_y - 1  # Next line; the leading is not tracked
+            elif op in (b"Tj", b"'", b'"') and operands and isinstance(operands[-1], str):
+                if op != b"Tj":
+                    y = line_y = line_y - 1
+                fragments.append((y, x, len(fragments), operands[-1]))
+            elif op == b"TJ" and operands and isinstance(operands[-1], list):
+                fragments.append((y, x, len(fragments), "".join(s for s in operands[-1] if isinstance(s, str))))
+            operands = []
+
+
+def _decode_stream(dictionary: bytes, stream: bytes, decoders: Dict[bytes, Any]) -> Optional[bytes]:
+    """Apply the stream's filters in order; None for filters used only by images"""
+    match = _FILTER.search(dictionary)
+    for name in re.findall(rb"/(\w+)", match.group(1)) if match else ():
+        decoder = decoders.get(name)
+        if decoder is None:
+            return None
+        try:
+            stream = decoder(stream)
+        except (ValueError, zlib.error):
+            return None
+    return stream
+
+
+def pdf_text(data: bytes, inflate: Optional[_Inflater] = None) -> str:
+    """Text of a PDF with simple fonts, one line per baseline, top to bottom"""
+    inflate = inflate or _Inflater()
+    decoders = {**_DECODERS, b"FlateDecode": inflate, b"Fl": inflate}
+    fragments: List[Tuple[float, float, int, str]] = []
+    for dictionary, stream in _STREAM.findall(data):
+        if re.search(rb"/Subtype\s*/Image|/Length1", dictionary):
+            continue  # Images and embedded fonts carry no text
+        stream = _decode_stream(dictionary, stream, decoders)
+        if stream and b"BT" in stream:
+            _content_fragments(stream, fragments)
+
+    lines: Dict[int, List[Tuple[float, int, str]]] = {}
+    for y, x, order, text in fragments:
+        lines.setdefault(round(y), []).append((x, order, text))
+    return "\n".join(" ".join(text for _, _, text in sorted(parts))
+                     for _, parts in sorted(lines.items(), reverse=True))
+
+
+def png_text(data: bytes, inflate: Optional[_Inflater] = None) -> str:
+    """tEXt, zTXt and iTXt chunks of a PNG"""
+    inflate = inflate or _Inflater()
+    texts, offset = [], 8
+    while offset + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        chunk = data[offset + 8:offset + 8 + length]
+        offset += length + 12
+        try:
+            if kind == b"tEXt":
+                texts.append(chunk.split(b"\0", 1)[1].decode("latin-1"))
+            elif kind == b"zTXt":
+                texts.append(inflate(chunk.split(b"\0", 1)[1][1:]).decode("latin-1"))
+            elif kind == b"iTXt":
+                _, rest = chunk.split(b"\0", 1)
+                compressed, rest = rest[0], rest[2:]
+                text = rest.split(b"\0", 2)[2]
+                texts.append((inflate(text) if compressed else text).decode("utf-8"))
+            elif kind == b"IEND":
+                break
+        except (IndexError, ValueError, zlib.error):
+            continue
+    return "\n".join(texts)
+
+
+def jpeg_text(data: bytes) -> str:
+    """COM segments of a JPEG"""
+    texts, offset = [], 2
+    while offset + 4 <= len(data) and data[offset] == 0xFF:
+        marker = data[offset + 1]
+        if marker == 0xDA:  # Start of scan: no more metadata
+            break
+        length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+        if marker == 0xFE:
+            texts.append(data[offset + 4:offset + 2 + length].decode("utf-8", "replace"))
+        offset += 2 + length
+    return "\n".join(texts)
+
+
+def extract_text(data: bytes) -> Tuple[Optional[str], str]:
+    """(format, text) of an uploaded file; format is None when it is not supported"""
+    if data.startswith(b"%PDF"):
+        return "pdf", pdf_text(data)
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png", png_text(data)
+    if data.startswith(b"\xff\xd8"):
+        return "jpeg", jpeg_text(data)
+    return None, ""
+
+
+# Field extraction
+
+_AMOUNT = re.compile(r"(₹|Rs\.?|INR)?\s*([0-9][0-9,]*(?:\.[0-9]{1,2})?)")
+_GROSS = re.compile(r"\b(?:gross\s*(?:salary|earnings|pay|total)?|total\s*earnings)\b[^\n]*", re.I)
+_NET = re.compile(r"\b(?:net\s*(?:pay(?:able)?|salary|amount)|take[\s-]*home(?:\s*pay)?)\b[^\n]*", re.I)
+_EMPLOYER = re.compile(r"\b(?:employer|company|organi[sz]ation)(?:\s*name)?\s*[:\-]\s*(.+)", re.I)
+_COMPANY_SUFFIX = re.compile(r"\b(?:pvt\.?|private|ltd\.?|limited|llp|inc\.?|corporation)\b", re.I)
+
+
+def _amount(label: re.Pattern, text: str) -> Optional[int]:
+    """First amount after the label on its line, skipping things like "Dec 2023" """
+    for match in label.finditer(text):
+        for amount in _AMOUNT.finditer(match.group(0)):
+            currency, digits = amount.groups()
+            if not currency and digits.isdigit() and 1900 <= int(digits) <= 2100:
+                continue
+            value = float(digits.replace(",", ""))
+            if value > 0:
+                return round(value)
+    return None
+
+
+def _employer(text: str) -> Optional[str]:
+    match = _EMPLOYER.search(text)
+    if match:
+        return match.group(1).strip()[:120] or None
+    for line in text.splitlines():
+        if _COMPANY_SUFFIX.search(line) and not re.search(r"\d{3,}", line):
+            return line.strip()[:120]
+    return None
+
+
+def parse_salary_slip(data: bytes) -> Dict[str, Any]:
+    """Parse one slip; runs in a worker process, so it takes and returns plain data"""
+    try:
+        kind, text = extract_text(data)
+    except InflateLimitExceeded:
+        return {"status": SLIP_UNREADABLE, "format": None, "gross_salary": None, "net_salary": None,
+                "employer": None, "error": "too_large"}
+    except Exception:  # A malformed upload must not take the worker down
+        logger.exception("Salary slip text extraction failed")
+        kind, text = None, ""
+
+    gross, net = _amount(_GROSS, text), _amount(_NET, text)
+    if gross and net and net > gross:
+        gross, net = net, gross  # Labels picked up the wrong way round
+    if not text.strip():
+        status = SLIP_UNREADABLE
+    else:
+        status = SLIP_PARSED if gross or net else SLIP_INCOMPLETE
+    return {
+        "status": status,
+        "format": kind,
+        "gross_salary": gross,
+        "net_salary": net,
+        "employer": _employer(text) if text else None,
+    }
+
+
+# Pool and cache
+
+def _unreadable(content_hash: str, error: str) -> Dict[str, Any]:
+    return {"status": SLIP_UNREADABLE, "format": None, "gross_salary": None, "net_salary": None,
+            "employer": None, "content_hash": content_hash, "error": error}
+
+
+class SalarySlipParser:
+    def __init__(self, workers: int = 2, cache_size: int = 1024, timeout: float = 20.0,
+                 max_bytes: int = 5 * 1024 * 1024, executor: Optional[Executor] = None):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.executor = executor  # Defaults to a process pool started on first use
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "SalarySlipParser":
+        return cls(
+            workers=int(os.getenv("SALARY_SLIP_WORKERS", "2")),
+            cache_size=int(os.getenv("SALARY_SLIP_CACHE_SIZE", "1024")),
+            timeout=float(os.getenv("SALARY_SLIP_TIMEOUT_SECONDS", "20")),
+            max_bytes=int(os.getenv("SALARY_SLIP_MAX_BYTES", str(5 * 1024 * 1024))),
+        )
+
+    def _executor(self) -> Executor:
+        if self.executor is not None:
+            return self.executor
+        if self._pool is None:
+            # Spawned, not forked: the server process has threads and open sockets
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def cached(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        result = self._results.get(content_hash)
+        if result is not None:
+            self._results.move_to_end(content_hash)
+        return result
+
+    async def parse(self, data: bytes) -> Dict[str, Any]:
+        """Parsed fields plus ``content_hash`` and whether the result came from the cache"""
+        content_hash = hashlib.sha256(data).hexdigest()
+        result = self.cached(content_hash)
+        if result is not None:
+            return {**result, "cached": True}
+        if len(data) > self.max_bytes:
+            return {**_unreadable(content_hash, "too_large"), "cached": False}
+
+        # Concurrent uploads of the same file share one parse
+        future = self._in_flight.get(content_hash)
+        if future is None:
+            future = asyncio.ensure_future(self._parse(content_hash, data))
+            self._in_flight[content_hash] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(content_hash, None))
+        return {**await asyncio.shield(future), "cached": False}
+
+    async def _parse(self, content_hash: str, data: bytes) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        # A second attempt only when the pool broke or was replaced for another parse
+        for _ in range(2):
+            executor = self._executor()
+            try:
+                call = loop.run_in_executor(executor, parse_salary_slip, data)
+            except BrokenProcessPool:
+                self._replace_pool(executor)  # A worker died before this file reached it
+                continue
+            try:
+                result = await asyncio.wait_for(call, self.timeout)
+                break
+            except asyncio.TimeoutError:
+                # Not cached: a busy pool is not the file's fault
+                logger.warning("Salary slip %s took longer than %.0fs to parse", content_hash[:12], self.timeout)
+                # The worker is still on it; stop it so it doesn't hold a slot for good
+                self._replace_pool(executor, terminate=True)
+                return _unreadable(content_hash, "timeout")
+            except BrokenProcessPool:
+                if executor is self._pool:
+                    logger.error("A salary slip worker died parsing %s; restarting the pool", content_hash[:12])
+                    self._replace_pool(executor)
+                    return _unreadable(content_hash, "worker_crashed")
+        else:
+            return _unreadable(content_hash, "worker_crashed")
+        result["content_hash"] = content_hash
+        self._results[content_hash] = result
+        while len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return result
+
+    def _replace_pool(self, pool: Executor, terminate: bool = False):
+        """Drop a broken or stuck pool; the next parse starts a new one"""
+        if pool is not self._pool:
+            return  # Already replaced, or an executor we were given
+        self._pool = None
+        if terminate:
+            # ProcessPoolExecutor can't cancel a running call, so end its processes;
+            # other parses on them fail over to the new pool
+            for process in list((getattr(pool, "_processes", None) or {}).values()):
+                process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_salary_slip_parser: Optional[SalarySlipParser] = None
+
+
+def get_salary_slip_parser() -> SalarySlipParser:
+    """Process-wide salary slip parser, configured from the environment on first use"""
+    global _salary_slip_parser
+    if _salary_slip_parser is None:
+        _salary_slip_parser = SalarySlipParser.from_env()
+    return _salary_slip_parser
@@ -1,159 +1,325 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, List, Optional
 from datetime import datetime, timedelta
+from array import array
 import json
+import logging
+import os
+import sys
+import time
+
+from utils.archive_index import get_archive_index
+from utils.job_queue import PRIORITY_LOW, job
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = "session_archives"
+
+# Agents that may keep per-session state
+AGENT_NAMES = ("master", "sales", "verification", "underwriting", "sanction")
+
+# Fields update_session can replace
+UPDATABLE_FIELDS = ("user_context", "conversation_state", "agent_states")
+
+# Stored, archived and indexed in place of an OTP, whether the bot showed it or the user typed it
+OTP_REDACTED = "[otp]"
+
+
+def _now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def _isoformat(timestamp_ms: int) -> str:
+    return datetime.fromtimestamp(timestamp_ms / 1000).isoformat()
+
+
+class ConversationHistory:
+    """Messages stored column-wise: one int64 per timestamp and a pointer per field.
+
+    Senders are interned, so every "user"/"bot" entry shares one string, and
+    empty metadata is stored as None. Dicts with ISO timestamps are only built
+    when the history is read or archived.
+    """
+    __slots__ = ("timestamps", "senders", "contents", "metadata")
 
-class SessionManager:
     def __init__(self):
-        self.sessions: Dict[str, Dict[str, Any]] = {}
-        self.session_timeout = timedelta(hours=2)  # 2 hour timeout
-    
-    def create_session(self, session_id: str) -> Dict[str, Any]:
-        """Create a new session"""
-        session_data = {
-            "session_id": session_id,
-            "created_at": datetime.now(),
-            "last_activity": datetime.now(),
-            "conversation_state": "greeting",
-            "user_context": {},
-            "conversation_history": [],
-            "agent_states": {
-                "master": {},
-                "sales": {},
-                "verification": {},
-                "underwriting": {},
-                "sanction": {}
-            }
+        self.timestamps = array("q")  # Epoch milliseconds
+        self.senders: List[str] = []
+        self.contents: List[str] = []
+        self.metadata: List[Optional[Dict[str, Any]]] = []
+
+    def append(self, sender: str, content: str, metadata: Optional[Dict[str, Any]] = None,
+               timestamp_ms: Optional[int] = None):
+        self.timestamps.append(timestamp_ms or _now_ms())
+        self.senders.append(sys.intern(sender))
+        self.contents.append(content)
+        self.metadata.append(metadata or None)
+
+    def message(self, index: int) -> Dict[str, Any]:
+        message = {"sender": self.senders[index], "content": self.contents[index]}
+        if self.metadata[index] is not None:
+            message["metadata"] = self.metadata[index]
+        message["timestamp"] = _isoformat(self.timestamps[index])
+        return message
+
+    def to_list(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        start = max(len(self) - limit, 0) if limit else 0
+        return [self.message(i) for i in range(start, len(self))]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return (self.message(i) for i in range(len(self)))
+
+
+class AgentStates:
+    __slots__ = AGENT_NAMES
+
+    def __init__(self):
+        for name in AGENT_NAMES:
+            setattr(self, name, None)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {name: getattr(self, name) or {} for name in AGENT_NAMES}
+
+
+class Session:
+    """One conversation; the context, history and agent states are created on first use"""
+    __slots__ = ("session_id", "created_at", "last_activity", "ended_at", "conversation_state",
+                 "_user_context", "_history", "_agent_states")
+
+    def __init__(self, session_id: str, now_ms: Optional[int] = None):
+        self.session_id = session_id
+        self.created_at = self.last_activity = now_ms or _now_ms()  # Epoch milliseconds
+        self.ended_at: Optional[int] = None
+        self.conversation_state = "greeting"
+        self._user_context: Optional[Dict[str, Any]] = None
+        self._history: Optional[ConversationHistory] = None
+        self._agent_states: Optional[AgentStates] = None
+
+    @property
+    def user_context(self) -> Dict[str, Any]:
+        if self._user_context is None:
+            self._user_context = {}
+        return self._user_context
+
+    @property
+    def conversation_history(self) -> ConversationHistory:
+        if self._history is None:
+            self._history = ConversationHistory()
+        return self._history
+
+    @property
+    def agent_states(self) -> AgentStates:
+        if self._agent_states is None:
+            self._agent_states = AgentStates()
+        return self._agent_states
+
+    @property
+    def message_count(self) -> int:
+        return len(self._history) if self._history is not None else 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "created_at": _isoformat(self.created_at),
+            "last_activity": _isoformat(self.last_activity),
+            "conversation_state": self.conversation_state,
+            "user_context": dict(self._user_context or {}),
+            "conversation_history": self._history.to_list() if self._history is not None else [],
+            "agent_states": (self._agent_states or AgentStates()).to_dict(),
         }
-        
-        self.sessions[session_id] = session_data
-        return session_data
-    
-    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        """Get session data"""
-        if session_id in self.sessions:
-            session = self.sessions[session_id]
-            
+
+
+@job("session.archive", priority=PRIORITY_LOW, retries=3)
+def write_session_archive(archive_data: Dict[str, Any]):
+    """Mock: Save to file (in production use proper database)"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with open(os.path.join(ARCHIVE_DIR, f"{archive_data['session_id']}.json"), "w") as f:
+        json.dump(archive_data, f, indent=2)
+    # The archive is already on disk; a failure here only keeps it out of support search
+    try:
+        get_archive_index().add(archive_data)
+    except Exception:
+        logger.exception("Failed to index session %s", archive_data["session_id"])
+
+
+class SessionManager:
+    def __init__(self, jobs=None):
+        self.sessions: Dict[str, Session] = {}
+        # The OTP last shown in each session, only to recognise the user typing it back
+        self._shown_otps: Dict[str, str] = {}
+        # With a job queue, archives are written in the background instead of inline
+        self.jobs = jobs
+        self.session_timeout_ms = int(timedelta(hours=2).total_seconds() * 1000)  # 2 hour timeout
+
+    def create_session(self, session_id: str) -> Session:
+        """Create a new session"""
+        session = Session(session_id)
+        self.sessions[session_id] = session
+        return session
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        """Get a live session, or None if it does not exist or has expired.
+
+        Returns the Session record itself (attribute access, changes are kept);
+        ``to_dict()`` gives the plain dict sessions used to be stored as.
+        """
+        session = self.sessions.get(session_id)
+        if session is not None:
+            now = _now_ms()
             # Check if session has expired
-            if datetime.now() - session["last_activity"] > self.session_timeout:
+            if now - session.last_activity > self.session_timeout_ms:
                 self.end_session(session_id)
                 return None
-            
+
             # Update last activity
-            session["last_activity"] = datetime.now()
+            session.last_activity = now
             return session
-        
+
         return None
-    
+
     def update_session(self, session_id: str, updates: Dict[str, Any]) -> bool:
-        """Update session data"""
-        if session_id in self.sessions:
-            self.sessions[session_id].update(updates)
-            self.sessions[session_id]["last_activity"] = datetime.now()
+        """Replace session fields: ``user_context``, ``conversation_state`` or ``agent_states``.
+
+        Sessions are fixed records, so any other field raises KeyError rather
+        than being stored where nothing reads it.
+        """
+        session = self.sessions.get(session_id)
+        if session is not None:
+            for field in updates:
+                if field not in UPDATABLE_FIELDS:
+                    raise KeyError(f"unknown session field {field!r}")
+            for field, value in updates.items():
+                if field == "user_context":
+                    session._user_context = dict(value)
+                elif field == "conversation_state":
+                    session.conversation_state = sys.intern(value)
+                else:
+                    for name in AGENT_NAMES:
+                        setattr(session.agent_states, name, value.get(name) or None)
+            session.last_activity = _now_ms()
             return True
         return False
-    
+
     def add_message(self, session_id: str, message: Dict[str, Any]) -> bool:
-        """Add message to conversation history"""
-        if session_id in self.sessions:
-            self.sessions[session_id]["conversation_history"].append({
-                **message,
-                "timestamp": datetime.now().isoformat()
-            })
-            self.sessions[session_id]["last_activity"] = datetime.now()
+        """Add message (sender, content and optional metadata) to conversation history.
+
+        OTPs are never stored: a bot message's ``otp`` metadata is dropped and
+        the code replaced by OTP_REDACTED in its content, as is a user message
+        that is the code shown.
+        """
+        session = self.sessions.get(session_id)
+        if session is not None:
+            now = _now_ms()
+            content, metadata = message["content"], message.get("metadata")
+            if metadata and metadata.get("otp"):
+                otp = self._shown_otps[session_id] = str(metadata["otp"])
+                metadata = {key: value for key, value in metadata.items() if key != "otp"}
+                content = content.replace(otp, OTP_REDACTED)
+            elif session_id in self._shown_otps and content.strip() == self._shown_otps[session_id]:
+                content = OTP_REDACTED
+            session.conversation_history.append(message["sender"], content, metadata, now)
+            session.last_activity = now
             return True
         return False
-    
+
     def update_context(self, session_id: str, context_updates: Dict[str, Any]) -> bool:
         """Update user context"""
-        if session_id in self.sessions:
-            self.sessions[session_id]["user_context"].update(context_updates)
-            self.sessions[session_id]["last_activity"] = datetime.now()
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.user_context.update(context_updates)
+            session.last_activity = _now_ms()
             return True
         return False
-    
+
     def update_conversation_state(self, session_id: str, new_state: str) -> bool:
         """Update conversation state"""
-        if session_id in self.sessions:
-            self.sessions[session_id]["conversation_state"] = new_state
-            self.sessions[session_id]["last_activity"] = datetime.now()
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.conversation_state = sys.intern(new_state)
+            session.last_activity = _now_ms()
             return True
         return False
-    
+
     def update_agent_state(self, session_id: str, agent_name: str, agent_state: Dict[str, Any]) -> bool:
         """Update specific agent state"""
-        if session_id in self.sessions:
-            self.sessions[session_id]["agent_states"][agent_name] = agent_state
-            self.sessions[session_id]["last_activity"] = datetime.now()
+        session = self.sessions.get(session_id)
+        if session is not None and agent_name in AGENT_NAMES:
+            setattr(session.agent_states, agent_name, agent_state)
+            session.last_activity = _now_ms()
             return True
         return False
-    
+
     def get_conversation_history(self, session_id: str, limit: int = 50) -> list:
         """Get conversation history"""
-        if session_id in self.sessions:
-            history = self.sessions[session_id]["conversation_history"]
-            return history[-limit:] if limit else history
+        session = self.sessions.get(session_id)
+        if session is not None and session.message_count:
+            return session.conversation_history.to_list(limit)
         return []
-    
+
     def end_session(self, session_id: str) -> bool:
         """End and cleanup session"""
         if session_id in self.sessions:
             # Log session end
             session = self.sessions[session_id]
-            session["ended_at"] = datetime.now()
-            
+            session.ended_at = _now_ms()
+
             # Archive session (in production, save to database)
             self._archive_session(session)
-            
+
             # Remove from active sessions
             del self.sessions[session_id]
+            self._shown_otps.pop(session_id, None)
             return True
         return False
-    
+
     def cleanup_expired_sessions(self):
         """Clean up expired sessions"""
-        current_time = datetime.now()
-        expired_sessions = []
-        
-        for session_id, session in self.sessions.items():
-            if current_time - session["last_activity"] > self.session_timeout:
-                expired_sessions.append(session_id)
-        
+        cutoff = _now_ms() - self.session_timeout_ms
+        expired_sessions = [session_id for session_id, session in self.sessions.items()
+                            if session.last_activity < cutoff]
+
         for session_id in expired_sessions:
             self.end_session(session_id)
-    
+
     def get_active_sessions_count(self) -> int:
         """Get count of active sessions"""
         return len(self.sessions)
-    
+
     def get_session_stats(self, session_id: str) -> Dict[str, Any]:
         """Get session statistics"""
         if session_id in self.sessions:
             session = self.sessions[session_id]
-            
+
             return {
                 "session_id": session_id,
-                "duration": str(datetime.now() - session["created_at"]),
-                "message_count": len(session["conversation_history"]),
-                "current_state": session["conversation_state"],
-                "last_activity": session["last_activity"].isoformat()
+                "duration": str(timedelta(milliseconds=_now_ms() - session.created_at)),
+                "message_count": session.message_count,
+                "current_state": session.conversation_state,
+                "last_activity": _isoformat(session.last_activity)
             }
         return {}
-    
-    def _archive_session(self, session: Dict[str, Any]):
+
+    def _archive_session(self, session: Session):
         """Archive completed session (mock implementation)"""
         # In production, this would save to database
         archive_data = {
-            "session_id": session["session_id"],
-            "created_at": session["created_at"].isoformat(),
-            "ended_at": session.get("ended_at", datetime.now()).isoformat(),
-            "final_state": session["conversation_state"],
-            "message_count": len(session["conversation_history"]),
-            "user_context": session["user_context"]
+            "session_id": session.session_id,
+            "created_at": _isoformat(session.created_at),
+            "ended_at": _isoformat(session.ended_at or _now_ms()),
+            "final_state": session.conversation_state,
+            "message_count": session.message_count,
+            "user_context": session._user_context or {},
+            "conversation_history": session._history.to_list() if session._history is not None else []
         }
-        
-        # Mock: Save to file (in production use proper database)
+
+        if self.jobs is not None:
+            # Session ids are reused across visits (reconnects); each visit is archived once
+            self.jobs.enqueue("session.archive", archive_data,
+                              idempotency_key=f"archive:{session.session_id}:{session.created_at}")
+            return
         try:
-            with open(f"session_archives/{session['session_id']}.json", "w") as f:
-                json.dump(archive_data, f, indent=2)
-        except:
-            pass  # Ignore file errors in demo
\ No newline at end of file
+            write_session_archive(archive_data)
+        except OSError:
+            logger.exception("Failed to archive session %s", session.session_id)
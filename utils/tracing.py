@@ -0,0 +1,305 @@
+"""
+Lightweight per-turn tracing.
+
+Spans are propagated through ``contextvars`` so nested ``tracer.span(...)``
+blocks (including across ``await`` and tasks spawned inside them) link up
+into one trace per turn. Sampling is decided once per trace at the root
+span. With sampling off, ``tracer.span()`` hands back a shared no-op span
+and touches no context variables, so instrumentation costs next to nothing.
+
+Finished spans go to exporters: an in-memory ring buffer for the admin
+endpoint and a file exporter writing OTLP/JSON (one ExportTraceServiceRequest
+per line) that collectors can ingest. The file exporter hands full batches to
+a writer thread, so spans ending on the event loop never wait on disk.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
+
+SERVICE_NAME = "tata-capital-loan-chatbot"
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name",
+                 "start_ns", "end_ns", "attributes", "error", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_ns = 0
+        self.end_ns = 0
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        self.tracer._export(self)
+        return False
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Returned when a trace is not sampled; every operation does nothing"""
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+class _UnsampledRoot(_NoopSpan):
+    """Marks the context of an unsampled trace so its child spans are skipped too"""
+    __slots__ = ("_token",)
+
+    def __enter__(self) -> "_UnsampledRoot":
+        self._token = _current_span.set(_NOOP_SPAN)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        _current_span.reset(self._token)
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_current_span: ContextVar[Optional[Any]] = ContextVar("current_span", default=None)
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class RingBufferExporter:
+    """Keeps the most recent finished spans in memory"""
+
+    def __init__(self, capacity: int = 2000):
+        self.spans: deque = deque(maxlen=capacity)
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+    def recent_traces(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most recent traces first, each with its spans in start order"""
+        traces: Dict[str, List[Span]] = {}
+        for span in reversed(self.spans):
+            if span.trace_id not in traces:
+                if len(traces) == limit:
+                    break
+                traces[span.trace_id] = []
+            traces[span.trace_id].append(span)
+
+        return [
+            {"trace_id": trace_id,
+             "spans": [span.to_dict() for span in sorted(spans, key=lambda s: s.start_ns)]}
+            for trace_id, spans in traces.items()
+        ]
+
+
+class OTLPFileExporter:
+    """Appends spans to a file as OTLP/JSON, one export request per line.
+
+    Batches are encoded and written by a background thread; up to
+    ``max_pending`` batches wait for it, after which new ones are dropped.
+    """
+
+    def __init__(self, path: str, batch_size: int = 64, max_pending: int = 64):
+        self.path = path
+        self.batch_size = batch_size
+        self._batch: List[Span] = []
+        self._lock = threading.Lock()
+        self._pending: "queue.Queue[List[Span]]" = queue.Queue(max_pending)
+        self._writer: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    def export(self, span: Span):
+        with self._lock:
+            self._batch.append(span)
+            if len(self._batch) < self.batch_size:
+                return
+            batch, self._batch = self._batch, []
+        self._submit(batch)
+
+    def flush(self):
+        """Write out every span exported so far; blocks until the writer has caught up"""
+        with self._lock:
+            batch, self._batch = self._batch, []
+        if batch:
+            self._submit(batch)
+        if self._writer is not None:
+            self._pending.join()
+
+    def _submit(self, batch: List[Span]):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run, name="otlp-file-exporter", daemon=True)
+                    self._writer.start()
+        try:
+            self._pending.put_nowait(batch)
+        except queue.Full:
+            self.dropped += len(batch)
+
+    def _run(self):
+        while True:
+            batch = self._pending.get()
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Failed to write %d spans to %s", len(batch), self.path)
+            finally:
+                self._pending.task_done()
+
+    def _write(self, batch: List[Span]):
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": "utils.tracing"},
+                    "spans": [span.to_otlp() for span in batch],
+                }],
+            }]
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(request, separators=(",", ":")) + "\n")
+
+
+class Tracer:
+    def __init__(self, sample_rate: float = 0.0, exporters: Optional[List[Any]] = None):
+        self.sample_rate = sample_rate
+        self.exporters = exporters or []
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """TRACE_SAMPLE_RATE (0-1, default 0) and optional TRACE_EXPORT_FILE"""
+        exporters: List[Any] = [RingBufferExporter(int(os.getenv("TRACE_BUFFER_SIZE", "2000")))]
+        if os.getenv("TRACE_EXPORT_FILE"):
+            exporters.append(OTLPFileExporter(os.getenv("TRACE_EXPORT_FILE")))
+        return cls(float(os.getenv("TRACE_SAMPLE_RATE", "0")), exporters)
+
+    def span(self, name: str, **attributes):
+        """Start a span as a child of the current one, or a new (sampled) trace"""
+        if not self.sample_rate:
+            return _NOOP_SPAN
+
+        parent = _current_span.get()
+        if parent is None:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return _UnsampledRoot()
+            return Span(self, name, f"{random.getrandbits(128):032x}", None, attributes)
+        if parent is _NOOP_SPAN:
+            return _NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def current_span(self):
+        """The active span, or a no-op span outside of a sampled trace"""
+        return _current_span.get() or _NOOP_SPAN
+
+    @property
+    def ring_buffer(self) -> Optional[RingBufferExporter]:
+        for exporter in self.exporters:
+            if isinstance(exporter, RingBufferExporter):
+                return exporter
+        return None
+
+    def flush(self):
+        for exporter in self.exporters:
+            if hasattr(exporter, "flush"):
+                exporter.flush()
+
+    def _export(self, span: Span):
+        for exporter in self.exporters:
+            exporter.export(span)
+
+
+tracer = Tracer.from_env()
+
+
+def traced(name: str):
+    """Run the decorated function (sync or async) inside a span called ``name``"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not tracer.sample_rate:
+                    return await func(*args, **kwargs)
+                with tracer.span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.sample_rate:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator